@@ -0,0 +1,191 @@
+"""Pick the highest quality settings that fit a wall-clock budget, from the run history.
+
+A cost model is fitted per stage on the successful runs in the run history (see
+run_history.py): log seconds against the effective subdivision level, log key count,
+relaxed_mesh, geode_mode and the loligagger, magnet and switch support features, with a
+small ridge penalty. Every combination of the quality parameters (body_subsurf_level, then
+relaxed_mesh) is predicted for the given design and the best one whose prediction plus a
+safety margin fits the budget is chosen:
+
+    python src/autotune.py --budget 3m
+    python src/autotune.py overrides.json --budget 600 --blender /path/to/blender --output-dir out
+    python src/autotune.py overrides.json --budget 10m --spool /tmp/dm-spool
+
+The remaining parameters, features included, come from the overrides file and are kept.
+Subdivision levels are only extrapolated one level past the recorded ones, and only once two
+levels have been recorded. With --blender (a one-shot worker) or --spool (a running worker
+pool) the chosen design is generated and the actual time is reported next to the prediction.
+The exit status is 1 when no setting fits the budget.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from itertools import product
+from math import log
+
+import numpy as np
+
+import key_layout
+import run_history
+import worker
+
+
+# Quality parameters in order of importance, each from lowest to highest quality
+quality_parameters = {'body_subsurf_level': [0, 1, 2, 3, 4, 5],
+                      'relaxed_mesh': [False, True]}
+
+feature_flags = ['relaxed_mesh', 'geode_mode', 'loligagger_port', 'magnet_bottom', 'switch_support']
+
+
+
+################
+## Cost Model ##
+################
+
+def effective_subsurf(parameters: dict) -> int:
+    """The body subdivision level the generator uses, geode mode forces 3."""
+    return 3 if parameters['geode_mode'] else parameters['body_subsurf_level']
+
+
+def features(parameters: dict) -> np.ndarray:
+    keys = len(key_layout.key_frames(parameters)['positions'])
+    return np.array([1, effective_subsurf(parameters), log(keys)] + [float(bool(parameters[flag])) for flag in feature_flags])
+
+
+def fit_cost_model(runs: list, ridge: float = 1e-2) -> dict:
+    """Per stage least squares of log seconds on the run features, over the runs that had the stage."""
+    defaults = key_layout.resolve_parameters({})
+    rows = []
+    for run in runs:
+        parameters = dict(defaults, **run['parameters'])
+        rows.append((features(parameters), {flag: bool(parameters[flag]) for flag in feature_flags}, run['stages']))
+
+    stages = []
+    for _, _, run_stages in rows:
+        stages += [stage for stage in run_stages if stage not in stages]
+    model = {'stages': {}, 'subsurf_levels': sorted({int(x[1]) for x, _, _ in rows}), 'runs': len(rows)}
+    for stage in stages:
+        x = np.array([x for x, _, run_stages in rows if stage in run_stages])
+        y = np.log(np.maximum([run_stages[stage] for _, _, run_stages in rows if stage in run_stages], 1e-3))
+        penalty = ridge * np.eye(x.shape[1])
+        penalty[0, 0] = 0
+        coefficients = np.linalg.solve(x.T @ x + penalty, x.T @ y)
+
+        # A stage gated on a feature (e.g. magnet_bottom) never ran with the other value of it
+        values = {flag: {flags[flag] for _, flags, run_stages in rows if stage in run_stages} for flag in feature_flags}
+        gates = {flag: value.pop() for flag, value in values.items()
+                 if len(value) == 1 and any(flags[flag] not in value for _, flags, _ in rows)}
+        model['stages'][stage] = {'coefficients': coefficients, 'sigma': float(np.std(y - x @ coefficients)), 'runs': len(y), 'gates': gates}
+    return model
+
+
+def predict(model: dict, parameters: dict) -> dict:
+    x = features(parameters)
+    stages = {stage: float(np.exp(x @ fit['coefficients'])) for stage, fit in model['stages'].items()
+              if all(bool(parameters[flag]) == value for flag, value in fit['gates'].items())}
+    return {'stages': stages, 'total': sum(stages.values())}
+
+
+
+############
+## Tuning ##
+############
+
+def candidate_levels(model: dict) -> list:
+    recorded = model['subsurf_levels']
+    if len(recorded) < 2:
+        return recorded
+    return [level for level in quality_parameters['body_subsurf_level'] if recorded[0] - 1 <= level <= recorded[-1] + 1]
+
+
+def tune(model: dict, overrides: dict, budget: float, margin: float) -> tuple:
+    """Predictions of every quality candidate, best first, and the best one that fits (or None)."""
+    candidates = []
+    for level, relaxed in product(candidate_levels(model), quality_parameters['relaxed_mesh']):
+        settings = {'body_subsurf_level': level, 'relaxed_mesh': relaxed}
+        parameters = key_layout.resolve_parameters(dict(overrides, **settings))
+        prediction = predict(model, parameters)
+        candidates.append({'settings': settings, 'predicted': prediction['total'], 'stages': prediction['stages'],
+                           'fits': prediction['total'] * (1 + margin) <= budget})
+    candidates.sort(key=lambda candidate: [quality_parameters[name].index(value) for name, value in candidate['settings'].items()], reverse=True)
+    return candidates, next((candidate for candidate in candidates if candidate['fits']), None)
+
+
+def parse_budget(text: str) -> float:
+    """Seconds from '180', '90s', '3m' or '1.5h'."""
+    units = {'s': 1, 'm': 60, 'h': 3600}
+    if text[-1:].lower() in units:
+        return float(text[:-1]) * units[text[-1].lower()]
+    return float(text)
+
+
+def generate(job: dict, blender: str = None, spool: str = None) -> dict:
+    """Run the job on a worker pool spool or a one-shot background Blender and return its result."""
+    if spool:
+        return worker.submit(spool, job, wait=True)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, str(job['id']) + '.json')
+        worker.write_json(path, job)
+        subprocess.check_call(worker.blender_command(blender, ['--job', path]))
+        with open(os.path.splitext(path)[0] + '.result.json') as handle:
+            return json.load(handle)
+
+
+def main(argv: list) -> int:
+    parser = argparse.ArgumentParser(description="Time-budget auto-tuner for the quality parameters")
+    parser.add_argument('overrides', nargs='?', help="JSON file of parameter overrides (or a worker job with 'parameters')")
+    parser.add_argument('--budget', required=True, help="wall-clock budget, e.g. 180, 90s, 3m or 1.5h")
+    parser.add_argument('--margin', type=float, default=0.1, help="safety margin on the prediction, as a fraction")
+    parser.add_argument('--db', default=run_history.default_run_history_path, help="run history database")
+    parser.add_argument('--days', type=float, default=90, help="fit on runs from the last DAYS days")
+    parser.add_argument('--blender', help="generate the chosen design in a background Blender")
+    parser.add_argument('--spool', help="generate the chosen design on a worker pool spool")
+    parser.add_argument('--output-dir', default=os.path.join(tempfile.gettempdir(), 'blended-dm-autotune'))
+    parser.add_argument('--json', action='store_true', help="print the candidates and result as JSON")
+    args = parser.parse_args(argv)
+
+    overrides = {}
+    if args.overrides:
+        with open(args.overrides) as handle:
+            overrides = json.load(handle)
+        overrides = overrides.get('parameters', overrides)
+    overrides = {name: value for name, value in overrides.items() if name not in quality_parameters}
+    budget = parse_budget(args.budget)
+
+    runs = [run for run in run_history.load_runs(args.db, args.days) if run['status'] == 'ok']
+    if not runs:
+        print("no successful runs in", args.db, "to fit the cost model on")
+        return 1
+    model = fit_cost_model(runs)
+    candidates, chosen = tune(model, overrides, budget, args.margin)
+    report = {'budget': budget, 'runs': model['runs'], 'candidates': candidates, 'chosen': chosen}
+
+    if not args.json:
+        print("cost model fitted on {} runs, subsurf levels {}".format(model['runs'], model['subsurf_levels']))
+        for candidate in candidates:
+            print("    subsurf {body_subsurf_level} relaxed {relaxed_mesh!s:5}".format(**candidate['settings']),
+                  "predicted {:7.1f} s".format(candidate['predicted']), "fits" if candidate['fits'] else "")
+        print("chosen:", json.dumps(chosen['settings']) if chosen else "nothing fits {:.0f} s".format(budget))
+
+    if chosen and (args.blender or args.spool):
+        job = {'id': 'autotune_' + '_'.join(str(value) for value in chosen['settings'].values()),
+               'parameters': dict(overrides, **chosen['settings']), 'output_dir': args.output_dir}
+        result = generate(job, args.blender, args.spool)
+        actual = {entry['stage']: entry['seconds'] for entry in result['telemetry'].get('stages', [])}
+        report['result'] = {'status': result['status'], 'outputs': result['outputs'], 'actual': result['telemetry'].get('total'), 'stages': actual}
+        if not args.json:
+            print("generated", result['status'], "in {} s, predicted {:.1f} s, budget {:.0f} s".format(result['telemetry'].get('total'), chosen['predicted'], budget))
+            for stage, seconds in chosen['stages'].items():
+                print("    {:40s} predicted {:7.1f} s  actual {}".format(stage, seconds, "-" if stage not in actual else "{:.1f} s".format(actual[stage])))
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    return 0 if chosen else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
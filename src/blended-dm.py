@@ -1,12 +1,29 @@
 import bpy
 import bmesh
+import hashlib
+import json
 import os
+import sqlite3
 import sys
+import tempfile
 import time
 import mathutils
+from mathutils.bvhtree import BVHTree
+import numpy as np
+from dataclasses import dataclass
 from math import pi, radians, sin, cos
 from contextlib import contextmanager
 
+# Blender-free modules next to this file; run from Blender's text editor without them, the
+# generation keeps no run history
+generator_dir = os.path.dirname(os.path.abspath(globals().get('__file__', '')))
+if generator_dir not in sys.path:
+    sys.path.insert(0, generator_dir)
+try:
+    import run_history
+except ImportError:
+    run_history = None
+
 #Hides select Blender console output 
 @contextmanager
 def suppress_stdout():
@@ -18,21 +35,267 @@ def suppress_stdout():
         finally:
             sys.stdout = old_stdout
 
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Peak resident memory in MB so far (kilobytes on Linux, unavailable on Windows)
+def peak_memory():
+    if resource is None:
+        return None
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+#Prints stage progress and records its start time for telemetry (see worker.py)
+stage_log = []
+def stage(name: str, note: str = ""):
+    if stage_hook is not None:
+        stage_hook(name, globals())
+    if not stage_log:
+        setup_scene()
+    stage_log.append({'stage': name, 'start': time.time()-start_time, 'peak_memory': peak_memory()})
+    if len(stage_log) == 1 and profile_operators:
+        operator_profiler.install()
+    operator_profiler.stage(name)
+    print("{:.2f}".format(stage_log[-1]['start']), "- " + name + note + progress.stage(name))
+    if name == "DONE":
+        progress.finish()
+        operator_profiler.finish()
+
+
+# Stage and step timings of earlier runs of the same layout in the run history (run_history.py)
+# give the ETA. Drivers can set progress_file (e.g. through parameter_overrides) to receive every
+# progress update as a JSON line, and run_history_path to keep the history elsewhere.
+run_history_path = None             # None for default_run_history_path
+progress_history_runs = 5
+progress_file = None
+
+# Drivers can also set stage_hook, called as stage_hook(name, globals()) before each stage starts;
+# variant_tree.py forks the run there and changes parameters that no earlier stage has read.
+stage_hook = None
+
+def mean(values):
+    return sum(values) / len(values) if values else None
+
+def format_eta(seconds):
+    return "" if seconds is None else " (ETA {:.0f} s)".format(seconds)
+
+class Progress:
+    def __init__(self):
+        self.signature = None
+        self.runs = []
+        self.current = None
+        self.steps = {}
+        self.step_started = None
+
+    def load(self):
+        self.signature = run_history.layout_signature(run_parameters) if run_history else ""
+        try:
+            self.runs = run_history.recent_runs(run_history_path or run_history.default_run_history_path, self.signature, progress_history_runs) if run_history else []
+        except (OSError, sqlite3.Error):
+            self.runs = []
+
+    def expected_stage(self, name: str):
+        return mean([run['stages'][name] for run in self.runs if name in run['stages']])
+
+    def expected_steps(self, name: str, count: int):
+        runs = [run['steps'][name] for run in self.runs if len(run['steps'].get(name, [])) == count]
+        return [mean(step) for step in zip(*runs)] if runs else None
+
+    def expected_after(self, name: str):
+        order = self.runs[-1]['order'] if self.runs else []
+        later = order[order.index(name) + 1:] if name in order else []
+        return sum(self.expected_stage(later_name) or 0 for later_name in later) if self.runs else None
+
+    def emit(self, event: dict):
+        event.update({'time': time.time(), 'elapsed': round(time.time() - start_time, 3), 'layout': self.signature})
+        if progress_file:
+            with open(progress_file, 'a') as handle:
+                handle.write(json.dumps(event) + '\n')
+
+    def stage(self, name: str) -> str:
+        """Start a stage; returns the console ETA note. The ETA scales history by this run's speed so far."""
+        if self.signature is None:
+            self.load()
+        if self.step_started is not None:
+            self.steps[self.current].append(time.time() - self.step_started)
+        self.current, self.step_started = name, None
+        elapsed = time.time() - start_time
+        eta = None
+        expected = self.expected_stage(name)
+        if expected is not None and name != "DONE":
+            expected_before = sum(self.expected_stage(entry['stage']) or 0 for entry in stage_log[:-1] if not entry.get('shared'))
+            speed = elapsed / expected_before if expected_before > 0 else 1
+            eta = speed * (expected + self.expected_after(name))
+        self.emit({'event': 'stage', 'stage': name, 'index': len(stage_log) - 1, 'expected': expected, 'eta': eta})
+        return format_eta(eta)
+
+    def step(self, label: str, index: int, count: int):
+        """Report step index (0-based) of count within the current stage, before it runs."""
+        now = time.time()
+        durations = self.steps.setdefault(self.current, [])
+        if self.step_started is not None:
+            durations.append(now - self.step_started)
+        self.step_started = now
+
+        expected = self.expected_steps(self.current, count)
+        if expected:
+            speed = sum(durations) / sum(expected[:len(durations)]) if durations else 1
+            remaining = speed * (sum(expected[index:]) + self.expected_after(self.current))
+        elif durations:
+            remaining = mean(durations) * (count - index)
+        else:
+            remaining = None
+        self.emit({'event': 'step', 'stage': self.current, 'step': index, 'steps': count, 'label': label,
+                   'expected': expected[index] if expected else mean(durations), 'eta': remaining})
+        print("    --- [{}/{}] {}{}".format(index + 1, count, label, format_eta(remaining)))
+
+    def finish(self):
+        """Append this run to the run history. Stages shared with other variants (variant_tree.py) are
+        left out, and so is the total, which only covers the stages after the fork."""
+        own_stages = [entry for entry in stage_log if not entry.get('shared')]
+        ends = [entry['start'] for entry in own_stages[1:]] + [None]
+        run = {'started': start_time, 'layout': self.signature, 'parameters': run_parameters, 'status': 'ok',
+               'total': time.time() - start_time if len(own_stages) == len(stage_log) else None,
+               'retries': sum(len(entry['attempts']) - 1 for entry in boolean_log),
+               'polycount': {name: {'vertices': len(bpy.data.objects[name].data.vertices), 'faces': len(bpy.data.objects[name].data.polygons)}
+                             for name in ['body', 'bottom'] if name in bpy.data.objects},
+               'stages': [(entry['stage'], None if end is None else end - entry['start'], self.steps.get(entry['stage']))
+                          for entry, end in zip(own_stages, ends)]}
+        try:
+            if run_history is not None:
+                run_history.record_run(run_history_path or run_history.default_run_history_path, run)
+        except (OSError, sqlite3.Error) as error:
+            print("    --- could not save run history:", error)
+        self.emit({'event': 'done', 'stage': "DONE", 'eta': 0})
+
+progress = Progress()
+
+
+# Opt-in bpy.ops profiler (profile_operators, e.g. through parameter_overrides): every operator call is
+# timed per operator and stage, and with profile_dir set each stage is also dumped as a cProfile .prof file.
+profile_operators = False
+profile_dir = None
+operator_profile = []
+
+def operator_class():
+    return type(bpy.ops.object.select_all)
+
+def restore_operators():
+    """Undo the profiler's wrapper; safe to call when it is not installed."""
+    operator = operator_class()
+    if hasattr(operator, 'original_call'):
+        operator.__call__ = operator.original_call
+        del operator.original_call
+
+class OperatorProfiler:
+    def __init__(self):
+        self.calls = {}
+        self.current = None
+        self.profile = None
+        self.installed = False
+
+    def install(self):
+        restore_operators()
+        operator = operator_class()
+        operator.original_call = original_call = operator.__call__
+        calls = self.calls
+
+        def profiled_call(op, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return original_call(op, *args, **kwargs)
+            finally:
+                key = (op.idname_py(), self.current)
+                entry = calls.get(key)
+                if entry is None:
+                    entry = calls[key] = [0, 0.0]
+                entry[0] += 1
+                entry[1] += time.perf_counter() - started
+
+        operator.__call__ = profiled_call
+        self.installed = True
+
+    def stage(self, name: str):
+        if not self.installed:
+            return
+        self.dump()
+        self.current = name
+        if profile_dir and name != "DONE":
+            import cProfile
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+    def dump(self):
+        if self.profile is None:
+            return
+        self.profile.disable()
+        os.makedirs(profile_dir, exist_ok=True)
+        self.profile.dump_stats(os.path.join(profile_dir, "{:02d}_{}.prof".format(len(stage_log) - 2, self.current.replace(' ', '_'))))
+        self.profile = None
+
+    def report(self) -> list:
+        """Operators by total time, with their calls and time per stage."""
+        operators = {}
+        for (name, stage_name), (count, total) in self.calls.items():
+            entry = operators.setdefault(name, {'operator': name, 'calls': 0, 'total': 0.0, 'stages': {}})
+            entry['calls'] += count
+            entry['total'] += total
+            entry['stages'][stage_name] = {'calls': count, 'total': round(total, 4)}
+        for entry in operators.values():
+            entry['mean'] = round(entry['total'] / entry['calls'], 6)
+            entry['total'] = round(entry['total'], 4)
+        return sorted(operators.values(), key=lambda entry: -entry['total'])
+
+    def finish(self, top: int = 25):
+        if not self.installed:
+            return
+        self.dump()
+        restore_operators()
+        self.installed = False
+        operator_profile[:] = self.report()
+        print("    --- hot operators (calls, total s, mean ms, slowest stage)")
+        for entry in operator_profile[:top]:
+            slowest = max(entry['stages'], key=lambda stage_name: entry['stages'][stage_name]['total'])
+            print("    {:<40} {:>6} {:>9.3f} {:>9.3f}  {}".format(entry['operator'], entry['calls'], entry['total'], entry['mean'] * 1000, slowest))
+
+operator_profiler = OperatorProfiler()
+
 
 
 ###################
 ## Blender Setup ##
 ###################
 
-bpy.context.scene.unit_settings.system = 'METRIC'
-bpy.context.scene.unit_settings.scale_length = 1
-bpy.context.scene.unit_settings.length_unit = 'MILLIMETERS'
-bpy.context.scene.cursor.location =  [0, 0, 0]
-bpy.context.scene.cursor.rotation_euler =  [0, 0, 0]
-bpy.ops.preferences.addon_enable(module='mesh_tools')
-bpy.ops.preferences.addon_enable(module='object_print3d_utils')
+# Scene setup runs with the first stage and addons are enabled by the stage that first needs
+# them, so runs that stop early or skip those stages never pay for them. Each step's time goes
+# to setup_log (reported by worker.py); an addon already enabled, e.g. in a warm worker, is free.
+import addon_utils
+
+setup_log = []
+def setup_step(name: str, started: float):
+    setup_log.append({'step': name, 'seconds': round(time.perf_counter() - started, 4)})
+    print("    --- setup", name, "{:.3f} s".format(setup_log[-1]['seconds']))
+
+def setup_scene():
+    started = time.perf_counter()
+    bpy.context.scene.unit_settings.system = 'METRIC'
+    bpy.context.scene.unit_settings.scale_length = 1
+    bpy.context.scene.unit_settings.length_unit = 'MILLIMETERS'
+    bpy.context.scene.cursor.location =  [0, 0, 0]
+    bpy.context.scene.cursor.rotation_euler =  [0, 0, 0]
+    setup_step('scene', started)
+
+def require_addon(module: str):
+    if addon_utils.check(module)[1]:
+        return
+    started = time.perf_counter()
+    with suppress_stdout():
+        bpy.ops.preferences.addon_enable(module=module)
+    setup_step(module, started)
 
 start_time = time.time()
+generator_names = set(globals())
 
 
 
@@ -45,16 +308,12 @@ ncols = 6                       # key columns
 
 alpha = pi / 12.0               # curvature of the columns
 beta  = pi / 36.0               # curvature of the rows
-centerrow = nrows - 3           # controls front_back tilt
+centerrow = None                # controls front_back tilt, None for nrows - 3
 centercol = 3                   # controls left_right tilt / tenting (higher number is more tenting)
 tenting_angle = pi / 12.0       # or, change this for more precise tenting control
 sa_profile_key_height = 12.7
-
-if nrows > 5:
-    column_style = "orthographic"
-else:
-    column_style = "standard"
-#column_style = "cylindrical"
+lastrow_columns = [2, 3]        # columns that keep a key in the last row
+column_style = None             # "standard", "orthographic" or "cylindrical"; None for orthographic above 5 rows
 
 
 def column_offset(column: int) -> list:
@@ -67,12 +326,13 @@ def column_offset(column: int) -> list:
 
 
 thumb_offsets = [6, -3, 7]
+# [rotation, offset(, size)] per thumb key; the thumb plate is derived from where the keys land
 th_layout = [[ [ -4, -35, 52],  (-56.3, -43.3, -23.5)],
              [ [-16, -33, 54],  (-37.8, -55.3, -25.3)],
              [ [  6, -34, 40],  (  -51,   -25,   -12)],
              [ [ -6, -34, 48],  (  -29,   -40,   -13)],
-             [ [ 10, -23, 10],  (  -32,   -15,    -2)],
-             [ [ 10, -23, 10],  (  -12,   -16,     3)]]
+             [ [ 10, -23, 10],  (  -32,   -15,    -2),  1.5],
+             [ [ 10, -23, 10],  (  -12,   -16,     3),  1.5]]
              
 
 keyboard_z_offset = 9                       # controls overall height# original=9 with centercol=3# use 16 for centercol=2
@@ -83,7 +343,7 @@ extra_height = 1.0                          # original= 0.5
 wall_z_offset = -15                         # length of the first downward_sloping part of the wall (negative)
 wall_xy_offset = 5                          # offset in the x and/or y direction for the first downward_sloping part of the wall (negative)
 wall_thickness = 2                          # wall thickness parameter# originally 5
-left_wall_x_offset = 2 + wall_xy_offset     # shape of left wall
+left_wall_x_offset = None                   # shape of left wall, None for 2 + wall_xy_offset
 left_wall_z_offset = 3                      # shape of left wall
 key_well_offset =  0.5                      # depth of key from body
 
@@ -98,6 +358,7 @@ geode_mode = False                # Forces other perameters
 body_thickness = 2
 body_subsurf_level = 1
 relaxed_mesh = True
+relax_iterations = 5              # Taubin smoothing passes applied to the walls when relaxed_mesh is set
 switch_support = True
 loligagger_port = True
 wide_pinky = True
@@ -106,7 +367,55 @@ hot_swap = False                  # Unused Currently
 magnet_bottom = True             
 magnet_diameter = 6.2
 magnet_height = 2.2
+magnet_layout = None              # [location key, direction key, rotation in degrees] per magnet; None places the default six
 bottom_thickness = 3              # Thickness of Bottom Plate
+use_template_library = True       # Append tool and magnet templates from a .blend library instead of rebuilding them
+template_library_dir = None       # None for ~/.blended-dm/templates
+use_punch_cache = False           # Reuse punched key patches of earlier runs (disk space for intersections)
+punch_cache_dir = None            # None for ~/.blended-dm/punch_cache
+punch_cache_size_limit = 256      # MB kept, the least recently used patches are removed first
+
+
+
+#########################
+## Parameter Overrides ##
+#########################
+
+# Drivers running this file through runpy (e.g. worker.py) pass a dict of parameter
+# values in init_globals.
+if 'parameter_overrides' in globals():
+    globals().update(parameter_overrides)
+
+
+
+########################
+## Derived Parameters ##
+########################
+
+# Parameters left at None follow the ones they derive from, after the overrides, so a job
+# overriding nrows builds the same keyboard as editing nrows above. Key masks the finger plate
+# cannot be built for are rejected here rather than stages later.
+def derive_parameters(p: dict):
+    if p['ncols'] < 4:
+        raise ValueError("ncols must be at least 4, the thumb bridges hang below finger columns 0-3")
+    columns = set(p['lastrow_columns'])
+    if not columns <= set(range(p['ncols'])):
+        raise ValueError("lastrow_columns " + str(p['lastrow_columns']) + " must be among columns 0-" + str(p['ncols'] - 1))
+    if any(column + 1 not in columns for column in columns if column < 3):
+        raise ValueError("lastrow_columns " + str(p['lastrow_columns']) + " must run up to column 3 from its first column below 3, "
+                         "the bottoms of columns 0-3 (where the thumb bridges hang) may only step down to the right")
+    if p['centerrow'] is None:
+        p['centerrow'] = p['nrows'] - 3
+    if p['column_style'] is None:
+        p['column_style'] = "orthographic" if p['nrows'] > 5 else "standard"
+    if p['left_wall_x_offset'] is None:
+        p['left_wall_x_offset'] = 2 + p['wall_xy_offset']
+
+derive_parameters(globals())
+
+# Every parameter value as this run sees it, for the run history
+run_parameters = {name: value for name, value in globals().items()
+                  if name not in generator_names and isinstance(value, (bool, int, float, str, list, tuple))}
 
 
 
@@ -118,22 +427,425 @@ lastrow = nrows - 1
 cornerrow = lastrow - 1
 lastcol = ncols - 1
 
+def key_present(column: int, row: int) -> bool:
+    return column in lastrow_columns or row != lastrow
+
+
+
+##################
+## Key Registry ##
+##################
+
+# Direct references to every key's objects, filled once during key placement and
+# iterated by all later stages instead of rebuilding object and vertex group names
+@dataclass
+class KeyEntry:
+    __slots__ = ('identifier', 'column', 'row', 'size', 'axis', 'tools', 'groups', 'group_index')
+    identifier: str         # " - column, row" or " - thumb - n", the suffix of every per-key name
+    column: int             # finger column, None for thumb keys
+    row: int                # finger row, or the thumb key number
+    size: float             # 1 or 1.5 (u)
+    axis: object            # key frame empty
+    tools: dict             # tool collection name -> tool object
+    groups: dict            # role -> vertex group name ('switch' and each projection tool)
+    group_index: dict       # mesh object name -> {role: vertex group index}
+
+keys = []
+key_by_position = {}        # (column, row) for finger keys, (None, n) for thumb keys
+
+def register_key(identifier: str, column, row, size: float) -> KeyEntry:
+    key = KeyEntry(identifier, column, row, size, None, {}, {'switch': 'switch' + identifier}, {})
+    for tool in ['keycap_projection_outer', 'keycap_projection_inner', 'switch_projection', 'switch_projection_inner']:
+        key.groups[tool] = tool + identifier
+    keys.append(key)
+    key_by_position[(column, row)] = key
+    return key
+
+# Resolve every key's vertex group indices on a mesh object; needed again after joins
+def index_key_groups(mesh_object):
+    for key in keys:
+        key.group_index[mesh_object.name] = {role: mesh_object.vertex_groups[name].index for role, name in key.groups.items() if name in mesh_object.vertex_groups}
+
+# Select a key's vertex group in edit mode without a name lookup
+def select_key_group(mesh_object, key: KeyEntry, role: str):
+    mesh_object.vertex_groups.active_index = key.group_index[mesh_object.name][role]
+    bpy.ops.object.vertex_group_select()
+
+
+
+########################
+## Projection Service ##
+########################
+
+# Vectorized form of Blender's shrinkwrap_snap_with_side(): place each point goal away from its hit,
+# on the side given by forcesign (0 keeps the point's own side) or only if it is too close or outside
+def snap_with_side(points, hits, normals, goal: float, forcesign: float, forcesnap: bool):
+    delta = points - hits
+    distance = np.linalg.norm(delta, axis=1)
+    side = np.where(np.einsum('ij,ij->i', delta, normals) < 0, -1.0, 1.0)
+    sign = side if forcesign == 0 else np.full(len(points), float(forcesign))
+    direction = delta * (side / np.maximum(distance, 1.2e-7))[:, None]
+    move = forcesnap | (side * distance * sign < goal)
+    result = np.where(move[:, None], hits + direction * (goal * sign)[:, None], points)
+    on_surface = distance < 1.2e-7
+    result[on_surface] = hits[on_surface] + normals[on_surface] * (goal * forcesign if forcesnap or goal > 0 else 0)
+    return result
+
+# Shrinkwrap's wrap_mode handling of a surface hit
+def snap_to_surface(points, hits, normals, offset: float, wrap_mode: str):
+    if wrap_mode == 'ON_SURFACE':
+        return hits.copy() if offset == 0 else snap_with_side(points, hits, normals, offset, 0, True)
+    return snap_with_side(points, hits, normals, offset, -1 if wrap_mode == 'INSIDE' else 1, False)
+
+def selection_mask(mesh_object):
+    mask = np.zeros(len(mesh_object.data.vertices), dtype=bool)
+    mesh_object.data.vertices.foreach_get('select', mask)
+    return mask
+
+# {group name: vertex mask} of an object in object mode, each group selected in edit mode and read back
+# with foreach_get. The vertex selection, active group and object selection are restored afterwards.
+def vertex_group_masks(mesh_object, group_names) -> dict:
+    view_layer = bpy.context.view_layer
+    active, selected = view_layer.objects.active, bpy.context.selected_objects
+    vertex_selection = selection_mask(mesh_object)
+    active_group = mesh_object.vertex_groups.active_index
+
+    bpy.ops.object.select_all(action='DESELECT')
+    mesh_object.select_set(True)
+    view_layer.objects.active = mesh_object
+    bpy.ops.object.mode_set(mode = 'EDIT')
+    masks = {}
+    for group_name in group_names:
+        bpy.ops.mesh.select_all(action='DESELECT')
+        bpy.ops.object.vertex_group_set_active(group=group_name)
+        bpy.ops.object.vertex_group_select()
+        mesh_object.update_from_editmode()
+        masks[group_name] = selection_mask(mesh_object)
+    bpy.ops.object.mode_set(mode = 'OBJECT')
+
+    mesh_object.data.vertices.foreach_set('select', vertex_selection)
+    mesh_object.vertex_groups.active_index = active_group
+    mesh_object.select_set(False)
+    for selected_object in selected:
+        selected_object.select_set(True)
+    view_layer.objects.active = active
+    return masks
+
+def vertex_coordinates(mesh_object):
+    coordinates = np.empty(len(mesh_object.data.vertices) * 3)
+    mesh_object.data.vertices.foreach_get('co', coordinates)
+    return coordinates.reshape(-1, 3)
+
+def set_vertex_coordinates(mesh_object, coordinates):
+    mesh_object.data.vertices.foreach_set('co', coordinates.ravel())
+    mesh_object.data.update()
+
+# Replaces a NEAREST_SURFACEPOINT Shrinkwrap onto a helper plane: analytic projection onto the plane
+def flatten_to_plane(mesh_object, mask, origin, normal):
+    coordinates = vertex_coordinates(mesh_object)
+    normal = np.array(normal) / np.linalg.norm(normal)
+    coordinates[mask] -= np.outer((coordinates[mask] - np.array(origin)) @ normal, normal)
+    set_vertex_coordinates(mesh_object, coordinates)
+
+# One BVH tree per projection target, built on first use and reused until invalidate() is called
+# after the target's mesh changes. Queries run in the target's local space, like Shrinkwrap.
+class ProjectionService:
+    def __init__(self):
+        self.trees = {}
+
+    def invalidate(self, target: str = None):
+        if target is None:
+            self.trees.clear()
+        else:
+            self.trees.pop(target, None)
+
+    def tree(self, target: str):
+        if target not in self.trees:
+            self.trees[target] = BVHTree.FromObject(bpy.data.objects[target], bpy.context.evaluated_depsgraph_get())
+        return self.trees[target]
+
+    # Masked vertices in target space and the matrix taking them back to object space
+    def query_points(self, mesh_object, target: str, mask):
+        bpy.context.view_layer.update()
+        to_target = np.array(bpy.data.objects[target].matrix_world.inverted() @ mesh_object.matrix_world)
+        coordinates = vertex_coordinates(mesh_object)
+        points = coordinates[mask] @ to_target[:3, :3].T + to_target[:3, 3]
+        return coordinates, points, to_target
+
+    def write_back(self, mesh_object, coordinates, mask, points, to_target):
+        from_target = np.linalg.inv(to_target)
+        coordinates[mask] = points @ from_target[:3, :3].T + from_target[:3, 3]
+        set_vertex_coordinates(mesh_object, coordinates)
+
+    # First hit along direction, skipping culled faces like Shrinkwrap's cull_face option
+    def ray_cast(self, tree, origin, direction, cull_face: str):
+        travelled = 0.0
+        while True:
+            location, normal, _, distance = tree.ray_cast(origin, direction)
+            if location is None:
+                return None
+            facing = direction.dot(normal)
+            if not ((cull_face == 'FRONT' and facing <= 0) or (cull_face == 'BACK' and facing >= 0)):
+                return location, normal, travelled + distance
+            origin = location + direction * 1e-4
+            travelled += distance + 1e-4
+
+    # PROJECT mode: cast every masked vertex along a local axis, one axis per masked vertex, or its normal
+    def project(self, mesh_object, target: str, mask=None, axis=None, positive: bool = True, negative: bool = False,
+                offset: float = 0.0, cull_face: str = 'OFF', wrap_mode: str = 'ON_SURFACE'):
+        if mask is None:
+            mask = np.ones(len(mesh_object.data.vertices), dtype=bool)
+        coordinates, points, to_target = self.query_points(mesh_object, target, mask)
+        if axis is not None:
+            directions = np.broadcast_to(np.asarray(axis, dtype=float), points.shape) @ to_target[:3, :3].T
+        else:
+            mesh_object.data.calc_normals()
+            normals = np.empty(len(mesh_object.data.vertices) * 3)
+            mesh_object.data.vertices.foreach_get('normal', normals)
+            directions = normals.reshape(-1, 3)[mask] @ to_target[:3, :3].T
+        directions /= np.linalg.norm(directions, axis=1)[:, None]
+
+        tree = self.tree(target)
+        hit = np.zeros(len(points), dtype=bool)
+        hits = np.zeros_like(points)
+        hit_normals = np.zeros_like(points)
+        for index, (point, direction) in enumerate(zip(points, directions)):
+            nearest = None
+            for sign in ([1] if positive else []) + ([-1] if negative else []):
+                result = self.ray_cast(tree, mathutils.Vector(point), mathutils.Vector(direction * sign), cull_face)
+                if result is not None and (nearest is None or result[2] < nearest[2]):
+                    nearest = result
+            if nearest is not None:
+                hit[index] = True
+                hits[index], hit_normals[index] = nearest[0], nearest[1]
+
+        points[hit] = snap_to_surface(points[hit], hits[hit], hit_normals[hit], offset, wrap_mode)
+        self.write_back(mesh_object, coordinates, mask, points, to_target)
+
+    # TARGET_PROJECT / NEAREST_SURFACEPOINT: snap every masked vertex against its nearest surface point
+    def snap_nearest(self, mesh_object, target: str, mask=None, offset: float = 0.0, wrap_mode: str = 'ON_SURFACE'):
+        if mask is None:
+            mask = np.ones(len(mesh_object.data.vertices), dtype=bool)
+        coordinates, points, to_target = self.query_points(mesh_object, target, mask)
+        tree = self.tree(target)
+        hits = np.empty_like(points)
+        hit_normals = np.empty_like(points)
+        for index, point in enumerate(points):
+            hits[index], hit_normals[index], _, _ = tree.find_nearest(mathutils.Vector(point))
+        points = snap_to_surface(points, hits, hit_normals, offset, wrap_mode)
+        self.write_back(mesh_object, coordinates, mask, points, to_target)
+
+projection = ProjectionService()
+
+
+
+####################
+## Instanced Mesh ##
+####################
+
+# A mesh's geometry as arrays: vertex coordinates, loop vertex indices and polygon sizes
+def mesh_arrays(mesh):
+    loop_vertices = np.empty(len(mesh.loops), dtype=np.int32)
+    loop_totals = np.empty(len(mesh.polygons), dtype=np.int32)
+    mesh.loops.foreach_get('vertex_index', loop_vertices)
+    mesh.polygons.foreach_get('loop_total', loop_totals)
+    coordinates = np.empty(len(mesh.vertices) * 3)
+    mesh.vertices.foreach_get('co', coordinates)
+    return coordinates.reshape(-1, 3), loop_vertices, loop_totals
+
+# Copies of the template geometry under each 4x4 matrix, as one set of mesh arrays
+def instance_arrays(coordinates, loop_vertices, loop_totals, matrices):
+    matrices = np.asarray(matrices, dtype=float).reshape(-1, 4, 4)
+    copies = len(matrices)
+    instanced = np.einsum('cij,vj->cvi', matrices[:, :3, :3], coordinates) + matrices[:, None, :3, 3]
+    return (instanced.reshape(-1, 3),
+            (loop_vertices[None, :] + len(coordinates) * np.arange(copies)[:, None]).ravel(),
+            np.tile(loop_totals, copies))
+
+# Several sets of mesh arrays as one, with each set's loops shifted past the vertices before it
+def concatenate_arrays(parts):
+    offsets = np.cumsum([0] + [len(part[0]) for part in parts[:-1]])
+    return (np.concatenate([part[0] for part in parts]),
+            np.concatenate([part[1] + offset for part, offset in zip(parts, offsets)]),
+            np.concatenate([part[2] for part in parts]))
+
+# A mesh holding the given geometry, written with foreach_set so the cost of adding copies
+# is array work rather than an operator call per copy
+def build_mesh(name: str, coordinates, loop_vertices, loop_totals):
+    loop_starts = np.concatenate(([0], np.cumsum(loop_totals)[:-1]))
+
+    mesh = bpy.data.meshes.new(name)
+    mesh.vertices.add(len(coordinates))
+    mesh.loops.add(len(loop_vertices))
+    mesh.polygons.add(len(loop_totals))
+    mesh.vertices.foreach_set('co', np.ascontiguousarray(coordinates).ravel())
+    mesh.loops.foreach_set('vertex_index', loop_vertices.astype(np.int32))
+    mesh.polygons.foreach_set('loop_start', loop_starts.astype(np.int32))
+    mesh.polygons.foreach_set('loop_total', loop_totals.astype(np.int32))
+    mesh.update(calc_edges=True)
+    for elements in [mesh.vertices, mesh.edges, mesh.polygons]:
+        elements.foreach_set('select', np.ones(len(elements), dtype=bool))
+    return mesh
+
+# One object holding the given geometry
+def build_mesh_object(name: str, coordinates, loop_vertices, loop_totals):
+    mesh_object = bpy.data.objects.new(name, build_mesh(name, coordinates, loop_vertices, loop_totals))
+    bpy.context.collection.objects.link(mesh_object)
+    return mesh_object
+
+# One object holding a copy of the template geometry under each 4x4 matrix
+def build_instanced_mesh(name: str, coordinates, loop_vertices, loop_totals, matrices):
+    return build_mesh_object(name, *instance_arrays(coordinates, loop_vertices, loop_totals, matrices))
+
+
+
+#####################
+## Modifier Stacks ##
+#####################
+
+# Mesh of an object with its whole modifier stack evaluated once
+def evaluate_modifier_stack(mesh_object):
+    depsgraph = bpy.context.evaluated_depsgraph_get()
+    return bpy.data.meshes.new_from_object(mesh_object.evaluated_get(depsgraph), preserve_all_data_layers=True, depsgraph=depsgraph)
+
+# Keep an evaluated mesh as the object's mesh in place of its modifiers
+def replace_mesh(mesh_object, evaluated_mesh):
+    old_mesh = mesh_object.data
+    mesh_object.modifiers.clear()
+    mesh_object.data = evaluated_mesh
+    bpy.data.meshes.remove(old_mesh)
+
+def apply_modifier_stack(mesh_object):
+    replace_mesh(mesh_object, evaluate_modifier_stack(mesh_object))
+
+# Non-manifold edge count (edges not shared by exactly two faces) and signed volume
+def mesh_statistics(mesh) -> tuple:
+    loop_edges = np.empty(len(mesh.loops), dtype=np.int32)
+    mesh.loops.foreach_get('edge_index', loop_edges)
+    non_manifold = int(np.count_nonzero(np.bincount(loop_edges, minlength=len(mesh.edges)) != 2))
+    mesh.calc_loop_triangles()
+    triangles = np.empty(len(mesh.loop_triangles) * 3, dtype=np.int32)
+    mesh.loop_triangles.foreach_get('vertices', triangles)
+    coordinates = np.empty(len(mesh.vertices) * 3)
+    mesh.vertices.foreach_get('co', coordinates)
+    corners = coordinates.reshape(-1, 3)[triangles.reshape(-1, 3)]
+    volume = np.einsum('ij,ij->i', corners[:, 0], np.cross(corners[:, 1], corners[:, 2])).sum() / 6
+    return non_manifold, float(volume)
+
+# A boolean result passes if it adds no non-manifold edges, keeps the target's volume sign and
+# moves the volume the way the operation should
+def boolean_result_valid(before: tuple, after: tuple, operation: str) -> bool:
+    tolerance = 1e-4 * abs(before[1]) + 1e-6
+    if after[0] > before[0] or after[1] * before[1] <= 0:
+        return False
+    if operation == 'UNION':
+        return after[1] >= before[1] - tolerance
+    return after[1] <= before[1] + tolerance
+
+boolean_log = []
+boolean_solvers = [('FAST', False), ('EXACT', False), ('EXACT', True)]      # (solver, use_hole_tolerant) in escalation order
+
+# Apply a boolean with the first solver whose result passes the sanity check; the last attempt is
+# kept if none does. Every attempt's time and the winning solver are recorded in boolean_log.
+# Operands whose parts overlap each other need self_intersecting for the exact solver.
+def apply_boolean(target, operand, operation: str = 'DIFFERENCE', solvers: list = boolean_solvers, self_intersecting: bool = False):
+    before = mesh_statistics(target.data)
+    modifier = target.modifiers.new(name="Boolean", type='BOOLEAN')
+    modifier.operation = operation
+    modifier.use_self = self_intersecting
+    if isinstance(operand, bpy.types.Collection):
+        modifier.operand_type = 'COLLECTION'
+        modifier.collection = operand
+    else:
+        modifier.object = operand
+
+    entry = {'stage': stage_log[-1]['stage'], 'target': target.name, 'operand': operand.name, 'operation': operation, 'attempts': []}
+    for solver, hole_tolerant in solvers:
+        modifier.solver = solver
+        modifier.use_hole_tolerant = hole_tolerant
+        attempt_start = time.time()
+        result = evaluate_modifier_stack(target)
+        valid = boolean_result_valid(before, mesh_statistics(result), operation)
+        entry['attempts'].append({'solver': solver + (" hole_tolerant" if hole_tolerant else ""), 'seconds': round(time.time() - attempt_start, 4), 'valid': valid})
+        if valid or (solver, hole_tolerant) == solvers[-1]:
+            break
+        bpy.data.meshes.remove(result)
+
+    entry['solver'] = entry['attempts'][-1]['solver']
+    entry['valid'] = valid
+    boolean_log.append(entry)
+    if not valid:
+        print("    --- boolean", operation, operand.name, "on", target.name, "failed validation with every solver")
+    replace_mesh(target, result)
+
 
 
 ########################
 ## Create Collections ##
 ########################
 
-for collection in ["AXIS", "KEYCAP_PROJECTION_OUTER", "KEYCAP_PROJECTION_INNER", "SWITCH_PROJECTION", "SWITCH_PROJECTION_INNER", "SWITCH_HOLE", "SWITCH_SUPPORT"]:
+for collection in ["AXIS", "KEYCAP_PROJECTION_OUTER", "KEYCAP_PROJECTION_INNER", "SWITCH_PROJECTION", "SWITCH_PROJECTION_INNER"]:
     bpy.context.scene.collection.children.link(bpy.data.collections.new(collection))
 
 
 
+######################
+## Template Library ##
+######################
+
+# Tool and magnet templates depend on a handful of values, so they are built once per signature and
+# kept in a .blend library that later runs append them from instead of rebuilding them from primitives.
+# Bump template_format whenever the construction of a template changes.
+template_library_dir = template_library_dir or os.path.join(os.path.expanduser('~'), '.blended-dm', 'templates')
+template_format = 1
+
+def template_path(kind: str, values) -> str:
+    signature = hashlib.sha1(repr((template_format, kind, tuple(bpy.app.version), values)).encode()).hexdigest()[:16]
+    return os.path.join(template_library_dir, kind + '_' + signature + '.blend')
+
+# Append the named template objects into the scene; False (and nothing appended) on a cache miss
+def load_templates(path: str, names: list) -> bool:
+    if not use_template_library or not os.path.exists(path):
+        return False
+    with bpy.data.libraries.load(path, link=False) as (data_from, data_to):
+        data_to.objects = [name for name in names if name in data_from.objects]
+    templates = [template for template in data_to.objects if template is not None]
+    if [template.name for template in templates] != names:
+        for template in templates:
+            bpy.data.objects.remove(template)
+        return False
+    for template in templates:
+        template.use_fake_user = False
+        template.data.use_fake_user = False
+        bpy.context.collection.objects.link(template)
+        template.select_set(False)
+    return True
+
+def save_templates(path: str, names: list):
+    if not use_template_library:
+        return
+    try:
+        os.makedirs(template_library_dir, exist_ok=True)
+        # A unique temporary file per writer, so pool workers saving the same template do not collide
+        handle, temporary_path = tempfile.mkstemp(suffix='.blend', dir=template_library_dir)
+        os.close(handle)
+        try:
+            bpy.data.libraries.write(temporary_path, {bpy.data.objects[name] for name in names}, fake_user=True)
+            os.replace(temporary_path, path)
+        finally:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+    except OSError as error:
+        print("    --- could not save templates:", error)
+
+
+
 ############################
 ## Initialize Tool Shapes ##
 ############################
 
-print("\n\n{:.2f}".format(time.time()-start_time), "- Initializing Tool Shapes")
+print("\n")
+stage("Initializing Tool Shapes")
 
 
 bpy.ops.object.empty_add(type='PLAIN_AXES', align='WORLD', location=(0, 0, 0), scale=(1, 1, 1))
@@ -151,55 +863,58 @@ ameoba_height = 20
 ameoba_width = 16.5
 ameoba_thickness = 3
 
-for size in [1, 1.5]:
-    for shape in [['switch_projection', (0, 0, 5*mount_thickness-1), (mount_width, mount_height*size,  10*mount_thickness)],
-                  ['switch_projection_inner', (0, 0, 5*mount_thickness-1), (mount_width+1.8, mount_height*size+1.8, 10*mount_thickness)],
-                  ['keycap_projection_outer', (0, 0, mount_thickness + 4 + 2), (19, 19*size, 8)],
-                  ['keycap_projection_inner', (0, 0, mount_thickness + 4 + 2 - 2), (19+2, 19*size+2, 8)],
-                  ['switch_hole', (0, 0, 0), (keyswitch_width, keyswitch_height, 2.1*mount_thickness)],
-                  ['ameoba_cut', (0, 0, -ameoba_thickness/2-0.1), (ameoba_width, ameoba_height, ameoba_thickness)],
-                  ['nub_cube', ((1.5 / 2) + 0.5*(keyswitch_width-0.01), 0, 0.5*mount_thickness), (1.5, 2.75, mount_thickness - 0.01)]]:
+tool_templates = [shape + "_" + str(size) + "u" for size in [1, 1.5] for shape in ['switch_projection', 'switch_projection_inner', 'keycap_projection_outer', 'keycap_projection_inner', 'switch_hole', 'switch_support']]
+tool_template_path = template_path('tools', (keyswitch_width, keyswitch_height, mount_thickness, ameoba_cut))
+
+if not load_templates(tool_template_path, tool_templates):
+    for size in [1, 1.5]:
+        for shape in [['switch_projection', (0, 0, 5*mount_thickness-1), (mount_width, mount_height*size,  10*mount_thickness)],
+                      ['switch_projection_inner', (0, 0, 5*mount_thickness-1), (mount_width+1.8, mount_height*size+1.8, 10*mount_thickness)],
+                      ['keycap_projection_outer', (0, 0, mount_thickness + 4 + 2), (19, 19*size, 8)],
+                      ['keycap_projection_inner', (0, 0, mount_thickness + 4 + 2 - 2), (19+2, 19*size+2, 8)],
+                      ['switch_hole', (0, 0, 0), (keyswitch_width, keyswitch_height, 2.1*mount_thickness)],
+                      ['ameoba_cut', (0, 0, -ameoba_thickness/2-0.1), (ameoba_width, ameoba_height, ameoba_thickness)],
+                      ['nub_cube', ((1.5 / 2) + 0.5*(keyswitch_width-0.01), 0, 0.5*mount_thickness), (1.5, 2.75, mount_thickness - 0.01)]]:
         
-        bpy.ops.mesh.primitive_cube_add(size=1, location=shape[1], scale=shape[2])
-        bpy.context.selected_objects[0].name = shape[0] + "_" + str(size) + "u"
+            bpy.ops.mesh.primitive_cube_add(size=1, location=shape[1], scale=shape[2])
+            bpy.context.selected_objects[0].name = shape[0] + "_" + str(size) + "u"
         
-        if shape[0] in ['switch_projection', 'switch_projection_inner']:
-            bpy.ops.object.mode_set(mode = 'EDIT')
-            bpy.ops.mesh.select_all(action='DESELECT')
-            grid_mesh = bmesh.from_edit_mesh(bpy.context.object.data)
-            grid_mesh.verts.ensure_lookup_table()
-            for vertex in [0, 2, 4, 6]:
-                grid_mesh.verts[vertex].select = True
-            bpy.ops.object.vertex_group_assign_new()
-            bpy.ops.mesh.select_all(action='SELECT')
-            bpy.ops.object.mode_set(mode = 'OBJECT')
-            bpy.data.objects[shape[0] + "_" + str(size) + "u"].vertex_groups['Group'].name = 'bottom_project'
+            if shape[0] in ['switch_projection', 'switch_projection_inner']:
+                bpy.ops.object.mode_set(mode = 'EDIT')
+                bpy.ops.mesh.select_all(action='DESELECT')
+                grid_mesh = bmesh.from_edit_mesh(bpy.context.object.data)
+                grid_mesh.verts.ensure_lookup_table()
+                for vertex in [0, 2, 4, 6]:
+                    grid_mesh.verts[vertex].select = True
+                bpy.ops.object.vertex_group_assign_new()
+                bpy.ops.mesh.select_all(action='SELECT')
+                bpy.ops.object.mode_set(mode = 'OBJECT')
+                bpy.data.objects[shape[0] + "_" + str(size) + "u"].vertex_groups['Group'].name = 'bottom_project'
         
-        elif shape[0] in ['nub_cube']:
-            bpy.ops.mesh.primitive_cylinder_add(vertices=50, radius=1.0 - 0.005, depth=2.75, location=(keyswitch_width / 2, 0, 1), rotation=(pi / 2, 0, 0))
-            bpy.context.selected_objects[0].name = "switch_support_" + str(size) + "u"
-            bpy.data.objects[shape[0] + "_" + str(size) + "u"].select_set(True)
-            bpy.ops.object.join()
-            bpy.ops.object.mode_set(mode = 'EDIT')
-            bpy.ops.mesh.convex_hull()
-            bpy.ops.mesh.dissolve_limited(angle_limit=radians(5))
-            bpy.ops.object.mode_set(mode = 'OBJECT')
-            bpy.ops.object.transform_apply(location=True, rotation=True, scale=True)
-            bpy.ops.object.origin_set(type='ORIGIN_CURSOR', center='MEDIAN')
-            bpy.ops.object.modifier_add(type='MIRROR')
-            bpy.ops.object.modifier_apply(modifier="Mirror")
+            elif shape[0] in ['nub_cube']:
+                bpy.ops.mesh.primitive_cylinder_add(vertices=50, radius=1.0 - 0.005, depth=2.75, location=(keyswitch_width / 2, 0, 1), rotation=(pi / 2, 0, 0))
+                bpy.context.selected_objects[0].name = "switch_support_" + str(size) + "u"
+                bpy.data.objects[shape[0] + "_" + str(size) + "u"].select_set(True)
+                bpy.ops.object.join()
+                bpy.ops.object.mode_set(mode = 'EDIT')
+                bpy.ops.mesh.convex_hull()
+                bpy.ops.mesh.dissolve_limited(angle_limit=radians(5))
+                bpy.ops.object.mode_set(mode = 'OBJECT')
+                bpy.ops.object.transform_apply(location=True, rotation=True, scale=True)
+                bpy.ops.object.origin_set(type='ORIGIN_CURSOR', center='MEDIAN')
+                bpy.ops.object.modifier_add(type='MIRROR')
+                bpy.ops.object.modifier_apply(modifier="Mirror")
             
-    bpy.context.view_layer.objects.active = bpy.data.objects["switch_hole_" + str(size) + "u"]
+        bpy.context.view_layer.objects.active = bpy.data.objects["switch_hole_" + str(size) + "u"]
     
-    if (ameoba_cut):
-        bpy.ops.object.modifier_add(type='BOOLEAN')
-        bpy.context.object.modifiers["Boolean"].operation = 'UNION'
-        bpy.context.object.modifiers["Boolean"].object = bpy.data.objects["ameoba_cut_" + str(size) + "u"]
-        bpy.ops.object.modifier_apply(modifier="Boolean")
+        if (ameoba_cut):
+            apply_boolean(bpy.context.object, bpy.data.objects["ameoba_cut_" + str(size) + "u"], 'UNION')
 
-    bpy.ops.object.select_all(action='DESELECT')
-    bpy.data.objects["ameoba_cut_" + str(size) + "u"].select_set(True)
-    with suppress_stdout(): bpy.ops.object.delete()
+        bpy.ops.object.select_all(action='DESELECT')
+        bpy.data.objects["ameoba_cut_" + str(size) + "u"].select_set(True)
+        with suppress_stdout(): bpy.ops.object.delete()
+
+    save_templates(tool_template_path, tool_templates)
 
 
 
@@ -207,7 +922,7 @@ for size in [1, 1.5]:
 ## FINGER KEY LOCATIONS ##
 ##########################
 
-print("{:.2f}".format(time.time()-start_time), "- Generate Finger Topology")
+stage("Generate Finger Topology")
 
 cap_top_height = mount_thickness + sa_profile_key_height
 row_radius = ((mount_height + extra_height) / 2) / (sin(alpha / 2)) + cap_top_height
@@ -216,36 +931,39 @@ column_radius = (((mount_width + extra_width) / 2) / (sin(beta / 2))) + cap_top_
 
 for column in range(ncols):
     for row in range(nrows):
-        if (column in [2, 3]) or (not row == lastrow):
+        if key_present(column, row):
             
             if column==ncols-1 and wide_pinky:
                 column_angle = beta * (centercol - column - 0.25)
             else:
                 column_angle = beta * (centercol - column)
             tool_identifier =  " - " + str(column) + ", " + str(row)
+            key = register_key(tool_identifier, column, row, 1.5 if (column==ncols-1 and wide_pinky) else 1)
 
             # CREATE tools for each key location and link into respective Collection
             for tool in [['AXIS',                           'key_axis',                          'key_axis'                           ],
                          ['KEYCAP_PROJECTION_OUTER',        'keycap_projection_outer_1u',        'keycap_projection_outer_1.5u'       ],
                          ['KEYCAP_PROJECTION_INNER',        'keycap_projection_inner_1u',        'keycap_projection_inner_1.5u'       ],
                          ['SWITCH_PROJECTION',              'switch_projection_1u',              'switch_projection_1u'               ],
-                         ['SWITCH_PROJECTION_INNER',        'switch_projection_inner_1u',        'switch_projection_inner_1.5u'       ],
-                         ['SWITCH_HOLE',                    'switch_hole_1u',                    'switch_hole_1.5u'                   ],
-                         ['SWITCH_SUPPORT',                 'switch_support_1u',                 'switch_support_1.5u'                ]]:
+                         ['SWITCH_PROJECTION_INNER',        'switch_projection_inner_1u',        'switch_projection_inner_1.5u'       ]]:
                 bpy.ops.object.select_all(action='DESELECT')
                 if column==ncols-1 and wide_pinky:
                     bpy.ops.object.add_named(name = tool[2])
-                    bpy.context.selected_objects[-1].name = tool[0].lower() + tool_identifier
+                    tool_object = bpy.context.selected_objects[-1]
+                    tool_object.name = tool[0].lower() + tool_identifier
                     bpy.ops.object.select_all(action='DESELECT')
-                    if tool[0] not in ['AXIS', 'SWITCH_SUPPORT']:
-                        bpy.data.objects[tool[0].lower() + tool_identifier].select_set(True)
+                    if tool[0] != 'AXIS':
+                        tool_object.select_set(True)
                         bpy.ops.transform.rotate(value=1.5708, orient_axis='Z', orient_type='GLOBAL', orient_matrix=((1, 0, 0), (0, 1, 0), (0, 0, 1)), orient_matrix_type='VIEW', mirror=True, use_proportional_edit=False, proportional_edit_falloff='SMOOTH', proportional_size=0.001, use_proportional_connected=False, use_proportional_projected=False)
                 else:
                     bpy.ops.object.add_named(name = tool[1])
-                    bpy.context.selected_objects[-1].name = tool[0].lower() + tool_identifier
+                    tool_object = bpy.context.selected_objects[-1]
+                    tool_object.name = tool[0].lower() + tool_identifier
 
-                bpy.data.collections[tool[0]].objects.link(bpy.data.objects[tool[0].lower() + tool_identifier])
-                bpy.context.collection.objects.unlink(bpy.data.objects[tool[0].lower() + tool_identifier])
+                bpy.data.collections[tool[0]].objects.link(tool_object)
+                bpy.context.collection.objects.unlink(tool_object)
+                key.tools[tool[0]] = tool_object
+            key.axis = key.tools['AXIS']
                 
             bpy.ops.object.select_all(action='DESELECT')
             # CREATE referecnce location for placing thumb cluster
@@ -256,8 +974,8 @@ for column in range(ncols):
                 bpy.context.collection.objects.unlink(bpy.data.objects["thumb_orgin"])
 
             # Select all tools
-            for tool in ['AXIS', 'KEYCAP_PROJECTION_OUTER', 'KEYCAP_PROJECTION_INNER', 'SWITCH_PROJECTION', 'SWITCH_PROJECTION_INNER', 'SWITCH_HOLE', 'SWITCH_SUPPORT']:
-                bpy.data.objects[tool.lower() + tool_identifier].select_set(True)
+            for tool_object in key.tools.values():
+                tool_object.select_set(True)
             
             # Apply transfomations to each set tools
             if (column_style == "standard"):
@@ -292,34 +1010,36 @@ for column in range(ncols):
 ## THUMB KEY LOCATIONS ##
 ##########################
 
-print("{:.2f}".format(time.time()-start_time), "- Generate Thumb Topology")
+stage("Generate Thumb Topology")
              
 for key in range(len(th_layout)):
     
     tool_identifier =  " - thumb - " + str(key)
+    thumb_key = register_key(tool_identifier, None, key, th_layout[key][2] if len(th_layout[key]) > 2 else 1)
     
     # Create tools for each key location and link into respective Collection
     for tool in [['AXIS',                           'key_axis',                          'key_axis'                           ],
                  ['KEYCAP_PROJECTION_OUTER',        'keycap_projection_outer_1u',        'keycap_projection_outer_1.5u'       ],
                  ['KEYCAP_PROJECTION_INNER',        'keycap_projection_inner_1u',        'keycap_projection_inner_1.5u'       ],
                  ['SWITCH_PROJECTION',              'switch_projection_1u',              'switch_projection_1.5u'             ],
-                 ['SWITCH_PROJECTION_INNER',        'switch_projection_inner_1u',        'switch_projection_inner_1.5u'       ],
-                 ['SWITCH_HOLE',                    'switch_hole_1u',                    'switch_hole_1.5u'                   ],
-                 ['SWITCH_SUPPORT',                 'switch_support_1u',                 'switch_support_1.5u'                ]]:
+                 ['SWITCH_PROJECTION_INNER',        'switch_projection_inner_1u',        'switch_projection_inner_1.5u'       ]]:
         bpy.ops.object.select_all(action='DESELECT')
-        if (key>3):
+        if (thumb_key.size > 1):
             bpy.ops.object.add_named(name = tool[2])
         else:
             bpy.ops.object.add_named(name = tool[1])
-        bpy.context.selected_objects[-1].name = tool[0].lower() + tool_identifier
-        bpy.data.collections[tool[0]].objects.link(bpy.data.objects[tool[0].lower() + tool_identifier])
-        bpy.context.collection.objects.unlink(bpy.data.objects[tool[0].lower() + tool_identifier])
+        tool_object = bpy.context.selected_objects[-1]
+        tool_object.name = tool[0].lower() + tool_identifier
+        bpy.data.collections[tool[0]].objects.link(tool_object)
+        bpy.context.collection.objects.unlink(tool_object)
+        thumb_key.tools[tool[0]] = tool_object
+    thumb_key.axis = thumb_key.tools['AXIS']
 
        
     # Select all tools
     bpy.ops.object.select_all(action='DESELECT')
-    for tool in ['AXIS', 'KEYCAP_PROJECTION_OUTER', 'KEYCAP_PROJECTION_INNER', 'SWITCH_PROJECTION', 'SWITCH_PROJECTION_INNER',  'SWITCH_HOLE', 'SWITCH_SUPPORT']:
-        bpy.data.objects[tool.lower() + tool_identifier].select_set(True)
+    for tool_object in thumb_key.tools.values():
+        tool_object.select_set(True)
 
     # Apply rotation    
     bpy.ops.transform.rotate(value=-radians(th_layout[key][0][0]), orient_axis='X', center_override=(0.0, 0.0, 0.0))
@@ -334,6 +1054,29 @@ for key in range(len(th_layout)):
 
 
 
+
+##########################
+## SWITCH HOLE OPERANDS ##
+##########################
+
+# Switch holes and supports are only ever boolean operands, so rather than an object per key in a
+# collection each is one mesh holding every key's copy of its template, placed by the key frames
+wide_turn = np.array(mathutils.Matrix.Rotation(1.5708, 4, 'Z'))
+
+def build_key_operand(name: str, template: str, turn_wide: bool):
+    parts = []
+    for size in [1, 1.5]:
+        template_object = bpy.data.objects[template + '_' + str(size) + 'u']
+        matrices = [np.array(key.axis.matrix_basis) @ (wide_turn if turn_wide and key.column is not None else np.identity(4)) @ np.array(template_object.matrix_basis)
+                    for key in keys if key.size == size]
+        parts.append(instance_arrays(*mesh_arrays(template_object.data), matrices))
+    return build_mesh_object(name, *concatenate_arrays(parts))
+
+switch_holes = build_key_operand('switch_holes', 'switch_hole', True)
+switch_supports = build_key_operand('switch_supports', 'switch_support', False)
+
+
+
 bpy.ops.object.select_all(action='DESELECT')
 
 for shape in ['keycap_projection_outer_', 'keycap_projection_inner_', 'switch_projection_', 'switch_projection_inner_', 'switch_hole_', 'switch_support_']:
@@ -347,11 +1090,223 @@ with suppress_stdout(): bpy.ops.object.delete()
 
 
 
+#####################
+## Finger Topology ##
+#####################
+
+# Boundary, bridge and correction vertices of the finger plate grid, derived from the key mask
+# (present[column][row]) in one pass over the keys. Grid vertex (u, w) is u*2*nrows + w; key
+# (column, row) owns u in 2*column, 2*column+1 (+x) and w in 2*row, 2*row+1 (-y). Every column
+# needs a contiguous run of keys from row 0, and the thumb bridges hang under columns 0-3, so
+# their bottoms may only step down to the right.
+def finger_topology(nrows: int, ncols: int, present) -> dict:
+    if ncols < 4:
+        raise ValueError("the thumb bridges need at least 4 finger columns")
+    bottoms = []
+    for column in range(ncols):
+        rows = [row for row in range(nrows) if present[column][row]]
+        if not rows or rows[0] != 0 or len(rows) != rows[-1] + 1:
+            raise ValueError("column " + str(column) + " needs contiguous keys from row 0")
+        bottoms.append(2 * rows[-1] + 1)
+    if any(bottoms[column] < bottoms[column - 1] for column in [1, 2, 3]):
+        raise ValueError("the bottoms of columns 0-3 may only step down to the right")
+
+    # Walk the bottom edge from the bottom-left corner; a step down fills the notch corner with a
+    # triangle, a step up with a face spanning the higher column's bottom edge, which it skips
+    walk, corrections = [], []
+    for column in range(ncols):
+        left, right = (2 * column, bottoms[column]), (2 * column + 1, bottoms[column])
+        if column > 0 and bottoms[column] < bottoms[column - 1]:
+            corrections.append((walk[-1], right))
+        else:
+            if column > 0 and bottoms[column] > bottoms[column - 1]:
+                corrections.append((walk[-1], (2 * column, bottoms[column - 1] + 1)))
+                walk += [(2 * column, w) for w in range(bottoms[column - 1] + 1, bottoms[column])]
+            walk.append(left)
+        walk.append(right)
+
+    bridge = [walk.index((2 * column, bottoms[column])) for column in [1, 2, 3]]
+    chains = {'finger_TOP':    [(u, 0) for u in range(2 * ncols)],
+              'finger_LEFT':   [(0, w) for w in range(bottoms[0] + 1)],
+              'finger_RIGHT':  [(2 * ncols - 1, w) for w in range(bottoms[-1] + 1)],
+              'finger_BOTTOM': walk[bridge[2]:],
+              'BRIDGE_LEFT':   walk[:bridge[0] + 1],
+              'BRIDGE_MID':    walk[bridge[0]:bridge[1] + 1],
+              'BRIDGE_RIGHT':  walk[bridge[1]:bridge[2] + 1]}
+
+    # Vertex group seeds as the plate stage assigns them, the sides by their two ends
+    seeds = [[side, [chains[side][0], chains[side][-1]]] for side in ['finger_TOP', 'finger_LEFT', 'finger_RIGHT', 'finger_BOTTOM']]
+    seeds += [['finger_corner_BL',    [walk[0]]],
+              ['finger_corner_TL',    [(0, 0)]],
+              ['finger_corner_TR',    [(2 * ncols - 1, 0)]],
+              ['finger_corner_BR',    [walk[-1]]]]
+    seeds += [[side, [chains[side][0], chains[side][-1]]] for side in ['BRIDGE_LEFT', 'BRIDGE_MID', 'BRIDGE_RIGHT']]
+    seeds += [['BRIDGE_LEFT_RING_0',  [walk[0]]],
+              ['BRIDGE_RIGHT_RING_0', [walk[bridge[2]]]]]
+    return {'bottoms': bottoms, 'chains': chains, 'seeds': seeds, 'corrections': corrections}
+
+
+
+####################
+## Thumb Topology ##
+####################
+
+# Slots, faces and vertex groups of the thumb plate for any number of thumb keys (frames are their
+# 4x4 key axis matrices). Two keys share a column when, in each of their key frames, their centres
+# lie less than column_gap apart across and at most two key heights apart along it, so the columns
+# follow the keys' own rotations rather than one axis for the whole cluster. Columns are ordered
+# left to right along the cluster's mean key x axis, rows top first, and slot (column, row) owns
+# grid vertices (i, j) like the finger grid. Neighbouring slots get a web face, and where a run of
+# shorter columns meets a taller one the notch below it is fanned from the taller column's edge.
+# The bridges to the finger plate hang off the top of the last two columns.
+def thumb_topology(frames, column_gap: float) -> dict:
+    frames = np.asarray(frames, dtype=float)
+    centres, x_axes, y_axes = frames[:, :3, 3], frames[:, :3, 0], frames[:, :3, 1]
+    column_of = list(range(len(frames)))
+    def root(key):
+        while column_of[key] != key:
+            key = column_of[key]
+        return key
+    for a in range(len(frames)):
+        for b in range(a + 1, len(frames)):
+            offset = centres[b] - centres[a]
+            if all(abs(offset @ x_axes[key]) < column_gap and abs(offset @ y_axes[key]) < 4 * column_gap for key in [a, b]):
+                column_of[root(b)] = root(a)
+
+    members = {}
+    for key in range(len(frames)):
+        members.setdefault(root(key), []).append(key)
+    across = x_axes.sum(axis=0)
+    columns = sorted(members.values(), key=lambda column: np.mean(centres[column] @ across))
+    slots, keys = [None] * len(frames), {}
+    for column, column_keys in enumerate(columns):
+        along = y_axes[column_keys].sum(axis=0)
+        for row, key in enumerate(sorted(column_keys, key=lambda key: -centres[key] @ along)):
+            slots[key], keys[(column, row)] = (column, row), key
+    heights = [len(column_keys) for column_keys in columns]
+    count = len(heights)
+    if count < 3:
+        raise ValueError("th_layout places its thumb keys in " + str(count) + " columns " + str(columns) +
+                         ", the thumb bridges need at least 3 side by side")
+
+    vertices = [(2 * column + i, 2 * row + j) for column, row in slots for i, j in [(0, 0), (1, 0), (1, 1), (0, 1)]]
+    faces = [[(i, j + 1), (i + 1, j + 1), (i + 1, j), (i, j)] for i, j in [(2 * column, 2 * row) for column, row in slots]]
+    webs = set()
+    for column, row in slots:
+        right, below, diagonal = (column + 1, row) in keys, (column, row + 1) in keys, (column + 1, row + 1) in keys
+        webs |= {face for face, linked in [((2 * column + 1, 2 * row), right), ((2 * column, 2 * row + 1), below),
+                                           ((2 * column + 1, 2 * row + 1), right and below and diagonal)] if linked}
+
+    # Runs of equal height; a run lower than its left (right) neighbour is fanned from that column's
+    # right (left) edge, and the junctions under the step merge with the web face above them
+    runs, start = [], 0
+    for column in range(1, count + 1):
+        if column == count or heights[column] != heights[start]:
+            runs.append((start, column - 1, heights[start]))
+            start = column
+    corrections, junctions = [], {}
+    include_left, include_right = [True] * count, [True] * count
+    for start, end, height in runs:
+        step_up = start > 0 and heights[start - 1] > height
+        step_down = end < count - 1 and heights[end + 1] > height
+        if step_up and step_down:
+            raise ValueError("thumb columns " + str(start) + "-" + str(end) + " are lower than both neighbours")
+        if step_up:
+            column, sign = start - 1, 1
+            edge = [(2 * column + 1, w) for w in range(2 * height, 2 * heights[column])]
+            notch = [(i, 2 * height - 1) for i in range(2 * start, 2 * end + 2)]
+            include_left[start:end + 1] = [False] * (end - start + 1)
+            include_right[start:end] = [False] * (end - start)
+        elif step_down:
+            column, sign = end + 1, -1
+            edge = [(2 * column, w) for w in range(2 * height, 2 * heights[column])]
+            notch = [(i, 2 * height - 1) for i in range(2 * end + 1, 2 * start - 1, -1)]
+            include_right[start:end + 1] = [False] * (end - start + 1)
+            include_left[start + 1:end + 1] = [False] * (end - start)
+        else:
+            continue
+        junctions.setdefault((column, height), set()).add(sign)
+        # Zip the taller column's edge to the notch, each notch segment with the edge vertices nearest it
+        segments = len(notch) - 1
+        spans = [int(segment * (len(edge) - 1) / segments + 0.5) for segment in range(segments + 1)]
+        for segment in range(segments):
+            corrections.append([notch[segment], notch[segment + 1]] + edge[spans[segment]:spans[segment + 1] + 1][::-1])
+    for (column, height), signs in junctions.items():
+        webs.discard((2 * column, 2 * height - 1))
+        bottom = [(2 * column + sign, 2 * height - 1) for sign in [-1] if sign in signs] + [(2 * column, 2 * height - 1), (2 * column + 1, 2 * height - 1)]
+        corrections.append(bottom + [(2 * column + 2, 2 * height - 1) for sign in [1] if sign in signs] + [(2 * column + 1, 2 * height), (2 * column, 2 * height)])
+    faces += [[(i, j + 1), (i + 1, j + 1), (i + 1, j), (i, j)] for i, j in sorted(webs)]
+
+    # Wind every face counter-clockwise in grid space (i, -j), which is upward on the plate
+    for face in faces + corrections:
+        area = sum(a[0] * -b[1] - b[0] * -a[1] for a, b in zip(face, face[1:] + face[:1]))
+        if area < 0:
+            face.reverse()
+
+    # Bottom edge from the bottom-left corner to the bottom-right one, across the fans' open sides
+    walk = []
+    for column in range(count):
+        bottom = 2 * heights[column] - 1
+        walk += [vertex for vertex, kept in [((2 * column, bottom), include_left[column]), ((2 * column + 1, bottom), include_right[column])] if kept]
+    last = 2 * count - 1
+    chains = {'thumb_LEFT':   [(i, 0) for i in range(last - 3)],
+              'thumb_RIGHT':  [(last, j) for j in range(1, 2 * heights[-1] - 1)] + walk[::-1],
+              'thumb_BOTTOM': [(0, j) for j in range(2 * heights[0])],
+              'BRIDGE_LEFT':  [(last - 3, 0), (last - 2, 0), (last - 1, 0)],
+              'BRIDGE_MID':   [(last - 1, 0), (last, 0), (last, 1)],
+              'BRIDGE_RIGHT': [(last, 1)]}
+    groups = [['key_thumb', vertices]] + [[side, chains[side]] for side in ['thumb_LEFT', 'thumb_RIGHT', 'thumb_BOTTOM']]
+    groups += [['thumb_corner_TL',     [(last - 3, 0)]],
+               ['thumb_corner_TLL',    [(last - 4, 0)]],
+               ['thumb_corner_ML',     [(last - 5, 0)]],
+               ['thumb_corner_BL',     [(0, 0)]],
+               ['thumb_corner_BR',     [walk[0]]]]
+    groups += [[side, chains[side]] for side in ['BRIDGE_LEFT', 'BRIDGE_MID', 'BRIDGE_RIGHT']]
+    groups += [['BRIDGE_LEFT_RING_0',  [(last - 4, 0), (last - 3, 0)]],
+               ['BRIDGE_RIGHT_RING_0', [(last, 1)]]]
+    return {'slots': slots, 'keys': keys, 'heights': heights, 'vertices': vertices, 'faces': faces,
+            'corrections': corrections, 'chains': chains, 'groups': groups}
+
+
+
+####################
+## Wall Smoothing ##
+####################
+
+# Taubin smoothing: alternating lambda/mu Laplacian passes over the (m, 2) edges, moving only the
+# movable vertices of the (n, 3) coordinates. The mu pass inflates back what the lambda pass
+# shrinks, so the walls relax without pulling inward.
+def taubin_smooth(co, edges, movable, iterations: int, lam: float = 0.5, mu: float = -0.53):
+    co = np.array(co, dtype=float)
+    count = len(co)
+
+    # Adjacency restricted to edges that touch a movable vertex, built once for all passes: the flat
+    # x, y, z slots each edge end adds its neighbour to, so one bincount sums all three axes.
+    # Pinned vertices get zero weight and stay where they are.
+    edges = edges[movable[edges[:, 0]] | movable[edges[:, 1]]]
+    targets = (np.concatenate([edges[:, 0], edges[:, 1]])[:, None] * 3 + np.arange(3)).ravel()
+    sources = np.concatenate([edges[:, 1], edges[:, 0]])
+    weight = (movable / np.maximum(np.bincount(edges.ravel(), minlength=count), 1))[:, None]
+    moving = movable[:, None]
+    for iteration in range(iterations):
+        for factor in [lam, mu]:
+            neighbour_sum = np.bincount(targets, co[sources].ravel(), 3 * count).reshape(-1, 3)
+            co += factor * (neighbour_sum * weight - co * moving)
+    return co
+
+
+
 ##################
 ## FINGER PLATE ##
 ##################
 
-print("{:.2f}".format(time.time()-start_time), "- Generate Finger Plate")
+stage("Generate Finger Plate")
+
+topology = finger_topology(nrows, ncols, [[key_present(column, row) for row in range(nrows)] for column in range(ncols)])
+
+# The thumb columns are grouped before any plate is built, so a cluster the bridges cannot reach fails here
+thumb_keys = [key_by_position[(None, thumb)] for thumb in range(len(th_layout))]
+thumb_plate_topology = thumb_topology([np.array(thumb_key.axis.matrix_basis) for thumb_key in thumb_keys], mount_height / 2)
 
 bpy.ops.mesh.primitive_grid_add(x_subdivisions=2*nrows-1, y_subdivisions=2*ncols-1, size=1, rotation=(0, 0, -pi/2))
 bpy.ops.transform.resize(value=(2*ncols-1, 2*nrows-1, 1))
@@ -369,27 +1324,24 @@ grid_mesh.edges.ensure_lookup_table()
 grid_mesh.faces.ensure_lookup_table()
 
             
-for column in range(ncols):
-    for row in range(nrows):
-        if (column in [2, 3]) or (not row == lastrow):
+for key in keys:
+    if key.column is not None:
             
-            face_is_a_key.append(row * 2 + column* 2*(2*nrows-1))            
+            face_is_a_key.append(key.row * 2 + key.column* 2*(2*nrows-1))            
             grid_mesh.faces[face_is_a_key[-1]].select = True
             
             bpy.ops.object.vertex_group_assign_new()
-            bpy.data.objects['finger_plate'].vertex_groups['Group'].name = 'switch - '+ str(column) + ', ' + str(row)
+            bpy.data.objects['finger_plate'].vertex_groups['Group'].name = key.groups['switch']
 
-            switch_size = 1
-            if column==ncols-1 and wide_pinky: switch_size = 1.5
-            bpy.ops.transform.resize(value=(mount_height*switch_size + 0.25, mount_width + 0.25, 1))
+            bpy.ops.transform.resize(value=(mount_height*key.size + 0.25, mount_width + 0.25, 1))
                         
             bpy.ops.transform.translate(value=-grid_mesh.faces[face_is_a_key[-1]].calc_center_median(), orient_type='GLOBAL')
             bpy.ops.transform.translate(value=(0, 0, mount_thickness+key_well_offset), orient_type='GLOBAL')
             
-            bpy.ops.transform.rotate(value=-bpy.data.objects['axis - '+ str(column) + ', ' + str(row)].rotation_euler[0], orient_axis='X', center_override=(0.0, 0.0, 0.0))
-            bpy.ops.transform.rotate(value=-bpy.data.objects['axis - '+ str(column) + ', ' + str(row)].rotation_euler[1], orient_axis='Y', center_override=(0.0, 0.0, 0.0))
-            bpy.ops.transform.rotate(value=-bpy.data.objects['axis - '+ str(column) + ', ' + str(row)].rotation_euler[2], orient_axis='Z', center_override=(0.0, 0.0, 0.0))
-            bpy.ops.transform.translate(value=bpy.data.objects['axis - '+ str(column) + ', ' + str(row)].location, orient_type='GLOBAL')
+            bpy.ops.transform.rotate(value=-key.axis.rotation_euler[0], orient_axis='X', center_override=(0.0, 0.0, 0.0))
+            bpy.ops.transform.rotate(value=-key.axis.rotation_euler[1], orient_axis='Y', center_override=(0.0, 0.0, 0.0))
+            bpy.ops.transform.rotate(value=-key.axis.rotation_euler[2], orient_axis='Z', center_override=(0.0, 0.0, 0.0))
+            bpy.ops.transform.translate(value=key.axis.location, orient_type='GLOBAL')
             bpy.ops.mesh.select_all(action='DESELECT')
 
 
@@ -406,35 +1358,22 @@ bpy.ops.mesh.select_all(action='DESELECT')
 
 
 # Create vertex group faces
-for side in [['finger_TOP',          [0, nrows*(ncols-1)*4 + nrows*2]],
-             ['finger_LEFT',         [0, nrows*2-3]],
-             ['finger_RIGHT',        [nrows*(ncols-1)*4 + nrows*2, nrows*ncols*4-3]],
-             ['finger_BOTTOM',       [nrows*14-1, nrows*ncols*4-3]],
-             ['finger_corner_BL',    [nrows*2-3]],
-             ['finger_corner_TL',    [0]],
-             ['finger_corner_TR',    [nrows*(ncols-1)*4 + nrows*2]],
-             ['finger_corner_BR',    [nrows*ncols*4-3]],
-             ['BRIDGE_LEFT',         [nrows*2-3, nrows*6-3]],
-             ['BRIDGE_MID',          [nrows*6-3, nrows*10-1]],
-             ['BRIDGE_RIGHT',        [nrows*10-1, nrows*14-1]],
-             ['BRIDGE_LEFT_RING_0',  [nrows*2-3]],
-             ['BRIDGE_RIGHT_RING_0', [nrows*14-1]]]:
+for side in topology['seeds']:
 
     bpy.ops.object.vertex_group_set_active(group=side[0])
     for vertex in side[1]:
-        grid_mesh.verts[vertex].select = True
+        grid_mesh.verts[vertex[0]*2*nrows + vertex[1]].select = True
     bpy.ops.object.vertex_group_assign()
     bpy.ops.mesh.select_all(action='DESELECT')
 
 
 # Create temporary vertex groups for adding faces
-for side in [['CORRECTION_1', [nrows*8 - 3,  nrows*10 - 2]],
-             ['CORRECTION_2', [nrows*16 - 1, nrows*20 - 3]]]:
+for number, correction in enumerate(topology['corrections']):
 
-    for vertex in side[1]:
-        grid_mesh.verts[vertex].select = True
+    for vertex in correction:
+        grid_mesh.verts[vertex[0]*2*nrows + vertex[1]].select = True
     bpy.ops.object.vertex_group_assign_new()
-    bpy.data.objects['finger_plate'].vertex_groups['Group'].name = side[0]
+    bpy.data.objects['finger_plate'].vertex_groups['Group'].name = 'CORRECTION_' + str(number + 1)
     bpy.ops.mesh.select_all(action='DESELECT')
 
 
@@ -448,7 +1387,7 @@ bpy.ops.mesh.select_mode(type="VERT")
 
 
 # Add correction faces
-for side in ['CORRECTION_1', 'CORRECTION_2']:
+for side in ['CORRECTION_' + str(number + 1) for number in range(len(topology['corrections']))]:
     bpy.ops.object.vertex_group_set_active(group=side)
     bpy.ops.object.vertex_group_select()
     bpy.ops.mesh.shortest_path_select(edge_mode='SELECT')
@@ -476,123 +1415,49 @@ bpy.ops.object.transform_apply(location=True, rotation=True, scale=True)
 ## THUMB PLATE ##
 #################
 
-print("{:.2f}".format(time.time()-start_time), "- Generate Thumb Plate")
+stage("Generate Thumb Plate")
 
-#bpy.ops.object.select_all(action='DESELECT')
+topology = thumb_plate_topology
 
-bpy.ops.mesh.primitive_grid_add(x_subdivisions=3, y_subdivisions=7, size=1, location=(0, 0, mount_thickness), rotation=(0, 0, -pi/2))
-bpy.ops.transform.resize(value=(7, 3, 1), orient_type='GLOBAL', orient_matrix=((1, 0, 0), (0, 1, 0), (0, 0, 1)), orient_matrix_type='GLOBAL', constraint_axis=(False, True, False), mirror=True, use_proportional_edit=False, proportional_edit_falloff='SMOOTH', proportional_size=1, use_proportional_connected=False, use_proportional_projected=False)
-bpy.ops.object.transform_apply(location=True, rotation=True, scale=True)
-bpy.context.selected_objects[0].name = "thumb_plate"
+# Key face corners in their key frames, lifted by key_well_offset twice like the finger plate
+corners = []
+for thumb_key in thumb_keys:
+    half_width, half_height = (mount_height + 0.25) / 2, (mount_height*thumb_key.size + 0.25) / 2
+    local = np.array([[-half_width,  half_height, mount_thickness + 2*key_well_offset, 1],
+                      [ half_width,  half_height, mount_thickness + 2*key_well_offset, 1],
+                      [ half_width, -half_height, mount_thickness + 2*key_well_offset, 1],
+                      [-half_width, -half_height, mount_thickness + 2*key_well_offset, 1]])
+    corners.append((local @ np.array(thumb_key.axis.matrix_basis).T)[:, :3])
 
+vertex_index = {vertex: number for number, vertex in enumerate(topology['vertices'])}
+polygons = topology['faces'] + topology['corrections']
+thumb_plate = build_mesh_object('thumb_plate', np.concatenate(corners),
+                                np.array([vertex_index[vertex] for polygon in polygons for vertex in polygon]),
+                                np.array([len(polygon) for polygon in polygons]))
 
-bpy.ops.object.mode_set(mode = 'EDIT')
-bpy.ops.mesh.select_all(action='DESELECT')
-    
-grid_mesh = bmesh.from_edit_mesh(bpy.context.object.data)
-grid_mesh.verts.ensure_lookup_table()
-grid_mesh.edges.ensure_lookup_table()
-grid_mesh.faces.ensure_lookup_table()
-
-
-faces_to_use = [0, 2, 6, 8, 12, 18]
-
-# Apply transfomations to each key face
-for thumb in range(len(faces_to_use)):
-    grid_mesh.faces[faces_to_use[thumb]].select = True
-    
-    bpy.ops.object.vertex_group_assign_new()
-    bpy.data.objects['thumb_plate'].vertex_groups['Group'].name = 'switch - thumb - ' + str(thumb)
-    
-    switch_size = 1
-    if thumb>3: switch_size = 1.5               
-    bpy.ops.transform.resize(value=(mount_height+0.25, mount_height*switch_size+0.25, 1))
-    
-    bpy.ops.transform.translate(value=-grid_mesh.faces[faces_to_use[thumb]].calc_center_median(), orient_type='GLOBAL')
-    bpy.ops.transform.translate(value=(0, 0, mount_thickness+key_well_offset), orient_type='GLOBAL')
 
-    bpy.ops.transform.rotate(value=-bpy.data.objects['axis - thumb - ' + str(thumb)].rotation_euler[0], orient_axis='X', center_override=(0.0, 0.0, 0.0))
-    bpy.ops.transform.rotate(value=-bpy.data.objects['axis - thumb - ' + str(thumb)].rotation_euler[1], orient_axis='Y', center_override=(0.0, 0.0, 0.0))
-    bpy.ops.transform.rotate(value=-bpy.data.objects['axis - thumb - ' + str(thumb)].rotation_euler[2], orient_axis='Z', center_override=(0.0, 0.0, 0.0))
-    bpy.ops.transform.translate(value=bpy.data.objects['axis - thumb - ' + str(thumb)].location, orient_type='GLOBAL', orient_matrix=((1, 0, 0), (0, 1, 0), (0, 0, 1)), orient_matrix_type='GLOBAL', mirror=True, use_proportional_edit=False, proportional_edit_falloff='SMOOTH', proportional_size=1, use_proportional_connected=False, use_proportional_projected=False)
-
-    bpy.ops.transform.translate(value=(0, 0, key_well_offset), orient_type='NORMAL', orient_matrix=((1, 0, 0), (0, 1, 0), (0, 0, 1)), orient_matrix_type='GLOBAL', constraint_axis=(True, True, True), mirror=True, use_proportional_edit=False, proportional_edit_falloff='SMOOTH', proportional_size=0.001, use_proportional_connected=False, use_proportional_projected=False)
-    
-    bpy.ops.mesh.select_all(action='DESELECT')
+# Vertex groups - switches, then the sides, corners and bridges
+for number, thumb_key in enumerate(thumb_keys):
+    thumb_plate.vertex_groups.new(name=thumb_key.groups['switch']).add(list(range(4*number, 4*number + 4)), 1.0, 'REPLACE')
+for side in topology['groups']:
+    thumb_plate.vertex_groups.new(name=side[0]).add([vertex_index[vertex] for vertex in side[1]], 1.0, 'REPLACE')
 
 
-for vertex_group_name in ['key_thumb', 'thumb_LEFT', 'thumb_RIGHT', 'thumb_BOTTOM', 'thumb_corner_TL', 'thumb_corner_TLL', 'thumb_corner_ML', 'thumb_corner_BL', 'thumb_corner_BR', 'BRIDGE_LEFT', 'BRIDGE_MID', 'BRIDGE_RIGHT', 'BRIDGE_LEFT_RING_0', 'BRIDGE_RIGHT_RING_0']:
-    bpy.ops.object.vertex_group_assign_new()
-    bpy.data.objects['thumb_plate'].vertex_groups['Group'].name = vertex_group_name
+# Triangulate the correction faces
+bpy.ops.object.select_all(action='DESELECT')
+bpy.context.view_layer.objects.active = thumb_plate
+thumb_plate.select_set(True)
+bpy.ops.object.mode_set(mode = 'EDIT')
+bpy.ops.mesh.select_all(action='DESELECT')
 
-# Remove unused faces
-grid_mesh.faces.ensure_lookup_table()
-for num in faces_to_use:
-    grid_mesh.faces[num].select = True
-bpy.ops.mesh.select_mode(type="VERT")
-bpy.ops.mesh.select_all(action='INVERT')
-bpy.ops.mesh.delete(type='VERT')
+grid_mesh = bmesh.from_edit_mesh(thumb_plate.data)
 grid_mesh.faces.ensure_lookup_table()
-grid_mesh.faces[7].select = True
-bpy.ops.mesh.delete(type='FACE')
-
-
-
-# Add correction faces
-grid_mesh.verts.ensure_lookup_table()
-for correction in [[15, 21, 23],
-                   [14, 15, 19, 21],
-                   [14, 17, 19],
-                   [ 9, 10, 13, 14, 17]]:
-    for vertex in correction:
-        grid_mesh.verts[vertex].select = True
-    bpy.ops.mesh.edge_face_add()
-    bpy.ops.mesh.quads_convert_to_tris(quad_method='BEAUTY', ngon_method='BEAUTY')
-    bpy.ops.mesh.select_all(action='DESELECT')
-
-
-
-# Vertex Group - key
-bpy.ops.mesh.select_all(action='SELECT')
-bpy.ops.object.vertex_group_set_active(group='key_thumb')
-bpy.ops.object.vertex_group_assign()
+for face in range(len(topology['faces']), len(polygons)):
+    grid_mesh.faces[face].select = True
+bpy.ops.mesh.quads_convert_to_tris(quad_method='BEAUTY', ngon_method='BEAUTY')
 bpy.ops.mesh.select_all(action='DESELECT')
 
-
-
-# Create vertex group faces
-for side in [['thumb_LEFT',   [0, 12]],
-             ['thumb_RIGHT',  [3, 23]],
-             ['thumb_BOTTOM', [0, 3]],
-             ['thumb_corner_TL',  [16]],
-             ['thumb_corner_TLL', [12]],
-             ['thumb_corner_ML',  [8]],
-             ['thumb_corner_BL',  [0]],
-             ['thumb_corner_BR',  [3]],
-             ['BRIDGE_LEFT',         [16, 20]],
-             ['BRIDGE_MID',          [20, 23]],
-             ['BRIDGE_RIGHT',        [23]],
-             ['BRIDGE_LEFT_RING_0',  [12, 16]],
-             ['BRIDGE_RIGHT_RING_0', [23]]]:
-
-    bpy.ops.object.vertex_group_set_active(group=side[0])
-    for vertex in side[1]:
-        grid_mesh.verts[vertex].select = True
-    bpy.ops.object.vertex_group_assign()
-    bpy.ops.mesh.select_all(action='DESELECT')
-
-
-
-# Add connecting edges to vertex groups
-for side in ['thumb_LEFT', 'thumb_RIGHT', 'thumb_BOTTOM', 'BRIDGE_LEFT', 'BRIDGE_MID']:
-    bpy.ops.object.vertex_group_set_active(group=side)
-    bpy.ops.object.vertex_group_select()
-    bpy.ops.mesh.shortest_path_select(edge_mode='SELECT', use_topology_distance=True)
-    bpy.ops.object.vertex_group_assign()
-    bpy.ops.mesh.select_all(action='DESELECT')
-
 bpy.ops.object.mode_set(mode = 'OBJECT')
-bpy.ops.object.transform_apply(location=True, rotation=True, scale=True)
 
 
 
@@ -601,7 +1466,7 @@ bpy.ops.object.transform_apply(location=True, rotation=True, scale=True)
 ## CONNECT PLATES ##
 ####################
 
-print("{:.2f}".format(time.time()-start_time), "- Connect Finger and Thumb Plates")
+stage("Connect Finger and Thumb Plates")
 
 # Join finger_plate and thumb_plate meshes
 bpy.data.objects["thumb_plate"].select_set(True)
@@ -629,7 +1494,7 @@ for bridge in ['BRIDGE_MID', 'BRIDGE_LEFT', 'BRIDGE_RIGHT']:
 ## CASE WALLS ##
 ################
 
-print("{:.2f}".format(time.time()-start_time), "- Generate Body Walls")
+stage("Generate Body Walls")
 
 # Vertex Group - RING_0
 bpy.ops.mesh.select_non_manifold()
@@ -638,116 +1503,91 @@ bpy.ops.object.vertex_group_assign()
 bpy.ops.mesh.select_all(action='DESELECT')
 
 
-# Construct Ring Skeleton
-for build_edge in [ ['finger_TOP',    [[wall_thickness, -1],
-                                       [wall_xy_offset + wall_thickness, wall_z_offset], 
-                                       [wall_xy_offset + wall_thickness, wall_z_offset -1.5 - wall_thickness]]],
-                    ['finger_RIGHT',  [[wall_thickness, -1],
-                                       [wall_xy_offset + wall_thickness, wall_z_offset], 
-                                       [wall_xy_offset + wall_thickness+1, wall_z_offset-10]]],
-                    ['finger_LEFT',   [[wall_thickness, -1],
-                                       [left_wall_x_offset+wall_thickness+1.5, -2.5-left_wall_x_offset], 
-                                       [left_wall_x_offset+wall_thickness-1.5, -2.5-3*left_wall_x_offset]]],
-                    ['finger_BOTTOM', [[wall_thickness, -1],
-                                       [wall_xy_offset + wall_thickness, wall_z_offset], 
-                                       [wall_xy_offset + wall_thickness, wall_z_offset -1.5 - wall_thickness]]],
-                    ['thumb_BOTTOM',  [[wall_thickness, -1],
-                                       [wall_xy_offset + wall_thickness, wall_z_offset], 
-                                       [wall_xy_offset + wall_thickness, wall_z_offset -1.5 - wall_thickness]]],
-                    ['thumb_LEFT',    [[wall_thickness, -1],
-                                       [wall_xy_offset + wall_thickness, wall_z_offset], 
-                                       [wall_xy_offset + wall_thickness, wall_z_offset -1.5 - wall_thickness]]],
-                    ['thumb_RIGHT',  [[wall_thickness, -1],
-                                       [wall_xy_offset + wall_thickness, wall_z_offset], 
-                                       [wall_xy_offset + wall_thickness, wall_z_offset -1.5 - wall_thickness]]]]:
-    for ring_num in range(0, 3):
-        bpy.ops.object.vertex_group_set_active(group=build_edge[0])
-        bpy.ops.object.vertex_group_select()
-        with suppress_stdout():
-            bpy.ops.mesh.offset_edges( width=build_edge[1][ring_num][0], depth=build_edge[1][ring_num][1], depth_mode='depth', follow_face=True, mirror_modifier=False, edge_rail=False, caches_valid=False)
-        bpy.ops.object.vertex_group_set_active(group='RING_' + str(ring_num+1))
-        bpy.ops.object.vertex_group_assign()
-        for group in ['key_finger', 'key_thumb', 'finger_LEFT', 'finger_TOP', 'finger_RIGHT', 'finger_BOTTOM', 'thumb_BOTTOM', 'thumb_LEFT', 'thumb_RIGHT', 'RING_0', 'RING_' + str(ring_num)]:
-            bpy.ops.object.vertex_group_set_active(group=group)
-            bpy.ops.object.vertex_group_remove_from()
-        bpy.ops.mesh.select_all(action='DESELECT')
-
-
-# Connect Rings
-for corner in ['finger_corner_BL', 'finger_corner_TL', 'finger_corner_TR', 'finger_corner_BR', 'thumb_corner_BL', 'thumb_corner_BR', 'BRIDGE_RIGHT_RING_0']:
-    for ring_num in range(1,4):
-        bpy.ops.object.vertex_group_set_active(group=corner)
-        bpy.ops.object.vertex_group_select()
-        for ring_group in range(0,4):
-            if ring_num != ring_group:
-                bpy.ops.object.vertex_group_set_active(group="RING_" + str(ring_group))
-                bpy.ops.object.vertex_group_deselect()
-        bpy.ops.mesh.edge_face_add()
+# Wall ring profiles: [width, depth] of rings 1-3 measured from the plate edge, per plate side
+def wall_profiles(wall_thickness, wall_xy_offset, wall_z_offset, left_wall_x_offset) -> dict:
+    regular = [[wall_thickness, -1],
+               [wall_xy_offset + wall_thickness, wall_z_offset],
+               [wall_xy_offset + wall_thickness, wall_z_offset -1.5 - wall_thickness]]
+    return {'finger_TOP':    regular,
+            'finger_RIGHT':  [[wall_thickness, -1],
+                              [wall_xy_offset + wall_thickness, wall_z_offset],
+                              [wall_xy_offset + wall_thickness+1, wall_z_offset-10]],
+            'finger_LEFT':   [[wall_thickness, -1],
+                              [left_wall_x_offset+wall_thickness+1.5, -2.5-left_wall_x_offset],
+                              [left_wall_x_offset+wall_thickness-1.5, -2.5-3*left_wall_x_offset]],
+            'finger_BOTTOM': regular,
+            'thumb_BOTTOM':  regular,
+            'thumb_LEFT':    regular,
+            'thumb_RIGHT':   regular}
+
+
+def normalized(vectors):
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-9)
+
+
+# Offset the boundary loop like offset_edges: width outward in the plate face, depth along its normal.
+# Every ring is measured from ring 0, so all three are computed in one pass. Also returns the miter
+# cosines, which are clamped at 0.5 for corners sharper than 120 degrees.
+def wall_ring_skeleton(ring_0, plate_normals, widths, depths):
+    edge_normals = normalized(plate_normals + np.roll(plate_normals, -1, axis=0))
+    edge_out = normalized(np.cross(np.roll(ring_0, -1, axis=0) - ring_0, edge_normals))
+    vertex_out = normalized(np.roll(edge_out, 1, axis=0) + edge_out)
+    cosines = np.einsum('ij,ij->i', vertex_out, edge_out)
+    miter = 1 / np.clip(cosines, 0.5, 1)
+    vertex_normals = normalized(plate_normals)
+    return [ring_0] + [ring_0 + vertex_out * (widths[:, ring_num] * miter)[:, None] + vertex_normals * depths[:, ring_num][:, None] for ring_num in range(3)], cosines
+
+
+# Walk the plate boundary once in face winding order, skipping vertices that belong to no side
+def ordered_wall_loop(plate_mesh, side_groups, deform):
+    next_vertex = {}
+    for edge in plate_mesh.edges:
+        if edge.is_boundary:
+            loop = edge.link_loops[0]
+            next_vertex[loop.vert] = loop.link_loop_next.vert
+    start = min(next_vertex, key=lambda vertex: vertex.index)
+    boundary = [start]
+    while next_vertex[boundary[-1]] is not start:
+        boundary.append(next_vertex[boundary[-1]])
+    return [vertex for vertex in boundary if any(group in vertex[deform] for group in side_groups)]
+
+
+body_object = bpy.context.object
+grid_mesh = bmesh.from_edit_mesh(body_object.data)
+grid_mesh.normal_update()
+deform = grid_mesh.verts.layers.deform.verify()
+side_groups = {body_object.vertex_groups[side].index: profile
+               for side, profile in wall_profiles(wall_thickness, wall_xy_offset, wall_z_offset, left_wall_x_offset).items()}
+dropped_groups = set(side_groups) | {body_object.vertex_groups[group].index for group in ['key_finger', 'key_thumb', 'RING_0', 'RING_1', 'RING_2', 'RING_3']}
+
+# Per-vertex ring profile, averaged where two sides meet at a corner
+wall_loop = ordered_wall_loop(grid_mesh, side_groups, deform)
+profiles = np.array([np.mean([side_groups[group] for group in side_groups if group in vertex[deform]], axis=0) for vertex in wall_loop])
+rings, _ = wall_ring_skeleton(np.array([vertex.co for vertex in wall_loop]), np.array([vertex.normal for vertex in wall_loop]), profiles[:, :, 0], profiles[:, :, 1])
+
+# Emit ring vertices, keeping corner/bridge groups of their source vertex, and the wall quads between rings
+ring_vertices = [wall_loop]
+for ring_num in range(1, 4):
+    ring_group = body_object.vertex_groups['RING_' + str(ring_num)].index
+    ring_vertices.append([])
+    for source, position in zip(wall_loop, rings[ring_num]):
+        vertex = grid_mesh.verts.new(position)
+        for group, weight in source[deform].items():
+            if group not in dropped_groups:
+                vertex[deform][group] = weight
+        vertex[deform][ring_group] = 1.0
+        ring_vertices[-1].append(vertex)
+
+    upper, lower = ring_vertices[-2], ring_vertices[-1]
+    for a in range(len(wall_loop)):
+        b = (a + 1) % len(wall_loop)
+        grid_mesh.faces.new((upper[b], upper[a], lower[a], lower[b]))
+
+bmesh.update_edit_mesh(body_object.data)
 bpy.ops.mesh.select_all(action='DESELECT')
 
 
 
-# Fill in Rings
-for ring in range(0, 3):
-    
-    if ring == 2:
-        bpy.ops.object.vertex_group_set_active(group='thumb_corner_TLL')
-        bpy.ops.object.vertex_group_select()
-        bpy.ops.object.vertex_group_set_active(group='finger_corner_BL')
-        bpy.ops.object.vertex_group_select()
-        for ring_again in range(0, 3):
-                bpy.ops.object.vertex_group_set_active(group='RING_' + str(ring_again))
-                bpy.ops.object.vertex_group_deselect()
-        bpy.ops.mesh.edge_face_add()
-    
-    bpy.ops.object.vertex_group_set_active(group='RING_' + str(ring))
-    bpy.ops.object.vertex_group_select()
-    bpy.ops.object.vertex_group_set_active(group='RING_' + str(ring+1))
-    bpy.ops.object.vertex_group_select()
-    bpy.ops.object.vertex_group_set_active(group='thumb_corner_TL')
-    bpy.ops.object.vertex_group_deselect()
-    bpy.ops.mesh.bridge_edge_loops()
-    bpy.ops.mesh.tris_convert_to_quads(face_threshold=3.14159, shape_threshold=3.14159)
-    bpy.ops.mesh.select_all(action='DESELECT')
-    
-    if ring<2:    
-        bpy.ops.object.vertex_group_set_active(group='finger_corner_BL')
-        bpy.ops.object.vertex_group_select()
-        for ring_again in range(0, 4):
-            if not (ring_again != ring) != (ring_again != ring+1)  :
-                bpy.ops.object.vertex_group_set_active(group='RING_' + str(ring_again))
-                bpy.ops.object.vertex_group_deselect()
-        bpy.ops.object.vertex_group_set_active(group='thumb_corner_TL')
-        bpy.ops.object.vertex_group_select()
-        bpy.ops.mesh.edge_face_add()
-        bpy.ops.mesh.select_all(action='DESELECT')
-        
-        bpy.ops.object.vertex_group_set_active(group='thumb_corner_TLL')
-        bpy.ops.object.vertex_group_select()
-        for ring_again in range(0, 4):
-            if not (ring_again != ring) != (ring_again != ring+1)  :
-                bpy.ops.object.vertex_group_set_active(group='RING_' + str(ring_again))
-                bpy.ops.object.vertex_group_deselect()
-        bpy.ops.object.vertex_group_set_active(group='thumb_corner_TL')
-        bpy.ops.object.vertex_group_select()
-        bpy.ops.mesh.edge_face_add()
-        bpy.ops.mesh.select_all(action='DESELECT')
-        
-        if ring == 1:
-            bpy.ops.object.vertex_group_set_active(group='thumb_corner_TLL')
-            bpy.ops.object.vertex_group_select()
-            bpy.ops.object.vertex_group_set_active(group='finger_corner_BL')
-            bpy.ops.object.vertex_group_select()
-            for ring_again in range(0, 4):
-                if ring_again != ring+1:
-                    bpy.ops.object.vertex_group_set_active(group='RING_' + str(ring_again))
-                    bpy.ops.object.vertex_group_deselect()
-            bpy.ops.object.vertex_group_set_active(group='thumb_corner_TL')
-            bpy.ops.object.vertex_group_select()
-            bpy.ops.mesh.edge_face_add()
-            bpy.ops.mesh.select_all(action='DESELECT')
-
-
 # Close Top Left Thumb Hole
 bpy.ops.object.vertex_group_set_active(group='BRIDGE_LEFT_RING_0')
 bpy.ops.object.vertex_group_select()
@@ -771,14 +1611,6 @@ bpy.ops.mesh.extrude_region_move(MESH_OT_extrude_region={"use_normal_flip":False
 bpy.ops.transform.resize(value=(1, 1, 0), orient_type='GLOBAL', orient_matrix=((1, 0, 0), (0, 1, 0), (0, 0, 1)), orient_matrix_type='GLOBAL', constraint_axis=(True, True, True), mirror=True, use_proportional_edit=False, proportional_edit_falloff='SMOOTH', proportional_size=1, use_proportional_connected=False, use_proportional_projected=False)
 bpy.ops.mesh.select_all(action='DESELECT')
 
-for vertex_group in ['finger_corner_TL', 'finger_corner_TR', 'finger_corner_BR', 'thumb_corner_BL', 'thumb_corner_BR']:
-    bpy.ops.object.vertex_group_set_active(group=vertex_group)
-    bpy.ops.object.vertex_group_select()
-for vertex_group in ['RING_0', 'RING_3', ]:
-    bpy.ops.object.vertex_group_set_active(group=vertex_group)
-    bpy.ops.object.vertex_group_deselect()
-bpy.ops.mesh.subdivide(smoothness=1)
-
 
 
 bpy.ops.mesh.select_all(action='SELECT')
@@ -793,9 +1625,27 @@ bpy.ops.object.vertex_group_select()
 bpy.ops.object.vertex_group_set_active(group='RING_3')
 bpy.ops.object.vertex_group_select()
 
+# Relax the selected vertices on foreach_get buffers. Unselected and open-boundary vertices stay
+# pinned, so the floor edge and key plates do not move.
+def relax_mesh(mesh, iterations: int):
+    co = np.empty(len(mesh.vertices) * 3)
+    mesh.vertices.foreach_get('co', co)
+    movable = np.empty(len(mesh.vertices), dtype=bool)
+    mesh.vertices.foreach_get('select', movable)
+    edges = np.empty(len(mesh.edges) * 2, dtype=np.int32)
+    mesh.edges.foreach_get('vertices', edges)
+    edges = edges.reshape(-1, 2)
+    loop_edges = np.empty(len(mesh.loops), dtype=np.int32)
+    mesh.loops.foreach_get('edge_index', loop_edges)
+    movable[edges[np.bincount(loop_edges, minlength=len(edges)) == 1].ravel()] = False
+
+    mesh.vertices.foreach_set('co', taubin_smooth(co.reshape(-1, 3), edges, movable, iterations).ravel())
+    mesh.update()
+
 if relaxed_mesh:
-    bpy.ops.mesh.vertices_smooth(factor=1, wait_for_input=False)
-    with suppress_stdout(): bpy.ops.mesh.relax()
+    bpy.ops.object.mode_set(mode = 'OBJECT')
+    relax_mesh(bpy.context.object.data, relax_iterations)
+    bpy.ops.object.mode_set(mode = 'EDIT')
 
 for vertex_group in ['finger_corner_TL', 'finger_corner_TR', 'finger_corner_BR', 'thumb_corner_BL', 'thumb_corner_BR']:
     bpy.ops.object.vertex_group_set_active(group=vertex_group)
@@ -813,11 +1663,108 @@ bpy.context.view_layer.objects.active = bpy.data.objects["body"]
 
 
 
+#####################
+## Punch-out Cache ##
+#####################
+
+# A key's punched patch (its switch group and one ring of the shell, cut by a projection tool, then
+# filled and flattened onto the key plane) only depends on that patch, the tool and the key frame.
+# Patches are kept under a hash of those inputs, so after a layout tweak only the keys whose
+# neighbourhood changed are intersected again and the others are spliced in from the cache.
+# Bump punch_cache_format whenever the punch-out steps change. The cache is opt-in: it trades disk
+# space under punch_cache_dir for the intersections of repeated runs of nearby layouts.
+punch_cache_dir = punch_cache_dir or os.path.join(os.path.expanduser('~'), '.blended-dm', 'punch_cache')
+punch_cache_format = 2
+
+# {vertex group name: member vertex indices} of a patch, only for the groups it can hold: every group
+# that is not a key's, and the groups of the keys near enough to reach into the key's ring. Membership
+# is what the later stages select by, so the weights are not kept.
+def patch_group_members(patch_object, key: KeyEntry) -> dict:
+    key_groups = {name for other in keys for name in other.groups.values()}
+    nearby = [other for other in keys if (other.axis.location - key.axis.location).length < 2.5 * mount_height]
+    names = [group.name for group in patch_object.vertex_groups if group.name not in key_groups]
+    names += [name for other in nearby for name in other.groups.values() if name in patch_object.vertex_groups]
+    return {name: np.flatnonzero(mask).astype(np.int32) for name, mask in vertex_group_masks(patch_object, names).items() if mask.any()}
+
+def punch_cache_path(patch_object, tool, key: KeyEntry, projection_type: list):
+    if not use_punch_cache:
+        return None
+    digest = hashlib.sha1(repr((punch_cache_format, tuple(bpy.app.version), projection_type[1:], key.size)).encode())
+    tool_matrix = np.array(tool.matrix_world)
+    tool_coordinates = vertex_coordinates(tool) @ tool_matrix[:3, :3].T + tool_matrix[:3, 3]
+    for array in [np.array(key.axis.matrix_basis), tool_coordinates, *mesh_arrays(patch_object.data)]:
+        digest.update(np.ascontiguousarray(np.round(array, 5)).tobytes())
+    for name, indices in sorted(patch_group_members(patch_object, key).items()):
+        digest.update(name.encode() + indices.tobytes())
+    return os.path.join(punch_cache_dir, digest.hexdigest()[:24] + '.npz')
+
+def save_punched_patch(path: str, patch_object, key: KeyEntry):
+    if path is None:
+        return
+    members = patch_group_members(patch_object, key)
+    names = sorted(members)
+    coordinates, loop_vertices, loop_totals = mesh_arrays(patch_object.data)
+    try:
+        os.makedirs(punch_cache_dir, exist_ok=True)
+        # A unique temporary file per writer, so pool workers saving the same patch do not collide
+        handle, temporary_path = tempfile.mkstemp(suffix='.tmp', dir=punch_cache_dir)
+        try:
+            with os.fdopen(handle, 'wb') as stream:
+                np.savez(stream, coordinates=coordinates, loop_vertices=loop_vertices, loop_totals=loop_totals,
+                         group_names=np.array(names, dtype=str), group_sizes=np.array([len(members[name]) for name in names], dtype=np.int32),
+                         group_vertices=np.concatenate([members[name] for name in names] + [np.zeros(0, dtype=np.int32)]))
+            os.replace(temporary_path, path)
+        finally:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+    except OSError as error:
+        print("    --- could not save punched patch:", error)
+
+# Replace the patch object's mesh by the cached punched patch; False (and nothing changed) on a cache miss
+def load_punched_patch(path: str, patch_object) -> bool:
+    if path is None or not os.path.exists(path):
+        return False
+    try:
+        with np.load(path) as data:
+            patch = {name: data[name] for name in data.files}
+        os.utime(path)
+    except (OSError, ValueError) as error:
+        print("    --- could not load punched patch:", error)
+        return False
+
+    old_mesh = patch_object.data
+    patch_object.data = build_mesh(old_mesh.name, patch['coordinates'], patch['loop_vertices'], patch['loop_totals'])
+    bpy.data.meshes.remove(old_mesh)
+    for name, indices in zip(patch['group_names'], np.split(patch['group_vertices'], np.cumsum(patch['group_sizes'])[:-1])):
+        group = patch_object.vertex_groups.get(str(name)) or patch_object.vertex_groups.new(name=str(name))
+        group.add(indices.tolist(), 1.0, 'REPLACE')
+    return True
+
+# Keep the most recently used patches within punch_cache_size_limit; temporary files an hour old were
+# left by a writer that died
+def prune_punch_cache():
+    if not use_punch_cache or not os.path.isdir(punch_cache_dir):
+        return
+    entries = [(entry.stat(), entry.name, entry.path) for entry in os.scandir(punch_cache_dir)]
+    patches = sorted(((stat.st_mtime, stat.st_size, path) for stat, name, path in entries if name.endswith('.npz')), reverse=True)
+    kept_size, stale = 0, [path for stat, name, path in entries if name.endswith('.tmp') and stat.st_mtime < time.time() - 3600]
+    for _, size, path in patches:
+        kept_size += size
+        if kept_size > punch_cache_size_limit * 1024 * 1024:
+            stale.append(path)
+    for path in stale:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+
 ###########################
 ## Form Switch Locations ##
 ###########################
 
-print("{:.2f}".format(time.time()-start_time), "- Punch out Switch Locations " + str(body_subsurf_level) + "x")
+stage("Punch out Switch Locations", " " + str(body_subsurf_level) + "x")
 
 bpy.ops.object.select_all(action='DESELECT')
 bpy.context.view_layer.objects.active = bpy.data.objects["body"]
@@ -825,13 +1772,23 @@ bpy.data.objects["body"].select_set(True)
 bpy.ops.object.transform_apply(location=True, rotation=True, scale=True)
 
 
+
+# Solidify and Subdivision are stacked and evaluated together: the unconnected outer and inner shells
+# subdivide independently, so one evaluation serves both up to level 3. Above that the inner shell
+# stays at level 3, so each shell gets its own single Subdivision modifier after the split.
+inner_subsurf_level = 3 if geode_mode else min(body_subsurf_level, 3)
+shared_subsurf_level = 0 if geode_mode or body_subsurf_level > 3 else body_subsurf_level
+
 bpy.ops.object.modifier_add(type='SOLIDIFY')
 bpy.context.object.modifiers["Solidify"].solidify_mode = 'NON_MANIFOLD'
 bpy.context.object.modifiers["Solidify"].nonmanifold_thickness_mode = 'CONSTRAINTS'
 bpy.context.object.modifiers["Solidify"].nonmanifold_boundary_mode = 'NONE'
 bpy.context.object.modifiers["Solidify"].thickness = body_thickness
 bpy.context.object.modifiers["Solidify"].use_rim = False
-bpy.ops.object.modifier_apply(modifier="Solidify")
+if shared_subsurf_level > 0:
+    bpy.ops.object.modifier_add(type='SUBSURF')
+    bpy.context.object.modifiers["Subdivision"].levels = shared_subsurf_level
+apply_modifier_stack(bpy.context.object)
 
 bpy.ops.object.mode_set(mode = 'EDIT')
 bpy.ops.mesh.select_all(action='DESELECT')
@@ -887,10 +1844,10 @@ if geode_mode:
     bpy.context.view_layer.objects.active = bpy.data.objects["body"]
     bpy.data.objects["body"].select_set(True)
 
-elif (body_subsurf_level>0):
+elif (body_subsurf_level>shared_subsurf_level):
     bpy.ops.object.modifier_add(type='SUBSURF')
     bpy.context.object.modifiers["Subdivision"].levels = body_subsurf_level
-    bpy.ops.object.modifier_apply(modifier="Subdivision")
+    apply_modifier_stack(bpy.context.object)
 
 
 bpy.ops.object.mode_set(mode = 'EDIT')
@@ -912,41 +1869,27 @@ bpy.context.view_layer.objects.active = bpy.data.objects["body_inner"]
 bpy.data.objects["body_inner"].select_set(True)
 bpy.ops.object.transform_apply(location=True, rotation=True, scale=True)
 
-if (body_subsurf_level>0):
+if inner_subsurf_level > shared_subsurf_level:
     bpy.ops.object.modifier_add(type='SUBSURF')
-    if (body_subsurf_level<=3):
-        bpy.context.object.modifiers["Subdivision"].levels = body_subsurf_level
-    else:
-        bpy.context.object.modifiers["Subdivision"].levels = 3
-    bpy.ops.object.modifier_apply(modifier="Subdivision")
-
+    bpy.context.object.modifiers["Subdivision"].levels = inner_subsurf_level
 if geode_mode:
     bpy.ops.object.modifier_add(type='SHRINKWRAP')
     bpy.context.object.modifiers["Shrinkwrap"].wrap_method = 'TARGET_PROJECT'
     bpy.context.object.modifiers["Shrinkwrap"].target = bpy.data.objects["body"]
     bpy.context.object.modifiers["Shrinkwrap"].offset = body_thickness
-    bpy.ops.object.modifier_apply(modifier="Shrinkwrap")
-
-bpy.ops.object.duplicate_move(OBJECT_OT_duplicate={"linked":False, "mode":'TRANSLATION'}, TRANSFORM_OT_translate={"value":(0, 0, 0), "orient_type":'GLOBAL', "orient_matrix":((1, 0, 0), (0, 1, 0), (0, 0, 1)), "orient_matrix_type":'GLOBAL', "constraint_axis":(False, False, False), "mirror":True, "use_proportional_edit":False, "proportional_edit_falloff":'SMOOTH', "proportional_size":1, "use_proportional_connected":False, "use_proportional_projected":False, "snap":False, "snap_target":'CLOSEST', "snap_point":(0, 0, 0), "snap_align":False, "snap_normal":(0, 0, 0), "gpencil_strokes":False, "cursor_transform":False, "texture_space":False, "remove_on_cancel":False, "release_confirm":False, "use_accurate":False, "use_automerge_and_split":False})
-bpy.ops.object.modifier_add(type='SOLIDIFY')
-bpy.context.object.modifiers["Solidify"].thickness = -0.01
-bpy.context.object.modifiers["Solidify"].offset = 1
-bpy.context.object.modifiers["Solidify"].use_rim = False
-bpy.ops.object.modifier_apply(modifier="Solidify")
-bpy.ops.object.mode_set(mode = 'EDIT')
-bpy.ops.mesh.separate(type='LOOSE')
-bpy.ops.object.mode_set(mode = 'OBJECT')
-bpy.ops.object.select_all(action='DESELECT')
+if bpy.context.object.modifiers:
+    apply_modifier_stack(bpy.context.object)
 
-bpy.context.view_layer.objects.active = bpy.data.objects["body_inner.001"]
-bpy.data.objects["body_inner.001"].select_set(True)
-with suppress_stdout(): bpy.ops.object.delete()
-
-bpy.ops.object.select_all(action='DESELECT')
-bpy.context.view_layer.objects.active = bpy.data.objects["body_inner.002"]
-bpy.data.objects["body_inner.002"].select_set(True)
-bpy.context.selected_objects[0].name = "body_inner_reference"
-bpy.ops.object.transform_apply(location=True, rotation=True, scale=True)
+# Reference surface 0.01 behind the inner shell, taken from the evaluated inner mesh
+reference_mesh = bpy.data.objects["body_inner"].data.copy()
+reference_mesh.calc_normals()
+reference_co = np.empty(len(reference_mesh.vertices) * 3)
+reference_normals = np.empty(len(reference_mesh.vertices) * 3)
+reference_mesh.vertices.foreach_get('co', reference_co)
+reference_mesh.vertices.foreach_get('normal', reference_normals)
+reference_mesh.vertices.foreach_set('co', reference_co - 0.01 * reference_normals)
+reference_mesh.update()
+bpy.context.collection.objects.link(bpy.data.objects.new("body_inner_reference", reference_mesh))
 
 
 bpy.ops.object.select_all(action='DESELECT')
@@ -971,82 +1914,109 @@ bpy.ops.object.mode_set(mode = 'OBJECT')
 
 
 #Ensure Corners hit body
-for thing in bpy.data.collections['SWITCH_PROJECTION'].objects:
-    bpy.context.view_layer.objects.active = thing
-    bpy.ops.object.modifier_add(type='SHRINKWRAP')
-    bpy.context.object.modifiers["Shrinkwrap"].wrap_method = 'PROJECT'
-    bpy.context.object.modifiers["Shrinkwrap"].use_negative_direction = True
-    bpy.context.object.modifiers["Shrinkwrap"].use_positive_direction = False
-    bpy.context.object.modifiers["Shrinkwrap"].use_project_z = True
-    bpy.context.object.modifiers["Shrinkwrap"].target = bpy.data.objects["body"]
-    bpy.context.object.modifiers["Shrinkwrap"].vertex_group = "bottom_project"
-    bpy.context.object.modifiers["Shrinkwrap"].offset = -0.2
-    bpy.context.object.modifiers["Shrinkwrap"].cull_face = 'BACK'
-    bpy.ops.object.modifier_apply(modifier="Shrinkwrap")
+for key in keys:
+    switch_projection = key.tools['SWITCH_PROJECTION']
+    projection.project(switch_projection, 'body', vertex_group_masks(switch_projection, ['bottom_project'])['bottom_project'], axis=(0, 0, 1), positive=False, negative=True, offset=-0.2, cull_face='BACK')
 
 bpy.context.view_layer.objects.active = bpy.data.objects["body"]
 bpy.data.objects["body"].select_set(True)
 
+index_key_groups(bpy.data.objects["body"])
+index_key_groups(bpy.data.objects["body_inner"])
 
 
-
+punch_step = 0
+punch_cache_hits = 0
 for projection_type in [['body',       'keycap_projection_outer', mount_thickness + 2, 'all'       ],
                         ['body',       'switch_projection'      , mount_thickness,     'all'       ],
                         ['body_inner', 'keycap_projection_inner', mount_thickness,     'all_inside'],
                         ['body_inner', 'switch_projection_inner', 0,                   'all_inside']]:
 
-    for thing in bpy.data.collections[projection_type[1].upper()].objects:
-        print("    ---" + thing.name)
-        vertex_group_name = thing.name
+    for key in keys:
+        thing = key.tools[projection_type[1].upper()]
+        vertex_group_name = key.groups[projection_type[1]]
+        progress.step(vertex_group_name, punch_step, 4 * len(keys))
+        punch_step += 1
             
-        bpy.context.scene.cursor.location = bpy.data.objects['axis' + thing.name[len(projection_type[1]):]].location
-        bpy.context.scene.cursor.rotation_euler =  bpy.data.objects['axis' + thing.name[len(projection_type[1]):]].rotation_euler
+        bpy.context.scene.cursor.location = key.axis.location
+        bpy.context.scene.cursor.rotation_euler =  key.axis.rotation_euler
         
         bpy.ops.object.select_all(action='DESELECT')
         bpy.context.view_layer.objects.active = bpy.data.objects[projection_type[0]]
         bpy.data.objects[projection_type[0]].select_set(True)
         
         bpy.ops.object.mode_set(mode = 'EDIT')
-        bpy.ops.object.vertex_group_set_active(group='switch' + thing.name[len(projection_type[1]):])
-        bpy.ops.object.vertex_group_select()
+        select_key_group(bpy.data.objects[projection_type[0]], key, 'switch')
         bpy.ops.mesh.select_more()
         bpy.ops.mesh.separate(type='SELECTED')
         bpy.ops.object.mode_set(mode = 'OBJECT')
         bpy.context.view_layer.objects.active = bpy.data.objects[projection_type[0] + ".001"]
         bpy.data.objects[projection_type[0]].select_set(False)
         bpy.context.selected_objects[0].name = "temp"
+
+        # The patch is punched on its own and only joined back into the shell once it is complete
+        patch_path = punch_cache_path(bpy.data.objects['temp'], thing, key, projection_type)
+        if load_punched_patch(patch_path, bpy.data.objects['temp']):
+            punch_cache_hits += 1
+            bpy.data.objects.remove(thing)
+        else:
+            thing.select_set(True)
+            bpy.ops.object.join()
+
+            bpy.ops.object.mode_set(mode = 'EDIT')   
+
+            with suppress_stdout(): bpy.ops.mesh.intersect(mode='SELECT_UNSELECT', separate_mode='ALL', solver='EXACT')
+
+            bpy.ops.mesh.separate(type='LOOSE')
             
-        thing.select_set(True)
-        bpy.ops.object.join()
+            bpy.ops.object.mode_set(mode = 'OBJECT')
+            bpy.ops.object.select_all(action='DESELECT')
 
-        bpy.ops.object.mode_set(mode = 'EDIT')   
+            mesh_size = len(bpy.data.objects['temp'].data.vertices)
+            for mesh_object in bpy.context.scene.objects:
+                if 'temp'+'.' in mesh_object.name:
+                    if len(mesh_object.data.vertices) > mesh_size:
+                        bpy.data.objects['temp'].select_set(True)
+                        with suppress_stdout(): bpy.ops.object.delete()
+                        mesh_object.name = 'temp'
+                        mesh_size = len(mesh_object.data.vertices)
+                    else:
+                        mesh_object.select_set(True)
+                        with suppress_stdout(): bpy.ops.object.delete()
+            
+            bpy.context.view_layer.objects.active = bpy.data.objects['temp']
+            bpy.ops.object.mode_set(mode = 'EDIT')
+            bpy.ops.mesh.select_all(action='SELECT')
+            bpy.context.object.vertex_groups.active_index = key.group_index[projection_type[0]]['switch']
+            bpy.ops.object.vertex_group_assign()
 
-        with suppress_stdout(): bpy.ops.mesh.intersect(mode='SELECT_UNSELECT', separate_mode='ALL', solver='EXACT')
+            # The cut's new vertices are the only ones outside the surface group: fill the hole they rim
+            bpy.ops.mesh.select_all(action='DESELECT')
+            bpy.ops.object.vertex_group_set_active(group=projection_type[3])
+            bpy.ops.object.vertex_group_select()
+            bpy.ops.mesh.select_all(action='INVERT')
+            bpy.ops.mesh.edge_face_add()
 
-        bpy.ops.mesh.separate(type='LOOSE')
-        
-        bpy.ops.object.mode_set(mode = 'OBJECT')
-        bpy.ops.object.select_all(action='DESELECT')
+            bpy.ops.mesh.inset(thickness=0, depth=0)
+            bpy.ops.transform.resize(value=(1, 1, 0), orient_type='CURSOR', orient_matrix=((1, 0, 0), (0, 1, 0), (0, 0, 1)), orient_matrix_type='GLOBAL', constraint_axis=(True, True, True), mirror=True, use_proportional_edit=False, proportional_edit_falloff='SMOOTH', proportional_size=1, use_proportional_connected=False, use_proportional_projected=False)
 
-        mesh_size = len(bpy.data.objects['temp'].data.vertices)
-        for mesh_object in bpy.context.scene.objects:
-            if 'temp'+'.' in mesh_object.name:
-                if len(mesh_object.data.vertices) > mesh_size:
-                    bpy.data.objects['temp'].select_set(True)
-                    with suppress_stdout(): bpy.ops.object.delete()
-                    mesh_object.name = 'temp'
-                    mesh_size = len(mesh_object.data.vertices)
-                else:
-                    mesh_object.select_set(True)
-                    with suppress_stdout(): bpy.ops.object.delete()
-        
-        bpy.context.view_layer.objects.active = bpy.data.objects['temp']
-        bpy.ops.object.mode_set(mode = 'EDIT')
-        bpy.ops.mesh.select_all(action='SELECT')
-        bpy.ops.object.vertex_group_set_active(group='switch' + vertex_group_name[len(projection_type[1]):])
-        bpy.ops.object.vertex_group_assign()
-        bpy.ops.object.mode_set(mode = 'OBJECT')
+            bpy.ops.object.vertex_group_assign_new()
+            bpy.data.objects['temp'].vertex_groups['Group'].name = vertex_group_name
+            bpy.ops.object.mode_set(mode = 'OBJECT')
+
+            # Flatten the new group onto the key plane, projection_type[2] above the key axis
+            key_rotation = key.axis.rotation_euler.to_matrix()
+            flatten_to_plane(bpy.data.objects['temp'], selection_mask(bpy.data.objects['temp']),
+                             key.axis.location + key_rotation @ mathutils.Vector((0, 0, projection_type[2])), key_rotation.col[2])
 
+            bpy.ops.object.mode_set(mode = 'EDIT')
+            bpy.ops.mesh.select_all(action='SELECT')
+            bpy.ops.object.vertex_group_set_active(group=projection_type[3])
+            bpy.ops.object.vertex_group_assign()
+            bpy.ops.object.mode_set(mode = 'OBJECT')
+            save_punched_patch(patch_path, bpy.data.objects['temp'], key)
+
+        bpy.ops.object.select_all(action='DESELECT')
         bpy.context.view_layer.objects.active = bpy.data.objects[projection_type[0]]
         bpy.data.objects[projection_type[0]].select_set(True)
         bpy.data.objects['temp'].select_set(True)
@@ -1057,44 +2027,8 @@ for projection_type in [['body',       'keycap_projection_outer', mount_thicknes
         bpy.ops.mesh.select_all(action='DESELECT')
         bpy.ops.mesh.select_non_manifold()
         with suppress_stdout(): bpy.ops.mesh.remove_doubles()
-        bpy.ops.mesh.select_all(action='DESELECT')
-        
-        
-        bpy.ops.object.vertex_group_set_active(group=projection_type[3])
-        bpy.ops.object.vertex_group_select()
-        bpy.ops.mesh.select_all(action='INVERT')
-        bpy.ops.mesh.edge_face_add()
-
-
-        bpy.ops.mesh.inset(thickness=0, depth=0)
-        bpy.ops.transform.resize(value=(1, 1, 0), orient_type='CURSOR', orient_matrix=((1, 0, 0), (0, 1, 0), (0, 0, 1)), orient_matrix_type='GLOBAL', constraint_axis=(True, True, True), mirror=True, use_proportional_edit=False, proportional_edit_falloff='SMOOTH', proportional_size=1, use_proportional_connected=False, use_proportional_projected=False)
 
-        bpy.ops.object.vertex_group_assign_new()
-        bpy.data.objects[projection_type[0]].vertex_groups['Group'].name = vertex_group_name
-
-       
-        bpy.ops.object.mode_set(mode = 'OBJECT')
-        bpy.data.objects[projection_type[0]].select_set(False)
-        with suppress_stdout(): bpy.ops.object.delete()
-        bpy.data.objects[projection_type[0]].select_set(True)
-       
-        bpy.ops.mesh.primitive_plane_add(enter_editmode=False, size=40, align='CURSOR', scale=(1, 1, 1))
-        bpy.ops.transform.translate(value=(0, 0, projection_type[2]), orient_type='CURSOR')
-        bpy.context.view_layer.objects.active = bpy.data.objects[projection_type[0]]
-        
-        bpy.ops.object.modifier_add(type='SHRINKWRAP')
-        bpy.context.object.modifiers["Shrinkwrap"].wrap_method = 'NEAREST_SURFACEPOINT'
-        bpy.context.object.modifiers["Shrinkwrap"].target = bpy.data.objects["Plane"]
-        bpy.context.object.modifiers["Shrinkwrap"].vertex_group = vertex_group_name
-
-        bpy.ops.object.modifier_apply(modifier="Shrinkwrap")
-
-        bpy.ops.object.mode_set(mode = 'EDIT')
-      
         bpy.ops.mesh.select_all(action='SELECT')
-        bpy.ops.object.vertex_group_set_active(group=projection_type[3])
-        bpy.ops.object.vertex_group_assign()
-        
         bpy.ops.object.vertex_group_set_active(group='bottom_non_manifold')
         bpy.ops.object.vertex_group_deselect()
         bpy.ops.mesh.fill_holes(sides=0)
@@ -1103,20 +2037,18 @@ for projection_type in [['body',       'keycap_projection_outer', mount_thicknes
         bpy.ops.object.mode_set(mode = 'OBJECT')
 
         bpy.ops.object.select_all(action='DESELECT')
-        bpy.data.objects["Plane"].select_set(True)
-        with suppress_stdout(): bpy.ops.object.delete()
 
+if use_punch_cache:
+    print("    punched patches reused from the cache:", punch_cache_hits, "of", punch_step)
+    prune_punch_cache()
+projection.invalidate('body')
 
   
 bpy.context.scene.cursor.location =  [0, 0, 0]
 bpy.context.scene.cursor.rotation_euler =  [0, 0, 0]
 bpy.ops.object.select_all(action='DESELECT')
 
-bpy.ops.object.modifier_add(type='SHRINKWRAP')
-bpy.context.object.modifiers["Shrinkwrap"].wrap_method = 'TARGET_PROJECT'
-bpy.context.object.modifiers["Shrinkwrap"].wrap_mode = 'INSIDE'
-bpy.context.object.modifiers["Shrinkwrap"].target = bpy.data.objects["body_inner_reference"]
-bpy.ops.object.modifier_apply(modifier="Shrinkwrap")
+projection.snap_nearest(bpy.data.objects['body_inner'], 'body_inner_reference', wrap_mode='INSIDE')
 
 
 
@@ -1124,17 +2056,61 @@ bpy.ops.object.modifier_apply(modifier="Shrinkwrap")
 ##  Loligagger Formation ##
 ###########################
 
+# Replace the part of a shell inside the holder box by a flat face on the plane y = plane_y. Only the
+# faces the shell's BVH tree finds around the box are bisected and removed, so the cost follows the
+# holder region instead of the whole subdivided body.
+def cut_holder_opening(mesh_object, center, size, plane_y: float, surface_group: str, holder_group: str):
+    low = mathutils.Vector(center) - mathutils.Vector(size) / 2
+    high = mathutils.Vector(center) + mathutils.Vector(size) / 2
+    def in_box(co, margin: float):
+        return all(low[axis] - margin <= co[axis] <= high[axis] + margin for axis in range(3))
+
+    candidates = {index for _, _, index, _ in projection.tree(mesh_object.name).find_nearest_range(mathutils.Vector(center), (high - low).length / 2)}
+    grid_mesh = bmesh.new()
+    grid_mesh.from_mesh(mesh_object.data)
+    grid_mesh.faces.ensure_lookup_table()
+    faces = [grid_mesh.faces[index] for index in candidates]
+    geometry = faces + list({edge for face in faces for edge in face.edges}) + list({vertex for face in faces for vertex in face.verts})
+
+    for axis in [0, 2]:
+        for bound in [low, high]:
+            plane_normal = [0, 0, 0]
+            plane_normal[axis] = 1
+            geometry = bmesh.ops.bisect_plane(grid_mesh, geom=geometry, dist=1e-4, plane_co=bound, plane_no=plane_normal)['geom']
+
+    inside = [face for face in geometry if isinstance(face, bmesh.types.BMFace) and in_box(face.calc_center_median(), 0)]
+    bmesh.ops.delete(grid_mesh, geom=inside, context='FACES')
+
+    # The opening's rim is an open chain (it reaches the bottom edge); fill it like edge_face_add
+    rim = [edge for edge in geometry if isinstance(edge, bmesh.types.BMEdge) and edge.is_valid and edge.is_boundary
+           and in_box(edge.verts[0].co, 1e-3) and in_box(edge.verts[1].co, 1e-3)]
+    fill = bmesh.ops.contextual_create(grid_mesh, geom=rim + list({vertex for edge in rim for vertex in edge.verts}))['faces']
+    rim_faces = bmesh.ops.inset_region(grid_mesh, faces=fill, thickness=0, depth=0)['faces']
+
+    deform = grid_mesh.verts.layers.deform.verify()
+    surface_index = mesh_object.vertex_groups[surface_group].index
+    holder_index = mesh_object.vertex_groups.new(name=holder_group).index
+    region_faces = [face for face in geometry if isinstance(face, bmesh.types.BMFace) and face.is_valid] + fill + rim_faces
+    for vertex in {vertex for face in region_faces for vertex in face.verts}:
+        vertex[deform][surface_index] = 1.0
+    for face in fill:
+        for vertex in face.verts:
+            vertex.co.y = plane_y
+            vertex[deform][holder_index] = 1.0
+
+    grid_mesh.to_mesh(mesh_object.data)
+    grid_mesh.free()
+    mesh_object.data.update()
+    projection.invalidate(mesh_object.name)
+
+
+stage("Form Loligagger Port")
+
 if loligagger_port:
         bpy.ops.object.select_all(action='DESELECT')
-        bpy.ops.mesh.primitive_cube_add(size=1, enter_editmode=False, align='WORLD', location=(bpy.data.objects['axis - 0, 0'].location[0] - sin(bpy.data.objects['axis - 0, 0'].rotation_euler[0])*mount_width*0.5, 100, 0), scale=(1, 1, 1))
+        bpy.ops.mesh.primitive_cube_add(size=1, enter_editmode=False, align='WORLD', location=(key_by_position[(0, 0)].axis.location[0] - sin(key_by_position[(0, 0)].axis.rotation_euler[0])*mount_width*0.5, 100, 0), scale=(1, 1, 1))
         bpy.context.active_object.name = 'holder_projection'
-        bpy.ops.object.modifier_add(type='SHRINKWRAP')
-        bpy.context.object.modifiers["Shrinkwrap"].target = bpy.data.objects["body"]
-        bpy.context.object.modifiers["Shrinkwrap"].wrap_method = 'PROJECT'
-        bpy.context.object.modifiers["Shrinkwrap"].use_project_y = True
-        bpy.context.object.modifiers["Shrinkwrap"].use_negative_direction = True
-        bpy.context.object.modifiers["Shrinkwrap"].offset = 0
-        bpy.ops.object.modifier_apply(modifier="Shrinkwrap")
+        projection.project(bpy.context.active_object, 'body', axis=(0, 1, 0), positive=True, negative=True)
         bpy.ops.object.origin_set(type='ORIGIN_CENTER_OF_MASS', center='MEDIAN')
 
         holder_width = 31.74
@@ -1148,121 +2124,11 @@ if loligagger_port:
         holder_hole_2_offset = -0.5
 
 
-        #Ouside Mesh
-        bpy.ops.mesh.primitive_cube_add(size=1, location=bpy.data.objects['holder_projection'].location + mathutils.Vector((holder_width/2, 0, (holder_height - bottom_thickness - 20)/2)), scale=(holder_width, 2.25+20, holder_height + bottom_thickness + 20))
-        bpy.context.selected_objects[0].name = "holder_outside"
-        bpy.ops.object.transform_apply(location=True, rotation=True, scale=True)
-        
-        bpy.context.view_layer.objects.active = bpy.data.objects["body"]
-        bpy.data.objects["body"].select_set(True)
-        bpy.ops.object.join()
-        
-
-        
-        bpy.ops.object.mode_set(mode = 'EDIT')
-        with suppress_stdout(): bpy.ops.mesh.intersect()
-        bpy.ops.mesh.select_all(action='DESELECT')
-        bpy.ops.mesh.separate(type='LOOSE')
-        bpy.ops.object.mode_set(mode = 'OBJECT')
-        bpy.data.objects["body.001"].select_set(False)
-        bpy.ops.object.mode_set(mode = 'EDIT')
-        
-        bpy.ops.object.vertex_group_set_active(group='all')
-        bpy.ops.object.vertex_group_select()
-        bpy.ops.mesh.select_all(action='INVERT')
-        bpy.ops.mesh.loop_to_region()
-        bpy.ops.mesh.delete(type='FACE')
-        bpy.ops.mesh.select_all(action='DESELECT')
-        bpy.ops.object.vertex_group_set_active(group='all')
-        bpy.ops.object.vertex_group_select()
-        bpy.ops.mesh.select_all(action='INVERT')
-        
-        bpy.ops.mesh.edge_face_add()
-        bpy.ops.mesh.inset(thickness=0, depth=0)
-        bpy.ops.object.vertex_group_assign_new()
-        bpy.data.objects['body'].vertex_groups['Group'].name = "holder_outside"
-        bpy.ops.transform.resize(value=(1, 0, 1), orient_type='GLOBAL', orient_matrix=((1, 0, 0), (0, 1, 0), (0, 0, 1)), orient_matrix_type='GLOBAL', constraint_axis=(True, True, True), mirror=True, use_proportional_edit=False, proportional_edit_falloff='SMOOTH', proportional_size=0.001, use_proportional_connected=False, use_proportional_projected=False)
-        
-        bpy.ops.object.mode_set(mode = 'OBJECT')
-        bpy.ops.mesh.primitive_plane_add(size=200, enter_editmode=False, align='WORLD', location=bpy.data.objects['holder_projection'].location + mathutils.Vector((holder_width/2, 0, (holder_height - bottom_thickness - 20)/2)), rotation=(-1.5708, 0, 0), scale=(1, 1, 1))
-        bpy.context.view_layer.objects.active = bpy.data.objects["body"]
-          
-        bpy.ops.object.modifier_add(type='SHRINKWRAP')
-        bpy.context.object.modifiers["Shrinkwrap"].wrap_method = 'NEAREST_SURFACEPOINT'
-        bpy.context.object.modifiers["Shrinkwrap"].target = bpy.data.objects["Plane"]
-        bpy.context.object.modifiers["Shrinkwrap"].vertex_group = "holder_outside"
-        bpy.ops.object.modifier_apply(modifier="Shrinkwrap")
-    
-        bpy.ops.object.mode_set(mode = 'EDIT')
-        bpy.ops.mesh.select_all(action='SELECT')
-        bpy.ops.object.vertex_group_set_active(group='all')
-        bpy.ops.object.vertex_group_assign()
-        bpy.ops.mesh.select_all(action='DESELECT')
-        bpy.ops.object.mode_set(mode = 'OBJECT')
-
-        bpy.ops.object.select_all(action='DESELECT')
-        bpy.data.objects["body.001"].select_set(True)
-        bpy.data.objects["Plane"].select_set(True)
-        with suppress_stdout(): bpy.ops.object.delete()
-
-
-
-        #Inside Mesh
-        bpy.ops.mesh.primitive_cube_add(size=1, location=bpy.data.objects['holder_projection'].location + mathutils.Vector((holder_width/2, 0, (holder_height - bottom_thickness - 20)/2)), scale=(holder_width + 1.5 + 2*body_thickness, 2.25+20, holder_height + bottom_thickness  + 2*body_thickness + 20))
-        bpy.context.selected_objects[0].name = "holder_outside"
-        bpy.ops.object.transform_apply(location=True, rotation=True, scale=True)
-        
-        bpy.context.view_layer.objects.active = bpy.data.objects["body_inner"]
-        bpy.data.objects["body_inner"].select_set(True)
-        bpy.ops.object.join()
-        
-        bpy.ops.object.mode_set(mode = 'EDIT')
-        with suppress_stdout(): bpy.ops.mesh.intersect()
-        bpy.ops.mesh.select_all(action='DESELECT')
-        bpy.ops.mesh.separate(type='LOOSE')
-        bpy.ops.object.mode_set(mode = 'OBJECT')
-        bpy.data.objects["body_inner.001"].select_set(False)
-        bpy.ops.object.mode_set(mode = 'EDIT')
-        
-        bpy.ops.object.vertex_group_set_active(group='all_inside')
-        bpy.ops.object.vertex_group_select()
-        bpy.ops.mesh.select_all(action='INVERT')
-        bpy.ops.mesh.loop_to_region()
-        bpy.ops.mesh.delete(type='FACE')
-        bpy.ops.mesh.select_all(action='DESELECT')
-        bpy.ops.object.vertex_group_set_active(group='all_inside')
-        bpy.ops.object.vertex_group_select()
-        bpy.ops.mesh.select_all(action='INVERT')
-
-        
-        bpy.ops.mesh.edge_face_add()
-        bpy.ops.mesh.inset(thickness=0, depth=0)
-        bpy.ops.object.vertex_group_assign_new()
-        bpy.data.objects['body_inner'].vertex_groups['Group'].name = "holder_inside"
-        bpy.ops.transform.resize(value=(1, 0, 1), orient_type='GLOBAL', orient_matrix=((1, 0, 0), (0, 1, 0), (0, 0, 1)), orient_matrix_type='GLOBAL', constraint_axis=(True, True, True), mirror=True, use_proportional_edit=False, proportional_edit_falloff='SMOOTH', proportional_size=0.001, use_proportional_connected=False, use_proportional_projected=False)
-
-        
-        bpy.ops.object.mode_set(mode = 'OBJECT')
-        bpy.ops.mesh.primitive_plane_add(size=200, enter_editmode=False, align='WORLD', location=bpy.data.objects['holder_projection'].location + mathutils.Vector((holder_width/2, -6, (holder_height - bottom_thickness - 20)/2)), rotation=(-1.5708, 0, 0), scale=(1, 1, 1))
-        bpy.context.view_layer.objects.active = bpy.data.objects["body_inner"]
-          
-        bpy.ops.object.modifier_add(type='SHRINKWRAP')
-        bpy.context.object.modifiers["Shrinkwrap"].wrap_method = 'NEAREST_SURFACEPOINT'
-        bpy.context.object.modifiers["Shrinkwrap"].target = bpy.data.objects["Plane"]
-        bpy.context.object.modifiers["Shrinkwrap"].vertex_group = "holder_inside"
-        bpy.ops.object.modifier_apply(modifier="Shrinkwrap")
-
-        bpy.ops.object.mode_set(mode = 'EDIT')
-        bpy.ops.mesh.select_all(action='SELECT')
-        bpy.ops.object.vertex_group_set_active(group='all_inside')
-        bpy.ops.object.vertex_group_assign()
-        bpy.ops.mesh.select_all(action='DESELECT')
-        bpy.ops.object.mode_set(mode = 'OBJECT')
-
-        bpy.ops.object.select_all(action='DESELECT')
-        bpy.data.objects["body_inner.001"].select_set(True)
-        bpy.data.objects["Plane"].select_set(True)
-        with suppress_stdout(): bpy.ops.object.delete()
+        holder_center = bpy.data.objects['holder_projection'].location + mathutils.Vector((holder_width/2, 0, (holder_height - bottom_thickness - 20)/2))
+        cut_holder_opening(bpy.data.objects['body'], holder_center, (holder_width, 2.25+20, holder_height + bottom_thickness + 20),
+                           bpy.data.objects['holder_projection'].location[1], 'all', 'holder_outside')
+        cut_holder_opening(bpy.data.objects['body_inner'], holder_center, (holder_width + 1.5 + 2*body_thickness, 2.25+20, holder_height + bottom_thickness + 2*body_thickness + 20),
+                           bpy.data.objects['holder_projection'].location[1] - 6, 'all_inside', 'holder_inside')
 
 
 
@@ -1271,7 +2137,7 @@ if loligagger_port:
 ## Join Inner and Outer Body Mesh ##
 ####################################
 
-print("{:.2f}".format(time.time()-start_time), "- Join Inner and Outer Body Mesh")
+stage("Join Inner and Outer Body Mesh")
 
 bpy.ops.mesh.primitive_cube_add(size=400, enter_editmode=False, align='WORLD', location=(0, 0, -200 - bottom_thickness), scale=(1, 1, 1))
 bpy.context.selected_objects[0].name = "cut_cube"
@@ -1290,6 +2156,7 @@ bpy.ops.mesh.fill()
 bpy.ops.object.vertex_group_remove_from()
 
 bpy.ops.mesh.select_all(action='DESELECT')
+require_addon('object_print3d_utils')
 with suppress_stdout():
     bpy.ops.mesh.normals_make_consistent()
     bpy.ops.mesh.print3d_clean_non_manifold()
@@ -1299,10 +2166,7 @@ bpy.ops.object.mode_set(mode = 'OBJECT')
 bpy.ops.object.select_all(action='DESELECT')
 bpy.context.view_layer.objects.active = bpy.data.objects['body']
 bpy.data.objects['body'].select_set(True)
-bpy.ops.object.modifier_add(type='BOOLEAN')
-bpy.context.object.modifiers["Boolean"].object = bpy.data.objects["cut_cube"]
-bpy.context.object.modifiers["Boolean"].solver = 'FAST'
-bpy.ops.object.modifier_apply(modifier="Boolean")
+apply_boolean(bpy.data.objects['body'], bpy.data.objects["cut_cube"])
 
 bpy.ops.object.mode_set(mode = 'EDIT')
 bpy.ops.object.vertex_group_assign()
@@ -1342,74 +2206,99 @@ bpy.ops.object.mode_set(mode = 'OBJECT')
 ## GENERATE BOTTOM PLATE ##
 ###########################
 
-print("{:.2f}".format(time.time()-start_time), "- Generate Bottom Plate")
-
-bpy.ops.object.mode_set(mode = 'EDIT')
-
-bpy.ops.mesh.select_all(action='DESELECT')
-bpy.ops.object.vertex_group_set_active(group='all_inside')
-bpy.ops.object.vertex_group_select()
-bpy.ops.object.vertex_group_set_active(group='bottom_non_manifold')
-bpy.ops.object.vertex_group_deselect()
-bpy.ops.object.vertex_group_set_active(group='all')
-bpy.ops.object.vertex_group_select()
-bpy.ops.mesh.select_all(action='INVERT')
-
-with suppress_stdout():
-    bpy.ops.mesh.remove_doubles(threshold=0.2)
-    bpy.ops.mesh.offset_edges(geometry_mode='offset', width=-0.2, angle=0, caches_valid=False, angle_presets='0°')
-bpy.ops.mesh.edge_face_add()
-bpy.ops.mesh.separate(type='LOOSE')
-        
-bpy.ops.object.mode_set(mode = 'OBJECT')
-bpy.ops.object.select_all(action='DESELECT')
-
-mesh_size = len(bpy.data.objects['body.001'].data.vertices)
-for mesh_object in bpy.context.scene.objects:
-    if 'body.001' == mesh_object.name:
-        continue
-    elif 'body.' in mesh_object.name:
-        if len(mesh_object.data.vertices) > mesh_size:
-            bpy.data.objects['body.001'].select_set(True)
-            with suppress_stdout(): bpy.ops.object.delete()
-            mesh_object.name = 'body.001'
-            mesh_size = len(mesh_object.data.vertices)
-        else:
-            mesh_object.select_set(True)
-            with suppress_stdout(): bpy.ops.object.delete()
-
-bpy.ops.object.select_all(action='DESELECT')
-bpy.context.view_layer.objects.active = bpy.data.objects["body.001"]
-bpy.data.objects["body.001"].select_set(True)
-bpy.context.selected_objects[0].name = "bottom"
-
-bpy.ops.object.mode_set(mode = 'EDIT')
-bpy.ops.mesh.select_all(action='SELECT')
-bpy.ops.object.vertex_group_assign_new()
-bpy.data.objects['bottom'].vertex_groups['Group'].name = 'bottom_lower'
-
-bpy.ops.mesh.extrude_region_move(MESH_OT_extrude_region={"use_normal_flip":False, "use_dissolve_ortho_edges":False, "mirror":False}, TRANSFORM_OT_translate={"value":(0, 0, 2.5), "orient_type":'GLOBAL', "orient_matrix":((0, 1, 0), (1, 0, 0), (0, 0, 1)), "orient_matrix_type":'NORMAL', "constraint_axis":(True, True, True), "mirror":False, "use_proportional_edit":False, "proportional_edit_falloff":'SMOOTH', "proportional_size":1, "use_proportional_connected":False, "use_proportional_projected":False, "snap":False, "snap_target":'CLOSEST', "snap_point":(0, 0, 0), "snap_align":False, "snap_normal":(0, 0, 0), "gpencil_strokes":False, "cursor_transform":False, "texture_space":False, "remove_on_cancel":False, "release_confirm":False, "use_accurate":False, "use_automerge_and_split":False})
-bpy.ops.object.vertex_group_remove()
-bpy.ops.object.vertex_group_assign_new()
-bpy.data.objects['bottom'].vertex_groups['Group'].name = 'bottom_upper'
-bpy.ops.mesh.edge_face_add()
-bpy.ops.mesh.normals_make_consistent(inside=False)
-bpy.ops.object.mode_set(mode = 'OBJECT')
-
-bpy.ops.object.modifier_add(type='SHRINKWRAP')
-bpy.context.object.modifiers["Shrinkwrap"].wrap_method = 'TARGET_PROJECT'
-bpy.context.object.modifiers["Shrinkwrap"].wrap_mode = 'INSIDE'
-bpy.context.object.modifiers["Shrinkwrap"].target = bpy.data.objects["body_inner_reference"]
-bpy.context.object.modifiers["Shrinkwrap"].offset = 0.2
-bpy.context.object.modifiers["Shrinkwrap"].vertex_group = "bottom_upper"
-bpy.ops.object.modifier_apply(modifier="Shrinkwrap")
-
-bpy.ops.object.mode_set(mode = 'EDIT')
-grid_mesh = bmesh.from_edit_mesh(bpy.context.object.data)
-for vertex in grid_mesh.verts:
-    if vertex.select:
-        vertex.co[2] = -0.5
-bpy.ops.object.mode_set(mode = 'OBJECT')
+stage("Generate Bottom Plate")
+
+# Closed loops of an edge list, following vertices that have exactly two edges
+def edge_loops(edges):
+    neighbours = {}
+    for a, b in edges:
+        neighbours.setdefault(a, []).append(b)
+        neighbours.setdefault(b, []).append(a)
+    loops = []
+    visited = set()
+    for start in neighbours:
+        if start in visited or len(neighbours[start]) != 2:
+            continue
+        visited.add(start)
+        loop = [start]
+        previous, current = start, neighbours[start][0]
+        while current != start and current not in visited and len(neighbours[current]) == 2:
+            visited.add(current)
+            loop.append(current)
+            previous, current = current, neighbours[current][1] if neighbours[current][0] == previous else neighbours[current][0]
+        if current == start and len(loop) > 2:
+            loops.append(loop)
+    return loops
+
+def signed_area(points):
+    return 0.5 * np.sum(points[:, 0] * np.roll(points[:, 1], -1) - np.roll(points[:, 0], -1) * points[:, 1])
+
+# Drop points closer than distance to the last kept point, like remove_doubles along the outline
+def drop_close_points(points, distance: float):
+    kept = [points[0]]
+    for point in points[1:]:
+        if np.linalg.norm(point - kept[-1]) >= distance:
+            kept.append(point)
+    while len(kept) > 3 and np.linalg.norm(kept[-1] - kept[0]) < distance:
+        kept.pop()
+    return np.array(kept)
+
+# Inset a closed 2D polygon by distance with mitred corners. Vertices whose offset edges flip
+# (edges shorter than the inset can absorb) are removed and the offset is redone without them.
+def inset_polygon(points, distance: float, miter_limit: float = 4):
+    if signed_area(points) < 0:
+        points = points[::-1]
+    while True:
+        edges = np.roll(points, -1, axis=0) - points
+        edges /= np.linalg.norm(edges, axis=1)[:, None]
+        inward = np.stack([-edges[:, 1], edges[:, 0]], axis=1)
+        bisector = inward + np.roll(inward, 1, axis=0)
+        scale = 2 * distance / np.maximum(np.einsum('ij,ij->i', bisector, bisector), 4 / miter_limit**2)
+        inset = points + bisector * scale[:, None]
+        flipped = np.einsum('ij,ij->i', np.roll(inset, -1, axis=0) - inset, edges) <= 0
+        if not flipped.any() or len(points) <= 3:
+            return inset
+        points = np.delete(points, (np.flatnonzero(flipped)[0] + 1) % len(points), axis=0)
+
+
+# Floor contour of the inner wall: vertices outside 'all' and outside all_inside \ bottom_non_manifold
+body = bpy.data.objects['body']
+floor_masks = vertex_group_masks(body, ['all', 'all_inside', 'bottom_non_manifold'])
+floor = ~(floor_masks['all'] | (floor_masks['all_inside'] & ~floor_masks['bottom_non_manifold']))
+body_edges = np.empty(len(body.data.edges) * 2, dtype=np.int32)
+body.data.edges.foreach_get('vertices', body_edges)
+body_edges = body_edges.reshape(-1, 2)
+body_coordinates = vertex_coordinates(body)
+
+contours = [body_coordinates[loop] for loop in edge_loops(body_edges[floor[body_edges].all(axis=1)])]
+contour = max(contours, key=lambda loop: abs(signed_area(loop[:, :2])))
+floor_z = contour[:, 2].mean()
+outline = inset_polygon(drop_close_points(contour[:, :2], 0.2), 0.2)
+
+# Plate as a prism over the outline: triangulated lower and upper caps joined by side quads. The body
+# is cut at -bottom_thickness, so the plate is bottom_thickness high less the 0.5 gap under its top.
+grid_mesh = bmesh.new()
+lower = [grid_mesh.verts.new((x, y, floor_z)) for x, y in outline]
+upper = [grid_mesh.verts.new((x, y, floor_z + bottom_thickness - 0.5)) for x, y in outline]
+caps = [grid_mesh.faces.new(lower[::-1]), grid_mesh.faces.new(upper)]
+for index in range(len(outline)):
+    grid_mesh.faces.new((lower[index], lower[index - len(outline) + 1], upper[index - len(outline) + 1], upper[index]))
+bmesh.ops.triangulate(grid_mesh, faces=caps, quad_method='BEAUTY', ngon_method='BEAUTY')
+bottom_mesh = bpy.data.meshes.new("bottom")
+grid_mesh.to_mesh(bottom_mesh)
+grid_mesh.free()
+
+bottom = bpy.data.objects.new("bottom", bottom_mesh)
+bpy.context.collection.objects.link(bottom)
+bottom.vertex_groups.new(name='bottom_lower').add(range(len(outline)), 1.0, 'REPLACE')
+bottom.vertex_groups.new(name='bottom_upper').add(range(len(outline), 2 * len(outline)), 1.0, 'REPLACE')
+
+# Upper face keeps 0.2 clearance inside the inner wall, then drops to its final height
+upper_mask = np.arange(2 * len(outline)) >= len(outline)
+projection.snap_nearest(bottom, 'body_inner_reference', upper_mask, offset=0.2, wrap_mode='INSIDE')
+bottom_coordinates = vertex_coordinates(bottom)
+bottom_coordinates[upper_mask, 2] = -0.5
+set_vertex_coordinates(bottom, bottom_coordinates)
 
 
 # Clip off protusions into bottom
@@ -1420,15 +2309,9 @@ bpy.data.objects['body'].select_set(True)
 bpy.ops.object.mode_set(mode = 'EDIT')
 bpy.ops.mesh.select_all(action='DESELECT')
 
-for column in range(ncols):
-    for row in range(nrows):
-        if (column in [2, 3]) or (not row == lastrow):
-            bpy.ops.object.vertex_group_set_active(group="switch_projection_inner - " + str(column) + ", " + str(row))
-            bpy.ops.object.vertex_group_select()
-
-for thumb in range(6):
-    bpy.ops.object.vertex_group_set_active(group="switch_projection_inner - thumb - " + str(thumb))
-    bpy.ops.object.vertex_group_select()
+index_key_groups(bpy.data.objects['body'])
+for key in keys:
+    select_key_group(bpy.data.objects['body'], key, 'switch_projection_inner')
 
 bpy.ops.mesh.select_more()
 bpy.ops.object.vertex_group_set_active(group="all")
@@ -1446,6 +2329,7 @@ bpy.ops.object.select_all(action='DESELECT')
 bpy.context.view_layer.objects.active = bpy.data.objects["body_inner_reference"]
 bpy.data.objects["body_inner_reference"].select_set(True)
 with suppress_stdout(): bpy.ops.object.delete()
+projection.invalidate('body_inner_reference')
 
 
 
@@ -1460,10 +2344,7 @@ if loligagger_port:
 
     bpy.context.view_layer.objects.active = bpy.data.objects["body"]
     bpy.data.objects["body"].select_set(True)
-    bpy.ops.object.modifier_add(type='BOOLEAN')
-    bpy.context.object.modifiers["Boolean"].object = bpy.data.objects["holder_outside"]
-    bpy.context.object.modifiers["Boolean"].use_hole_tolerant = True
-    bpy.ops.object.modifier_apply(modifier="Boolean")
+    apply_boolean(bpy.data.objects["body"], bpy.data.objects["holder_outside"])
     
     
     bpy.ops.mesh.primitive_cube_add(size=1, location=bpy.data.objects['holder_projection'].location + mathutils.Vector((holder_hole_2_width/2 + holder_hole_2_offset, -8.5, 0)), scale=(holder_hole_2_width, 10, 2*holder_hole_height + 1))
@@ -1485,10 +2366,7 @@ if loligagger_port:
     
     bpy.context.view_layer.objects.active = bpy.data.objects["body"]
     bpy.data.objects["body"].select_set(True)
-    bpy.ops.object.modifier_add(type='BOOLEAN')
-    bpy.context.object.modifiers["Boolean"].object = bpy.data.objects["holder_inside"]
-    #bpy.context.object.modifiers["Boolean"].use_hole_tolerant = True
-    bpy.ops.object.modifier_apply(modifier="Boolean")
+    apply_boolean(bpy.data.objects["body"], bpy.data.objects["holder_inside"])
     
     #bottom extension
     bpy.ops.mesh.primitive_cube_add(size=1, location=bpy.data.objects['holder_projection'].location + mathutils.Vector(((holder_hole_2_width-0.4)/2 + holder_hole_2_offset + 0.2, -10-3.7, -(bottom_thickness-0.5)/2 - 0.5)), scale=(holder_hole_2_width-0.4, 20, bottom_thickness-0.01-0.5))
@@ -1509,13 +2387,7 @@ if loligagger_port:
 
     bpy.context.view_layer.objects.active = bpy.data.objects["bottom"]
     bpy.data.objects["bottom"].select_set(True)
-    bpy.ops.object.modifier_add(type='BOOLEAN')
-    bpy.context.object.modifiers["Boolean"].operation = 'UNION'
-    bpy.context.object.modifiers["Boolean"].object = bpy.data.objects["holder_bottom_2"]
-    #bpy.context.object.modifiers["Boolean"].use_self = True
-    #bpy.context.object.modifiers["Boolean"].use_hole_tolerant = True
-    bpy.context.object.modifiers["Boolean"].solver = 'FAST'
-    bpy.ops.object.modifier_apply(modifier="Boolean")
+    apply_boolean(bpy.data.objects["bottom"], bpy.data.objects["holder_bottom_2"], 'UNION')
     
     bpy.ops.mesh.primitive_cube_add(size=1, location=bpy.data.objects['holder_projection'].location + mathutils.Vector(((holder_hole_width-0.4)/2 + holder_hole_offset + 0.2, -10, -(bottom_thickness-0.5)/2 - 0.5)), scale=(holder_hole_width-0.4, 20, bottom_thickness-0.02-0.5))
     bpy.context.selected_objects[0].name = "holder_bottom_1"
@@ -1523,13 +2395,7 @@ if loligagger_port:
     
     bpy.context.view_layer.objects.active = bpy.data.objects["bottom"]
     bpy.data.objects["bottom"].select_set(True)
-    bpy.ops.object.modifier_add(type='BOOLEAN')
-    bpy.context.object.modifiers["Boolean"].operation = 'UNION'
-    bpy.context.object.modifiers["Boolean"].object = bpy.data.objects["holder_bottom_1"]
-    #bpy.context.object.modifiers["Boolean"].use_self = True
-    #bpy.context.object.modifiers["Boolean"].use_hole_tolerant = True
-    bpy.context.object.modifiers["Boolean"].solver = 'FAST'
-    bpy.ops.object.modifier_apply(modifier="Boolean")
+    apply_boolean(bpy.data.objects["bottom"], bpy.data.objects["holder_bottom_1"], 'UNION')
 
     
     bpy.ops.object.select_all(action='DESELECT')
@@ -1548,190 +2414,144 @@ if loligagger_port:
 
 if magnet_bottom:
 
-    print("{:.2f}".format(time.time()-start_time), "- Adding Magnet Connectors")
-
-    bpy.ops.object.select_all(action='DESELECT')
-
-    bpy.ops.mesh.primitive_cylinder_add(vertices=50, radius=magnet_diameter/2 + 1, depth=magnet_height+2, enter_editmode=False, align='WORLD', location=(0, 0, 0), scale=(1, 1, 1))
-    bpy.context.active_object.name = 'mag_template'
-    bpy.ops.object.transform_apply(location=True, rotation=True, scale=True)
-
-
-    bpy.ops.object.mode_set(mode = 'EDIT')
-    bpy.ops.mesh.select_all(action='DESELECT')
-    bpy.ops.mesh.select_mode(type="VERT")
-    grid_mesh = bmesh.from_edit_mesh(bpy.context.object.data)
-    grid_mesh.faces.ensure_lookup_table()
-    for vertex in grid_mesh.verts:
-        if (vertex.co[0] < .1):
-            vertex.co[0] = 0
-            vertex.select = True
-
-    bpy.ops.transform.translate(value=(magnet_diameter/2 + 1.5 , 0, 0), orient_type='GLOBAL', orient_matrix=((1, 0, 0), (0, 1, 0), (0, 0, 1)), orient_matrix_type='GLOBAL', constraint_axis=(True, False, False), mirror=True, use_proportional_edit=False, proportional_edit_falloff='SMOOTH', proportional_size=1, use_proportional_connected=False, use_proportional_projected=False)
+    stage("Adding Magnet Connectors")
 
+    # body was joined and cut since its tree was built
+    projection.invalidate('body')
 
-    bpy.ops.object.vertex_group_assign_new()
-    bpy.ops.object.mode_set(mode = 'OBJECT')
-    bpy.data.objects['mag_template'].vertex_groups['Group'].name = 'connection'
+    bpy.ops.object.select_all(action='DESELECT')
 
-    bpy.ops.object.mode_set(mode = 'EDIT')
-    bpy.ops.mesh.select_all(action='DESELECT')
-    bpy.ops.mesh.select_mode(type="VERT")
-    grid_mesh = bmesh.from_edit_mesh(bpy.context.object.data)
-    grid_mesh.faces.ensure_lookup_table()
-    for vertex in grid_mesh.verts:
-        if (vertex.co[2] < .1):
-            vertex.select = True
+    magnet_templates = ['mag_template', 'mag_h_template']
+    magnet_template_path = template_path('magnets', (magnet_diameter, magnet_height))
 
-    bpy.ops.object.vertex_group_assign_new()
-    bpy.ops.object.mode_set(mode = 'OBJECT')
-    bpy.data.objects['mag_template'].vertex_groups['Group'].name = 'bottom'
+    if not load_templates(magnet_template_path, magnet_templates):
+        bpy.ops.mesh.primitive_cylinder_add(vertices=50, radius=magnet_diameter/2 + 1, depth=magnet_height+2, enter_editmode=False, align='WORLD', location=(0, 0, 0), scale=(1, 1, 1))
+        bpy.context.active_object.name = 'mag_template'
+        bpy.ops.object.transform_apply(location=True, rotation=True, scale=True)
 
 
-    bpy.ops.transform.translate(value=(magnet_diameter/2 + 1 + 2.5, 0, 0.5*(magnet_height+2)), orient_type='GLOBAL', orient_matrix=((1, 0, 0), (0, 1, 0), (0, 0, 1)), orient_matrix_type='GLOBAL', mirror=True, use_proportional_edit=False, proportional_edit_falloff='SMOOTH', proportional_size=1, use_proportional_connected=False, use_proportional_projected=False)
-    bpy.ops.object.origin_set(type='ORIGIN_CURSOR', center='MEDIAN')
+        bpy.ops.object.mode_set(mode = 'EDIT')
+        bpy.ops.mesh.select_all(action='DESELECT')
+        bpy.ops.mesh.select_mode(type="VERT")
+        grid_mesh = bmesh.from_edit_mesh(bpy.context.object.data)
+        grid_mesh.faces.ensure_lookup_table()
+        for vertex in grid_mesh.verts:
+            if (vertex.co[0] < .1):
+                vertex.co[0] = 0
+                vertex.select = True
 
-    bpy.context.active_object.select_set(False)
-    bpy.ops.object.select_all(action='DESELECT')
+        bpy.ops.transform.translate(value=(magnet_diameter/2 + 1.5 , 0, 0), orient_type='GLOBAL', orient_matrix=((1, 0, 0), (0, 1, 0), (0, 0, 1)), orient_matrix_type='GLOBAL', constraint_axis=(True, False, False), mirror=True, use_proportional_edit=False, proportional_edit_falloff='SMOOTH', proportional_size=1, use_proportional_connected=False, use_proportional_projected=False)
 
-    bpy.ops.mesh.primitive_cylinder_add(vertices=64, radius=magnet_diameter/2+0.4, depth=2*magnet_height+0.2, enter_editmode=False, align='WORLD', location=(0, 0, 0), scale=(1, 1, 1))
-    bpy.context.active_object.name = 'mag_h_template'
-    bpy.ops.object.transform_apply(location=True, rotation=False, scale=True)
-    bpy.ops.transform.translate(value=(magnet_diameter/2 + 1 + 2.5, 0, -0.2), orient_type='GLOBAL', orient_matrix=((1, 0, 0), (0, 1, 0), (0, 0, 1)), orient_matrix_type='GLOBAL', mirror=True, use_proportional_edit=False, proportional_edit_falloff='SMOOTH', proportional_size=1, use_proportional_connected=False, use_proportional_projected=False)
-    bpy.ops.object.origin_set(type='ORIGIN_CURSOR', center='MEDIAN')
-
-    bpy.ops.curve.primitive_bezier_circle_add(radius=magnet_diameter/2+0.7, enter_editmode=False, align='WORLD', location=(0, 0, 0), scale=(1, 1, 1))
-    bpy.context.active_object.name = 'mag_h_curve'
-    bpy.ops.object.transform_apply(location=True, rotation=False, scale=True)
-    bpy.ops.transform.translate(value=(magnet_diameter/2 + 1 + 2.5, 0, -0.2), orient_type='GLOBAL', orient_matrix=((1, 0, 0), (0, 1, 0), (0, 0, 1)), orient_matrix_type='GLOBAL', mirror=True, use_proportional_edit=False, proportional_edit_falloff='SMOOTH', proportional_size=1, use_proportional_connected=False, use_proportional_projected=False)
-    bpy.ops.object.origin_set(type='ORIGIN_CURSOR', center='MEDIAN')
-
-    bpy.ops.mesh.primitive_cylinder_add(radius=.8, depth=2*magnet_height+5, enter_editmode=False, align='WORLD', location=(0, 0, 0), scale=(1, 1, 1))
-    bpy.context.active_object.name = 'mag_h_template_rib'
-    bpy.ops.object.transform_apply(location=True, rotation=False, scale=True)
-    bpy.ops.transform.translate(value=(magnet_diameter/2 + 1 + 2.5, 0, -0.2), orient_type='GLOBAL', orient_matrix=((1, 0, 0), (0, 1, 0), (0, 0, 1)), orient_matrix_type='GLOBAL', mirror=True, use_proportional_edit=False, proportional_edit_falloff='SMOOTH', proportional_size=1, use_proportional_connected=False, use_proportional_projected=False)
-    bpy.ops.object.origin_set(type='ORIGIN_CURSOR', center='MEDIAN')
-
-    bpy.ops.object.modifier_add(type='ARRAY')
-    bpy.context.object.modifiers["Array"].count = 5
-    bpy.context.object.modifiers["Array"].relative_offset_displace[0] = 2*pi*(magnet_diameter/2+0.7)/5/0.8
-    bpy.ops.object.modifier_apply(modifier="Array")
-
-    bpy.ops.object.modifier_add(type='CURVE')
-    bpy.context.object.modifiers["Curve"].object = bpy.data.objects["mag_h_curve"]
-    bpy.ops.object.modifier_apply(modifier="Curve")
 
-    bpy.ops.object.select_all(action='DESELECT')
-    bpy.data.objects['mag_h_template'].select_set(True)
-    bpy.context.view_layer.objects.active = bpy.data.objects["mag_h_template"]
-    bpy.ops.object.modifier_add(type='BOOLEAN')
-    bpy.context.object.modifiers["Boolean"].object = bpy.data.objects["mag_h_template_rib"]
-    bpy.ops.object.modifier_apply(modifier="Boolean")
-
-
-
-    #              [location,                                       direction, rotation] 
-    magnet_data = [['axis - 0, 0',                                  'axis - 0, 0',                                  [0, radians(90), 0] ],
-                   ['axis - ' + str(ncols-2) + ', 0',               'axis - ' + str(ncols-2) + ', 0',               [radians(90), 0, 0] ],
-                   ['axis - ' + str(ncols-2) + ', ' + str(nrows-2), 'axis - ' + str(ncols-2) + ', ' + str(nrows-2), [radians(-90), 0, 0]],
-                   ['axis - thumb - 5',                             'axis - thumb - 5',                             [radians(-90), 0, 0]],
-                   ['axis - 0, ' + str(nrows-2),                    'axis - 0, ' + str(nrows-2),                    [0, radians(90), 0] ],
-                   ['axis - ' + str(ncols-1) + ', 0',               'axis - ' + str(ncols-1) + ', ' + str(nrows-2 - (nrows-1)%2 ), [0, radians(-90), 0]]]
-    for item in range(len(magnet_data)):
-        bpy.ops.object.select_all(action='DESELECT')
-        bpy.ops.mesh.primitive_plane_add(enter_editmode=False, align='WORLD', location=((bpy.data.objects[magnet_data[item][0]].location[0]+bpy.data.objects[magnet_data[item][1]].location[0])/2, (bpy.data.objects[magnet_data[item][0]].location[1]+bpy.data.objects[magnet_data[item][1]].location[1])/2, 2), rotation=magnet_data[item][2], scale=(1, 1, 1))
-        bpy.context.active_object.name = 'mag_' + str(item)
-        bpy.ops.object.modifier_add(type='SHRINKWRAP')
-        bpy.context.object.modifiers["Shrinkwrap"].target = bpy.data.objects["body"]
-        bpy.context.object.modifiers["Shrinkwrap"].wrap_method = 'PROJECT'
-
-        bpy.context.object.modifiers["Shrinkwrap"].use_positive_direction = False
-        bpy.context.object.modifiers["Shrinkwrap"].use_negative_direction = True
-        bpy.context.object.modifiers["Shrinkwrap"].offset = -body_thickness + 1
-        bpy.ops.object.modifier_apply(modifier="Shrinkwrap")
-        bpy.ops.transform.translate(value=(0, 0, -1.99), orient_type='GLOBAL', orient_matrix=((1, 0, 0), (0, 1, 0), (0, 0, 1)), orient_matrix_type='GLOBAL', mirror=True, use_proportional_edit=False, proportional_edit_falloff='SMOOTH', proportional_size=1, use_proportional_connected=False, use_proportional_projected=False)
-        bpy.ops.object.transform_apply(location=True, rotation=True, scale=True)
-        bpy.ops.object.origin_set(type='ORIGIN_CENTER_OF_MASS', center='MEDIAN')
+        bpy.ops.object.vertex_group_assign_new()
+        bpy.ops.object.mode_set(mode = 'OBJECT')
+        bpy.data.objects['mag_template'].vertex_groups['Group'].name = 'connection'
 
-    for x in range(len(magnet_data)):        
-        bpy.ops.object.select_all(action='DESELECT')
-        bpy.ops.object.add_named(name = 'mag_template')
-        bpy.context.selected_objects[-1].name = 'maghole_' + str(x)
-        bpy.ops.object.select_all(action='DESELECT')
-        bpy.data.objects['maghole_' + str(x)].select_set(True)        
-        bpy.ops.transform.translate(value=bpy.data.objects['mag_' + str(x)].location, orient_type='GLOBAL', orient_matrix=((1, 0, 0), (0, 1, 0), (0, 0, 1)), orient_matrix_type='GLOBAL', mirror=True, use_proportional_edit=False, proportional_edit_falloff='SMOOTH', proportional_size=1, use_proportional_connected=False, use_proportional_projected=False)
-
-        bpy.context.object.rotation_mode = 'QUATERNION'
-        bpy.context.object.rotation_quaternion = mathutils.Vector((bpy.data.objects['mag_' + str(x)].data.polygons[0].normal[0], bpy.data.objects['mag_' + str(x)].data.polygons[0].normal[1], 0)).to_track_quat('X','Z')
-        bpy.ops.object.modifier_add(type='SHRINKWRAP')
-        bpy.context.object.modifiers["Shrinkwrap"].wrap_method = 'PROJECT'
-        bpy.context.object.modifiers["Shrinkwrap"].use_project_x = True
-        bpy.context.object.modifiers["Shrinkwrap"].use_negative_direction = True
-        bpy.context.object.modifiers["Shrinkwrap"].use_positive_direction = False
-        bpy.context.object.modifiers["Shrinkwrap"].target = bpy.data.objects["body"]
-        bpy.context.object.modifiers["Shrinkwrap"].offset = -body_thickness/2
-        bpy.context.object.modifiers["Shrinkwrap"].vertex_group = "connection"
-        bpy.ops.object.modifier_apply(modifier="Shrinkwrap")
-        
         bpy.ops.object.mode_set(mode = 'EDIT')
         bpy.ops.mesh.select_all(action='DESELECT')
         bpy.ops.mesh.select_mode(type="VERT")
         grid_mesh = bmesh.from_edit_mesh(bpy.context.object.data)
         grid_mesh.faces.ensure_lookup_table()
-
-        bpy.ops.object.vertex_group_set_active(group="bottom")
-        bpy.ops.object.vertex_group_select()
-
         for vertex in grid_mesh.verts:
-            if (vertex.select):
-                vertex.co[2] = 0
-
+            if (vertex.co[2] < .1):
+                vertex.select = True
 
+        bpy.ops.object.vertex_group_assign_new()
         bpy.ops.object.mode_set(mode = 'OBJECT')
+        bpy.data.objects['mag_template'].vertex_groups['Group'].name = 'bottom'
 
-    for x in range(len(magnet_data)):
-        bpy.ops.object.select_all(action='DESELECT')
-        bpy.ops.object.add_named(name = 'mag_h_template')
-        bpy.context.selected_objects[-1].name = 'mag_h_' + str(x)
-        bpy.ops.object.select_all(action='DESELECT')
-        bpy.data.objects['mag_h_' + str(x)].select_set(True)    
-        
-        bpy.ops.transform.translate(value=bpy.data.objects['mag_' + str(x)].location, orient_type='GLOBAL', orient_matrix=((1, 0, 0), (0, 1, 0), (0, 0, 1)), orient_matrix_type='GLOBAL', mirror=True, use_proportional_edit=False, proportional_edit_falloff='SMOOTH', proportional_size=1, use_proportional_connected=False, use_proportional_projected=False)
-        bpy.context.object.rotation_mode = 'QUATERNION'
-        bpy.context.object.rotation_quaternion = mathutils.Vector((bpy.data.objects['mag_' + str(x)].data.polygons[0].normal[0], bpy.data.objects['mag_' + str(x)].data.polygons[0].normal[1], 0)).to_track_quat('X','Z')
 
-    bpy.ops.object.select_all(action='DESELECT')
+        bpy.ops.transform.translate(value=(magnet_diameter/2 + 1 + 2.5, 0, 0.5*(magnet_height+2)), orient_type='GLOBAL', orient_matrix=((1, 0, 0), (0, 1, 0), (0, 0, 1)), orient_matrix_type='GLOBAL', mirror=True, use_proportional_edit=False, proportional_edit_falloff='SMOOTH', proportional_size=1, use_proportional_connected=False, use_proportional_projected=False)
+        bpy.ops.object.origin_set(type='ORIGIN_CURSOR', center='MEDIAN')
 
+        bpy.context.active_object.select_set(False)
+        bpy.ops.object.select_all(action='DESELECT')
 
-    for x in range(len(magnet_data)):
-        bpy.data.objects['mag_h_' + str(x)].select_set(True)
-        bpy.context.view_layer.objects.active = bpy.data.objects['mag_h_' + str(x)]
-    bpy.ops.object.join()
-    bpy.context.selected_objects[0].name = "mag_h"
+        bpy.ops.mesh.primitive_cylinder_add(vertices=64, radius=magnet_diameter/2+0.4, depth=2*magnet_height+0.2, enter_editmode=False, align='WORLD', location=(0, 0, 0), scale=(1, 1, 1))
+        bpy.context.active_object.name = 'mag_h_template'
+        bpy.ops.object.transform_apply(location=True, rotation=False, scale=True)
+        bpy.ops.transform.translate(value=(magnet_diameter/2 + 1 + 2.5, 0, -0.2), orient_type='GLOBAL', orient_matrix=((1, 0, 0), (0, 1, 0), (0, 0, 1)), orient_matrix_type='GLOBAL', mirror=True, use_proportional_edit=False, proportional_edit_falloff='SMOOTH', proportional_size=1, use_proportional_connected=False, use_proportional_projected=False)
+        bpy.ops.object.origin_set(type='ORIGIN_CURSOR', center='MEDIAN')
+
+        bpy.ops.curve.primitive_bezier_circle_add(radius=magnet_diameter/2+0.7, enter_editmode=False, align='WORLD', location=(0, 0, 0), scale=(1, 1, 1))
+        bpy.context.active_object.name = 'mag_h_curve'
+        bpy.ops.object.transform_apply(location=True, rotation=False, scale=True)
+        bpy.ops.transform.translate(value=(magnet_diameter/2 + 1 + 2.5, 0, -0.2), orient_type='GLOBAL', orient_matrix=((1, 0, 0), (0, 1, 0), (0, 0, 1)), orient_matrix_type='GLOBAL', mirror=True, use_proportional_edit=False, proportional_edit_falloff='SMOOTH', proportional_size=1, use_proportional_connected=False, use_proportional_projected=False)
+        bpy.ops.object.origin_set(type='ORIGIN_CURSOR', center='MEDIAN')
+
+        bpy.ops.mesh.primitive_cylinder_add(radius=.8, depth=2*magnet_height+5, enter_editmode=False, align='WORLD', location=(0, 0, 0), scale=(1, 1, 1))
+        bpy.context.active_object.name = 'mag_h_template_rib'
+        bpy.ops.object.transform_apply(location=True, rotation=False, scale=True)
+        bpy.ops.transform.translate(value=(magnet_diameter/2 + 1 + 2.5, 0, -0.2), orient_type='GLOBAL', orient_matrix=((1, 0, 0), (0, 1, 0), (0, 0, 1)), orient_matrix_type='GLOBAL', mirror=True, use_proportional_edit=False, proportional_edit_falloff='SMOOTH', proportional_size=1, use_proportional_connected=False, use_proportional_projected=False)
+        bpy.ops.object.origin_set(type='ORIGIN_CURSOR', center='MEDIAN')
+
+        bpy.ops.object.modifier_add(type='ARRAY')
+        bpy.context.object.modifiers["Array"].count = 5
+        bpy.context.object.modifiers["Array"].relative_offset_displace[0] = 2*pi*(magnet_diameter/2+0.7)/5/0.8
+        bpy.ops.object.modifier_apply(modifier="Array")
+
+        bpy.ops.object.modifier_add(type='CURVE')
+        bpy.context.object.modifiers["Curve"].object = bpy.data.objects["mag_h_curve"]
+        bpy.ops.object.modifier_apply(modifier="Curve")
 
-    bpy.context.active_object.select_set(False)
-    bpy.ops.object.select_all(action='DESELECT')
-    for x in range(len(magnet_data)):
-        bpy.data.objects['maghole_' + str(x)].select_set(True)
-        bpy.context.view_layer.objects.active = bpy.data.objects['maghole_' + str(x)]
-    bpy.ops.object.join()
-    bpy.context.selected_objects[0].name = "maghole"
+        bpy.ops.object.select_all(action='DESELECT')
+        bpy.data.objects['mag_h_template'].select_set(True)
+        bpy.context.view_layer.objects.active = bpy.data.objects["mag_h_template"]
+        apply_boolean(bpy.data.objects["mag_h_template"], bpy.data.objects["mag_h_template_rib"])
+
+        save_templates(magnet_template_path, magnet_templates)
+
+
+
+    if magnet_layout is None:
+        # The thumb magnet sits at the lowest key of the outermost thumb column
+        heights = thumb_plate_topology['heights']
+        thumb_magnet = (None, thumb_plate_topology['keys'][(len(heights) - 1, heights[-1] - 1)])
+        #                [location key,        direction key,                          rotation] 
+        magnet_layout = [[(0, 0),              (0, 0),                                 [0, 90, 0] ],
+                         [(ncols-2, 0),        (ncols-2, 0),                           [90, 0, 0] ],
+                         [(ncols-2, nrows-2),  (ncols-2, nrows-2),                     [-90, 0, 0]],
+                         [thumb_magnet,        thumb_magnet,                           [-90, 0, 0]],
+                         [(0, nrows-2),        (0, nrows-2),                           [0, 90, 0] ],
+                         [(ncols-1, 0),        (ncols-1, nrows-2 - (nrows-1)%2),       [0, -90, 0]]]
+
+    # One 2x2 plane per magnet midway between its keys at z=2, all cast onto the body in a single pass
+    plane_frames = []
+    for location_key, direction_key, rotation in magnet_layout:
+        midpoint = (key_by_position[location_key].axis.location + key_by_position[direction_key].axis.location) / 2
+        plane_frames.append(mathutils.Matrix.Translation((midpoint[0], midpoint[1], 2)) @ mathutils.Euler([radians(angle) for angle in rotation]).to_matrix().to_4x4())
+    magnet_planes = build_instanced_mesh('mag_planes', np.array([[-1, -1, 0], [1, -1, 0], [1, 1, 0], [-1, 1, 0]], dtype=float),
+                                         np.arange(4, dtype=np.int32), np.array([4], dtype=np.int32), plane_frames)
+    projection.project(magnet_planes, 'body', positive=False, negative=True, offset=-body_thickness + 1)
+
+    # Magnet frames: the projected plane's centre dropped to the floor, local X along its horizontal normal
+    corners = vertex_coordinates(magnet_planes).reshape(-1, 4, 3)
+    plane_normals = np.cross(corners[:, 2] - corners[:, 0], corners[:, 3] - corners[:, 1])
+    magnet_frames = []
+    for center, normal in zip(corners.mean(axis=1), plane_normals):
+        magnet_frames.append(mathutils.Matrix.Translation((center[0], center[1], center[2] - 1.99)) @ mathutils.Vector((normal[0], normal[1], 0)).to_track_quat('X','Z').to_matrix().to_4x4())
+    magnet_frames = np.array(magnet_frames)
+
+    # Holders: connection side cast back along -X onto the wall, bottom side flattened to the frame origin
+    template_mesh = bpy.data.objects['mag_template']
+    template_arrays = mesh_arrays(template_mesh.data)
+    template_masks = vertex_group_masks(template_mesh, ['connection', 'bottom'])
+    connection = np.tile(template_masks['connection'], len(magnet_frames))
+    bottom_mask = np.tile(template_masks['bottom'], len(magnet_frames))
+    maghole = build_instanced_mesh('maghole', *template_arrays, magnet_frames)
+    frame_x = np.repeat(magnet_frames[:, :3, 0], len(template_arrays[0]), axis=0)
+    projection.project(maghole, 'body', connection, axis=frame_x[connection], positive=False, negative=True, offset=-body_thickness/2)
+    coordinates = vertex_coordinates(maghole)
+    coordinates[bottom_mask, 2] = np.repeat(magnet_frames[:, 2, 3], len(template_arrays[0]))[bottom_mask]
+    set_vertex_coordinates(maghole, coordinates)
+
+    build_instanced_mesh('mag_h', *mesh_arrays(bpy.data.objects['mag_h_template'].data), magnet_frames)
 
-    bpy.context.active_object.select_set(False)
+    bpy.ops.object.select_all(action='DESELECT')
     bpy.context.view_layer.objects.active = bpy.data.objects['body']
 
-    bpy.ops.object.modifier_add(type='BOOLEAN')
-    bpy.context.object.modifiers["Boolean"].operation = 'UNION'
-    bpy.context.object.modifiers["Boolean"].object = bpy.data.objects["maghole"]
-    bpy.context.object.modifiers["Boolean"].solver = 'FAST'
-    bpy.ops.object.modifier_apply(modifier="Boolean")
-
-
-    bpy.ops.object.modifier_add(type='BOOLEAN')
-    bpy.context.object.modifiers["Boolean"].operation = 'DIFFERENCE'
-    bpy.context.object.modifiers["Boolean"].object = bpy.data.objects["mag_h"]
-    bpy.context.object.modifiers["Boolean"].solver = 'FAST'
-    bpy.ops.object.modifier_apply(modifier="Boolean")
+    apply_boolean(bpy.data.objects['body'], bpy.data.objects["maghole"], 'UNION')
+    apply_boolean(bpy.data.objects['body'], bpy.data.objects["mag_h"], 'DIFFERENCE')
 
 
     bpy.context.view_layer.objects.active = bpy.data.objects["maghole"]
@@ -1748,18 +2568,14 @@ if magnet_bottom:
 
     bpy.context.view_layer.objects.active = bpy.data.objects["bottom"]
 
-    bpy.ops.object.modifier_add(type='BOOLEAN')
-    bpy.context.object.modifiers["Boolean"].operation = 'DIFFERENCE'
-    bpy.context.object.modifiers["Boolean"].object = bpy.data.objects["mag_h"]
-    #bpy.context.object.modifiers["Boolean"].use_self = True
-    bpy.context.object.modifiers["Boolean"].solver = 'FAST'
-    bpy.ops.object.modifier_apply(modifier="Boolean")
+    apply_boolean(bpy.data.objects["bottom"], bpy.data.objects["mag_h"], 'DIFFERENCE')
 
     bpy.context.view_layer.objects.active = bpy.data.objects["body"]
 
     bpy.ops.object.select_all(action='DESELECT')
-    for object in ['mag_0', 'mag_1', 'mag_2', 'mag_3', 'mag_4', 'mag_5', 'mag_template', 'mag_h_template', 'mag_h', 'maghole', 'mag_template', 'mag_h_template_rib', 'mag_h_curve']:
-        bpy.data.objects[object].select_set(True)
+    for object in ['mag_planes', 'mag_template', 'mag_h_template', 'mag_h', 'maghole', 'mag_h_template_rib', 'mag_h_curve']:
+        if object in bpy.data.objects:
+            bpy.data.objects[object].select_set(True)
     with suppress_stdout(): bpy.ops.object.delete()
 
 
@@ -1769,27 +2585,12 @@ if magnet_bottom:
 ## Create Switch Holes ##
 #########################
 
-print("{:.2f}".format(time.time()-start_time), "- Add Switch Holes")
+stage("Add Switch Holes")
 
 bpy.context.view_layer.objects.active = bpy.data.objects["body"]
 bpy.data.objects['body'].select_set(True)
 
-bpy.ops.object.modifier_add(type='BOOLEAN')
-bpy.context.object.modifiers["Boolean"].operand_type = 'COLLECTION'
-bpy.context.object.modifiers["Boolean"].solver = 'FAST'
-bpy.context.object.modifiers["Boolean"].collection = bpy.data.collections["SWITCH_HOLE"]
-bpy.ops.object.modifier_apply(modifier="Boolean")
-
-
-'''
-for thing in bpy.data.collections['SWITCH_HOLE'].objects:
-    print("   ---" + thing.name)
-    bpy.ops.object.modifier_add(type='BOOLEAN')
-    bpy.context.object.modifiers["Boolean"].object = thing
-    #bpy.context.object.modifiers["Boolean"].use_self = True
-    bpy.context.object.modifiers["Boolean"].use_hole_tolerant = True
-    bpy.ops.object.modifier_apply(modifier="Boolean")
-'''
+apply_boolean(bpy.data.objects['body'], switch_holes, self_intersecting=True)
 
 
 #########################
@@ -1797,25 +2598,12 @@ for thing in bpy.data.collections['SWITCH_HOLE'].objects:
 #########################
 
 if switch_support:
-    print("{:.2f}".format(time.time()-start_time), "- Add Switch Supports")
+    stage("Add Switch Supports")
     
     bpy.context.view_layer.objects.active = bpy.data.objects["body"]
     bpy.data.objects['body'].select_set(True)
     
-    bpy.ops.object.modifier_add(type='BOOLEAN')
-    bpy.context.object.modifiers["Boolean"].operation = 'UNION'
-    bpy.context.object.modifiers["Boolean"].operand_type = 'COLLECTION'
-    bpy.context.object.modifiers["Boolean"].solver = 'FAST'
-    bpy.context.object.modifiers["Boolean"].collection = bpy.data.collections["SWITCH_SUPPORT"]
-    bpy.ops.object.modifier_apply(modifier="Boolean")
-    '''
-    for thing in bpy.data.collections['SWITCH_SUPPORT'].objects:
-        print("   ---" + thing.name)
-        bpy.ops.object.modifier_add(type='BOOLEAN')
-        bpy.context.object.modifiers["Boolean"].operation = 'UNION'
-        bpy.context.object.modifiers["Boolean"].object = thing
-        bpy.ops.object.modifier_apply(modifier="Boolean")
-    '''
+    apply_boolean(bpy.data.objects['body'], switch_supports, 'UNION', self_intersecting=True)
 
 
 
@@ -1823,14 +2611,19 @@ if switch_support:
 ## Clean Up ##
 ##############
 
-print("{:.2f}".format(time.time()-start_time), "- Clean Up")
+stage("Clean Up")
 
 bpy.ops.object.select_all(action='DESELECT')
 
-for collection in ['AXIS', 'SWITCH_SUPPORT', 'SWITCH_HOLE', 'SWITCH_PROJECTION', 'SWITCH_PROJECTION_INNER', 'KEYCAP_PROJECTION_OUTER', 'KEYCAP_PROJECTION_INNER']:
+for collection in ['AXIS', 'SWITCH_PROJECTION', 'SWITCH_PROJECTION_INNER', 'KEYCAP_PROJECTION_OUTER', 'KEYCAP_PROJECTION_INNER']:
     for thing in bpy.data.collections[collection].objects:
         thing.select_set(True)
     with suppress_stdout(): bpy.ops.object.delete()
     bpy.data.collections.remove(bpy.data.collections[collection])
 
-print("{:.2f}".format(time.time()-start_time), "- DONE")
+for operand in [switch_holes, switch_supports]:
+    mesh = operand.data
+    bpy.data.objects.remove(operand)
+    bpy.data.meshes.remove(mesh)
+
+stage("DONE")
@@ -0,0 +1,261 @@
+"""Key frames of a Blended-DM design computed with NumPy, without Blender.
+
+The placement math mirrors the "FINGER KEY LOCATIONS" and "THUMB KEY LOCATIONS" stages of
+blended-dm.py: every key gets the 4x4 world matrix its key_axis ends up with. Parameter
+defaults are read from the generator's parameter sections, so the two cannot drift apart:
+
+    import key_layout
+    parameters = key_layout.resolve_parameters({'nrows': 6})
+    layout = key_layout.key_frames(parameters)
+    topology = key_layout.finger_topology(parameters)
+    thumb = key_layout.thumb_topology(parameters, layout)
+
+The finger and thumb plate topologies (boundary, bridge and correction vertices) run the
+generator's own finger_topology and thumb_topology. The finger scaling benchmark times it
+over grids from 4x5 to 32x32. Up to about 8x8 (60 keys) a call costs a near constant 20-40 us
+of call and setup overhead, so the linear fit is only meaningful over the larger grids:
+
+    python src/key_layout.py --benchmark
+"""
+
+import argparse
+import ast
+import os
+import re
+import sys
+import timeit
+from functools import lru_cache
+from math import pi, radians, sin, cos
+
+import numpy as np
+
+
+GENERATOR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'blended-dm.py')
+
+# Tool shape constants from the generator's "Initialize Tool Shapes" stage
+keyswitch_height = 14.4
+keyswitch_width = 14.4
+mount_thickness = 4
+mount_height = keyswitch_height + 3
+mount_width = keyswitch_width + 3
+
+
+
+################
+## Parameters ##
+################
+
+def generator_parameter_source(path: str = GENERATOR) -> str:
+    """The generator's Shape and Shell parameter sections, up to the override hook."""
+    with open(path) as handle:
+        source = handle.read()
+    start = source.index("## Shape Parameters ##")
+    end = source.index("## Parameter Overrides ##")
+    return source[source.index('\n', start) + 1:source.rindex('\n', 0, end)]
+
+
+@lru_cache(maxsize=None)
+def generator_function(section: str, name: str, path: str = GENERATOR, uses: tuple = ()):
+    """A Blender-free function defined in one of the generator's sections, compiled on its own.
+
+    Only the function's definition is taken from the parsed generator, so neither the code nor
+    the comments around it can change or cut it short. Its globals are just NumPy and the
+    functions of the same section named in uses, which it calls.
+    """
+    with open(path) as handle:
+        source = handle.read()
+    lines = source.split('\n')
+    banners = [number + 1 for number, line in enumerate(lines[:-1], 1)
+               if re.fullmatch(r'#{3,}', line) and re.fullmatch(r'##.+##', lines[number])]
+    start = next(banner for banner in banners if lines[banner - 1].strip('# ') == section)
+    end = next((banner for banner in banners if banner > start), len(lines))
+    definitions = [next(node for node in ast.parse(source).body
+                        if isinstance(node, ast.FunctionDef) and node.name == function and start < node.lineno < end)
+                   for function in (name,) + tuple(uses)]
+    namespace = {'np': np}
+    exec(compile(ast.Module(body=definitions, type_ignores=[]), path, 'exec'), namespace)
+    return namespace[name]
+
+
+def resolve_parameters(overrides: dict = None, path: str = GENERATOR) -> dict:
+    """Parameter values exactly as the generator sees them after applying overrides.
+
+    Derived parameters left at None (centerrow, column_style, left_wall_x_offset) are computed
+    from the overridden values by the generator's derive_parameters.
+    """
+    parameters = {'pi': pi, 'radians': radians, 'sin': sin, 'cos': cos}
+    exec(generator_parameter_source(path), parameters)
+    parameters.update(overrides or {})
+    generator_function("Derived Parameters", 'derive_parameters', path)(parameters)
+    parameters['lastrow'] = parameters['nrows'] - 1
+    parameters['cornerrow'] = parameters['lastrow'] - 1
+    for name in ['pi', 'radians', 'sin', 'cos', '__builtins__']:
+        parameters.pop(name, None)
+    return parameters
+
+
+
+################
+## Transforms ##
+################
+
+def rotation(axis: str, angle: float) -> np.ndarray:
+    """Right-handed rotation about a world axis as a 4x4 matrix."""
+    c, s = cos(angle), sin(angle)
+    i, j = {'X': (1, 2), 'Y': (2, 0), 'Z': (0, 1)}[axis]
+    matrix = np.eye(4)
+    matrix[i, i] = matrix[j, j] = c
+    matrix[i, j], matrix[j, i] = -s, s
+    return matrix
+
+
+def translation(offset) -> np.ndarray:
+    matrix = np.eye(4)
+    matrix[:3, 3] = offset
+    return matrix
+
+
+def rotation_about(axis: str, angle: float, center) -> np.ndarray:
+    return translation(center) @ rotation(axis, angle) @ translation(-np.asarray(center, dtype=float))
+
+
+
+################
+## Key Frames ##
+################
+
+def key_present(parameters: dict, column: int, row: int) -> bool:
+    return column in parameters['lastrow_columns'] or row != parameters['lastrow']
+
+
+def finger_frame(parameters: dict, column: int, row: int) -> np.ndarray:
+    """World matrix of a finger key's axis; transform.rotate(value=-a) is a rotation by +a."""
+    p = parameters
+    cap_top_height = mount_thickness + p['sa_profile_key_height']
+    row_radius = ((mount_height + p['extra_height']) / 2) / (sin(p['alpha'] / 2)) + cap_top_height
+    column_radius = (((mount_width + p['extra_width']) / 2) / (sin(p['beta'] / 2))) + cap_top_height
+    wide = column == p['ncols'] - 1 and p['wide_pinky']
+    column_angle = p['beta'] * (p['centercol'] - column - (0.25 if wide else 0))
+    spread = (column - p['centercol'] + (0.25 if wide else 0)) * (1 + column_radius * sin(p['beta']))
+
+    frame = rotation_about('X', p['alpha'] * (p['centerrow'] - row), (0, 0, row_radius))
+    if p['column_style'] == "standard":
+        frame = rotation_about('Y', column_angle, (0, 0, column_radius)) @ frame
+    elif p['column_style'] == "orthographic":
+        frame = rotation('Y', column_angle) @ frame
+        frame = translation((spread, 0, column_radius * (1 - cos(column_angle)))) @ frame
+    elif p['column_style'] == "cylindrical":
+        frame = translation((spread, 0, column_radius * (1 - cos(column_angle)))) @ frame
+    frame = translation(p['column_offset'](column)) @ frame
+    return translation((0, 0, p['keyboard_z_offset'])) @ rotation('Y', p['tenting_angle']) @ frame
+
+
+def thumb_origin(parameters: dict) -> np.ndarray:
+    frame = finger_frame(parameters, 1, parameters['cornerrow'])
+    return (frame @ np.array([mount_height / 2, -mount_width / 2, 0, 1]))[:3]
+
+
+def thumb_frame(parameters: dict, thumb: int, origin: np.ndarray) -> np.ndarray:
+    angles, offset = parameters['th_layout'][thumb][:2]
+    frame = rotation('Z', radians(angles[2])) @ rotation('Y', radians(angles[1])) @ rotation('X', radians(angles[0]))
+    return translation(origin + np.asarray(parameters['thumb_offsets'], dtype=float) + np.asarray(offset, dtype=float)) @ frame
+
+
+def key_frames(parameters: dict) -> dict:
+    """Every key of the design in registration order.
+
+    Returns 'positions' ((column, row) for finger keys, (None, n) for thumb keys, as in the
+    generator's key_by_position), 'frames' (n, 4, 4) world matrices of the key axes, 'sizes'
+    (1 or 1.5 u, thumb keys as set in th_layout) and 'rotated' (1.5u tools turned 90 degrees about Z, the wide pinky column).
+    """
+    p = parameters
+    positions, frames, sizes, rotated = [], [], [], []
+    for column in range(p['ncols']):
+        for row in range(p['nrows']):
+            if key_present(p, column, row):
+                wide = column == p['ncols'] - 1 and p['wide_pinky']
+                positions.append((column, row))
+                frames.append(finger_frame(p, column, row))
+                sizes.append(1.5 if wide else 1)
+                rotated.append(wide)
+
+    origin = thumb_origin(p)
+    for thumb in range(len(p['th_layout'])):
+        positions.append((None, thumb))
+        frames.append(thumb_frame(p, thumb, origin))
+        sizes.append(p['th_layout'][thumb][2] if len(p['th_layout'][thumb]) > 2 else 1)
+        rotated.append(False)
+
+    return {'positions': positions, 'frames': np.array(frames), 'sizes': np.array(sizes, dtype=float), 'rotated': np.array(rotated)}
+
+
+
+#####################
+## Finger Topology ##
+#####################
+
+def finger_topology(parameters: dict) -> dict:
+    """The generator's finger_topology for the parameter set's key mask.
+
+    Returns 'bottoms' (lowest grid row w per column), 'chains' (grid vertices (u, w) of every
+    finger side and bridge in walking order), 'seeds' (vertex group name and grid vertices as
+    assigned by the plate stage) and 'corrections' (end vertices of each correction face).
+    """
+    p = parameters
+    present = [[key_present(p, column, row) for row in range(p['nrows'])] for column in range(p['ncols'])]
+    return generator_function("Finger Topology", 'finger_topology')(p['nrows'], p['ncols'], present)
+
+
+def thumb_topology(parameters: dict, layout: dict = None) -> dict:
+    """The generator's thumb_topology for where the parameter set's thumb keys land.
+
+    Returns 'slots' ((column, row) per thumb key), 'keys' (thumb key per slot), 'heights',
+    'vertices' (grid vertices (i, j), four per key), 'faces', 'corrections', 'chains' and
+    'groups' like finger_topology, on the thumb plate grid.
+    """
+    layout = layout or key_frames(parameters)
+    thumbs = [index for index, position in enumerate(layout['positions']) if position[0] is None]
+    return generator_function("Thumb Topology", 'thumb_topology')(layout['frames'][thumbs], mount_height / 2)
+
+
+def benchmark(sizes: list, number: int) -> list:
+    """Seconds per finger_topology call for each (nrows, ncols)."""
+    results = []
+    for nrows, ncols in sizes:
+        parameters = resolve_parameters({'nrows': nrows, 'ncols': ncols})
+        keys = sum(key_present(parameters, column, row) for column in range(ncols) for row in range(nrows))
+        seconds = min(timeit.repeat(lambda: finger_topology(parameters), number=number, repeat=5)) / number
+        results.append({'nrows': nrows, 'ncols': ncols, 'keys': keys, 'seconds': seconds})
+    return results
+
+
+def main(argv: list) -> int:
+    parser = argparse.ArgumentParser(description="Finger plate topology of a parameter set")
+    parser.add_argument('--nrows', type=int)
+    parser.add_argument('--ncols', type=int)
+    parser.add_argument('--benchmark', action='store_true', help="time the topology over grids from 4x5 to 32x32")
+    parser.add_argument('--number', type=int, default=200, help="calls per benchmark timing")
+    args = parser.parse_args(argv)
+
+    if args.benchmark:
+        results = benchmark([(nrows, ncols) for nrows in [4, 6, 8, 16, 32] for ncols in [5, 6, 8, 16, 32]], args.number)
+        for result in results:
+            print("{nrows}x{ncols}  {keys:3d} keys  ".format(**result) + "{:7.2f} us  {:.3f} us/key".format(result['seconds'] * 1e6, result['seconds'] * 1e6 / result['keys']))
+        keys = np.array([result['keys'] for result in results])
+        seconds = np.array([result['seconds'] for result in results]) * 1e6
+        slope, intercept = np.polyfit(keys, seconds, 1)
+        residual = seconds - (slope * keys + intercept)
+        print("linear fit {:.2f} us + {:.3f} us/key, r^2 {:.3f}".format(intercept, slope, 1 - residual.var() / seconds.var()))
+        return 0
+
+    overrides = {name: value for name, value in [('nrows', args.nrows), ('ncols', args.ncols)] if value is not None}
+    topology = finger_topology(resolve_parameters(overrides))
+    for side, vertices in topology['seeds']:
+        print("{:20s}".format(side), vertices)
+    for number, correction in enumerate(topology['corrections']):
+        print("{:20s}".format('CORRECTION_' + str(number + 1)), list(correction))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
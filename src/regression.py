@@ -0,0 +1,178 @@
+"""Golden-geometry regression check against the .stl files shipped in things/.
+
+Every case regenerates a shipped configuration through the worker's run_job and compares
+each exported object with its golden file: volume, bounding box, triangle count band, open
+edges and a sampled symmetric Hausdorff distance from BVH nearest-point queries. Run it
+before and after a performance change to check that the generated geometry is preserved:
+
+    python src/regression.py --blender /path/to/blender
+    python src/regression.py --blender /path/to/blender --case 5x6_geode --report out/report.json
+
+Outside Blender the script relaunches itself in a background Blender. The exit status is 1
+when any object is outside its tolerances.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+try:
+    import bpy
+    from mathutils.bvhtree import BVHTree
+except ImportError:
+    bpy = None
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import stl_mesh
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+THINGS = os.path.join(ROOT, 'things')
+
+# Shipped .stl files and the parameter overrides that produce them
+cases = {'5x6_geode': {'parameters': {'geode_mode': True},
+                       'golden': {'body': 'blended_dm_5x6_geode_body.stl', 'bottom': 'blended_dm_5x6_geode_bottom.stl'}},
+         '5x6_lvl-5': {'parameters': {'body_subsurf_level': 5},
+                       'golden': {'bottom': 'blended_dm_5x6_lvl-5_bottom.stl'}}}
+
+default_tolerances = {'volume': 0.01,           # relative
+                      'bounding_box': 0.5,      # mm per bound
+                      'triangles': 0.25,        # relative band around the golden count
+                      'hausdorff': 0.5}         # mm
+
+
+
+################
+## Comparison ##
+################
+
+def sample_surface(triangles: np.ndarray, count: int, seed: int = 0) -> np.ndarray:
+    """Area-weighted uniform points on the triangles, reproducible per seed."""
+    generator = np.random.default_rng(seed)
+    areas = np.linalg.norm(np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0]), axis=1)
+    chosen = generator.choice(len(triangles), size=count, p=areas / areas.sum())
+    u, v = generator.random(count), generator.random(count)
+    flip = u + v > 1
+    u[flip], v[flip] = 1 - u[flip], 1 - v[flip]
+    corners = triangles[chosen]
+    return corners[:, 0] + u[:, None] * (corners[:, 1] - corners[:, 0]) + v[:, None] * (corners[:, 2] - corners[:, 0])
+
+
+def bvh_tree(triangles: np.ndarray):
+    return BVHTree.FromPolygons(triangles.reshape(-1, 3).tolist(), np.arange(len(triangles) * 3).reshape(-1, 3).tolist(), all_triangles=True)
+
+
+def directed_distances(points: np.ndarray, tree) -> np.ndarray:
+    return np.array([tree.find_nearest(point)[3] for point in points.tolist()])
+
+
+def hausdorff(first: np.ndarray, second: np.ndarray, samples: int) -> dict:
+    """Sampled symmetric Hausdorff distance (and the mean distance) between two surfaces."""
+    forward = directed_distances(sample_surface(first, samples, seed=1), bvh_tree(second))
+    backward = directed_distances(sample_surface(second, samples, seed=2), bvh_tree(first))
+    return {'max': float(max(forward.max(), backward.max())),
+            'mean': float((forward.mean() + backward.mean()) / 2)}
+
+
+def compare(generated: np.ndarray, golden: np.ndarray, tolerances: dict, samples: int) -> dict:
+    """Metrics of generated against golden stl_mesh records and the tolerances each one fails.
+
+    The shipped geode body has 48 open edges around its switch punch-outs, so open edges fail
+    only when there are more than in the golden file.
+    """
+    edges, golden_edges = stl_mesh.edge_counts(stl_mesh.weld(generated)[1]), stl_mesh.edge_counts(stl_mesh.weld(golden)[1])
+    metrics = {'volume': stl_mesh.volume(generated), 'golden_volume': stl_mesh.volume(golden),
+               'bounding_box_error': float(np.abs(stl_mesh.bounding_box(generated) - stl_mesh.bounding_box(golden)).max()),
+               'triangles': len(generated), 'golden_triangles': len(golden),
+               'open_edges': edges['boundary'] + edges['non_manifold'],
+               'golden_open_edges': golden_edges['boundary'] + golden_edges['non_manifold'],
+               'watertight': stl_mesh.closed(edges), 'golden_watertight': stl_mesh.closed(golden_edges),
+               'hausdorff': hausdorff(stl_mesh.triangles(generated), stl_mesh.triangles(golden), samples)}
+
+    failures = []
+    if abs(metrics['volume'] - metrics['golden_volume']) > tolerances['volume'] * abs(metrics['golden_volume']):
+        failures.append('volume')
+    if metrics['bounding_box_error'] > tolerances['bounding_box']:
+        failures.append('bounding_box')
+    if abs(len(generated) - len(golden)) > tolerances['triangles'] * len(golden):
+        failures.append('triangles')
+    if metrics['hausdorff']['max'] > tolerances['hausdorff']:
+        failures.append('hausdorff')
+    if metrics['open_edges'] > metrics['golden_open_edges']:
+        failures.append('open_edges')
+    metrics['failures'] = failures
+    return metrics
+
+
+
+###########################
+## Regression in Blender ##
+###########################
+
+def run_case(name: str, output_dir: str, tolerances: dict, samples: int) -> dict:
+    import worker
+
+    case = cases[name]
+    result = worker.run_job({'id': name, 'parameters': case['parameters'],
+                             'outputs': list(case['golden']), 'output_dir': output_dir})
+    report = {'case': name, 'status': result['status'], 'total': result['telemetry'].get('total'), 'objects': {}}
+    if result['status'] != 'ok':
+        report['error'] = result.get('error')
+        return report
+
+    for obj, golden in case['golden'].items():
+        if obj not in result['outputs']:
+            report['objects'][obj] = {'failures': ['missing']}
+            continue
+        report['objects'][obj] = compare(stl_mesh.load(result['outputs'][obj]), stl_mesh.load(os.path.join(THINGS, golden)), tolerances, samples)
+    return report
+
+
+def blender_main(argv: list) -> int:
+    parser = argparse.ArgumentParser(description="Golden geometry regression check")
+    parser.add_argument('--case', action='append', choices=sorted(cases), help="case to run, all by default")
+    parser.add_argument('--output-dir', default=os.path.join(tempfile.gettempdir(), 'blended-dm-regression'))
+    parser.add_argument('--report', help="write the JSON report here")
+    parser.add_argument('--samples', type=int, default=5000, help="surface samples per mesh for the Hausdorff distance")
+    for name, value in default_tolerances.items():
+        parser.add_argument('--' + name.replace('_', '-') + '-tolerance', dest=name, type=float, default=value)
+    args = parser.parse_args(argv)
+    tolerances = {name: getattr(args, name) for name in default_tolerances}
+
+    reports = []
+    for name in args.case or sorted(cases):
+        started = time.time()
+        report = run_case(name, args.output_dir, tolerances, args.samples)
+        reports.append(report)
+        print("case", name, report['status'], "in {:.1f} s".format(time.time() - started))
+        for obj, metrics in report['objects'].items():
+            if 'volume' in metrics:
+                print("   ", obj, "volume {:.0f} / {:.0f} mm3, bbox {:.3f} mm, triangles {} / {}, hausdorff {:.3f} mm (mean {:.3f}), open edges {} / {}".format(
+                    metrics['volume'], metrics['golden_volume'], metrics['bounding_box_error'], metrics['triangles'],
+                    metrics['golden_triangles'], metrics['hausdorff']['max'], metrics['hausdorff']['mean'],
+                    metrics['open_edges'], metrics['golden_open_edges']))
+            print("   ", obj, "FAIL " + ", ".join(metrics['failures']) if metrics['failures'] else "ok")
+
+    if args.report:
+        os.makedirs(os.path.dirname(os.path.abspath(args.report)), exist_ok=True)
+        with open(args.report, 'w') as handle:
+            json.dump({'tolerances': tolerances, 'cases': reports}, handle, indent=2)
+    failed = [report for report in reports if report['status'] != 'ok' or any(metrics['failures'] for metrics in report['objects'].values())]
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    if bpy is not None:
+        sys.exit(blender_main(sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []))
+    else:
+        # Relaunch in a background Blender, passing everything but --blender through
+        launcher = argparse.ArgumentParser(add_help=False)
+        launcher.add_argument('--blender', default='blender')
+        known, rest = launcher.parse_known_args(sys.argv[1:])
+        sys.exit(subprocess.call([known.blender, '--background', '--factory-startup', '--python', os.path.abspath(__file__), '--'] + rest))
@@ -0,0 +1,261 @@
+"""The run history: a SQLite database every generation appends to, and queries over it.
+
+The generator imports this module to record each run (worker.py records the jobs that fail)
+in ~/.blended-dm/run_history.sqlite by default: parameters and their hash, stage and step
+timings, polycounts, boolean solver retries, status and host. It reads the recent runs of
+its layout back for the ETA. The queries need neither Blender nor the generator:
+
+    python src/run_history.py summary --days 7
+    python src/run_history.py percentile --stage "punch out" --layout 5x6 --where body_subsurf_level=2 --days 30 --q 95
+    python src/run_history.py slow --days 30 --factor 1.5
+    python src/run_history.py runs --limit 20 --json
+
+Runs are selected by age (--days), layout prefix (--layout, e.g. "5x6" or "5x6+6 subsurf 2"),
+parameter values (--where name=value, values parsed as JSON) and host. A run is slow when its
+time is more than --factor times the median of the selected runs of its layout. The exit status
+of slow is 1 when any run is flagged, so a build queue can alert on it.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import sys
+import time
+from contextlib import closing
+
+import numpy as np
+
+import key_layout
+
+
+default_run_history_path = os.path.join(os.path.expanduser('~'), '.blended-dm', 'run_history.sqlite')
+
+run_history_schema = """
+CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY, started REAL, host TEXT, layout TEXT, parameter_hash TEXT,
+                                 parameters TEXT, status TEXT, total REAL, retries INTEGER, polycount TEXT, error TEXT);
+CREATE TABLE IF NOT EXISTS stages (run INTEGER REFERENCES runs (id), position INTEGER, stage TEXT, seconds REAL, steps TEXT);
+CREATE INDEX IF NOT EXISTS runs_layout ON runs (layout, started);
+CREATE INDEX IF NOT EXISTS stages_run ON stages (run, position);
+"""
+
+
+
+###########
+## Store ##
+###########
+
+def layout_signature(parameters: dict) -> str:
+    p = parameters
+    return "{}x{}+{} subsurf {}{}{}{}{}".format(p['nrows'], p['ncols'], len(p['th_layout']), p['body_subsurf_level'], " geode" * p['geode_mode'],
+        " loligagger" * p['loligagger_port'], " magnets" * p['magnet_bottom'], " supports" * p['switch_support'])
+
+
+def parameter_hash(parameters: dict) -> str:
+    return hashlib.sha1(json.dumps(parameters, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def open_run_history(path: str) -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    connection = sqlite3.connect(path, timeout=30)
+    connection.executescript(run_history_schema)
+    return connection
+
+
+def record_run(path: str, run: dict) -> int:
+    """Append one run: the runs columns (parameters and polycount as dicts) and its stages as
+    (stage, seconds, steps) in order, seconds None for the final DONE marker. A variant forked by
+    variant_tree.py has no total, as it only ran the stages after its fork."""
+    with closing(open_run_history(path)) as connection, connection:
+        run_id = connection.execute("INSERT INTO runs (started, host, layout, parameter_hash, parameters, status, total, retries, polycount, error)"
+                                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                    (run['started'], run.get('host', socket.gethostname()), run['layout'], parameter_hash(run['parameters']),
+                                     json.dumps(run['parameters'], sort_keys=True), run['status'], run['total'], run.get('retries', 0),
+                                     json.dumps(run.get('polycount', {})), run.get('error'))).lastrowid
+        connection.executemany("INSERT INTO stages (run, position, stage, seconds, steps) VALUES (?, ?, ?, ?, ?)",
+                               [(run_id, position, stage, seconds, None if steps is None else json.dumps(steps))
+                                for position, (stage, seconds, steps) in enumerate(run.get('stages', []))])
+    return run_id
+
+
+def recent_runs(path: str, layout: str, count: int) -> list:
+    """The last count successful runs of a layout, oldest first, as {'order', 'stages', 'steps'}."""
+    if not os.path.exists(path):
+        return []
+    with closing(open_run_history(path)) as connection:
+        ids = [row[0] for row in connection.execute("SELECT id FROM runs WHERE layout = ? AND status = 'ok' ORDER BY started DESC LIMIT ?", (layout, count))]
+        runs = []
+        for run_id in reversed(ids):
+            rows = connection.execute("SELECT stage, seconds, steps FROM stages WHERE run = ? ORDER BY position", (run_id,)).fetchall()
+            runs.append({'order': [stage for stage, _, _ in rows],
+                         'stages': {stage: seconds for stage, seconds, _ in rows if seconds is not None},
+                         'steps': {stage: json.loads(steps) for stage, _, steps in rows if steps is not None}})
+    return runs
+
+
+def job_parameters(overrides: dict) -> dict:
+    """The run parameters the generator would record for a job's overrides."""
+    defaults, resolved = key_layout.resolve_parameters({}), key_layout.resolve_parameters(overrides)
+    return {name: resolved[name] for name in defaults
+            if name not in ['lastrow', 'cornerrow'] and isinstance(resolved[name], (bool, int, float, str, list, tuple))}
+
+
+
+#############
+## Queries ##
+#############
+
+def load_runs(path: str, days: float = None, layout: str = None, where: dict = None, host: str = None) -> list:
+    """Selected runs, oldest first, with their parameters, polycount and stage seconds decoded."""
+    if not os.path.exists(path):
+        return []
+    query, arguments = "SELECT id, started, host, layout, parameter_hash, parameters, status, total, retries, polycount, error FROM runs WHERE 1", []
+    if days is not None:
+        query += " AND started >= ?"
+        arguments.append(time.time() - days * 86400)
+    if layout:
+        query += " AND substr(layout, 1, ?) = ?"
+        arguments += [len(layout), layout]
+    if host:
+        query += " AND host = ?"
+        arguments.append(host)
+
+    runs = []
+    with closing(open_run_history(path)) as connection:
+        for row in connection.execute(query + " ORDER BY started", arguments):
+            run = dict(zip(['id', 'started', 'host', 'layout', 'parameter_hash', 'parameters', 'status', 'total', 'retries', 'polycount', 'error'], row))
+            run['parameters'], run['polycount'] = json.loads(run['parameters']), json.loads(run['polycount'])
+            if any(run['parameters'].get(name) != value for name, value in (where or {}).items()):
+                continue
+            run['stages'] = {stage: seconds for stage, seconds in connection.execute(
+                "SELECT stage, seconds FROM stages WHERE run = ? AND seconds IS NOT NULL ORDER BY position", (run['id'],))}
+            runs.append(run)
+    return runs
+
+
+def run_seconds(run: dict, stage: str = None):
+    """Total seconds of a run, or of its first stage whose name contains stage (any case)."""
+    if stage is None:
+        return run['total']
+    return next((seconds for name, seconds in run['stages'].items() if stage.lower() in name.lower()), None)
+
+
+def build_seconds(run: dict) -> float:
+    """Seconds the run kept a machine busy: its total, or for a forked variant its own stages."""
+    if run['total'] is not None:
+        return run['total']
+    return sum(seconds or 0 for seconds in run['stages'].values())
+
+
+def percentile(runs: list, q: float, stage: str = None) -> dict:
+    seconds = [value for value in (run_seconds(run, stage) for run in runs if run['status'] == 'ok') if value is not None]
+    return {'runs': len(seconds), 'stage': stage or 'total', 'q': q,
+            'seconds': float(np.percentile(seconds, q)) if seconds else None,
+            'median': float(np.median(seconds)) if seconds else None}
+
+
+def slow_runs(runs: list, factor: float, stage: str = None, min_runs: int = 3) -> list:
+    """Successful runs slower than factor times the median of their layout, slowest first."""
+    by_layout = {}
+    for run in runs:
+        if run['status'] == 'ok' and run_seconds(run, stage) is not None:
+            by_layout.setdefault(run['layout'], []).append(run)
+    flagged = []
+    for layout, layout_runs in by_layout.items():
+        if len(layout_runs) < min_runs:
+            continue
+        median = float(np.median([run_seconds(run, stage) for run in layout_runs]))
+        for run in layout_runs:
+            ratio = run_seconds(run, stage) / median if median > 0 else 1
+            if ratio > factor:
+                flagged.append({'id': run['id'], 'started': run['started'], 'host': run['host'], 'layout': layout,
+                                'seconds': run_seconds(run, stage), 'median': median, 'ratio': ratio})
+    return sorted(flagged, key=lambda entry: -entry['ratio'])
+
+
+def summary(runs: list, days: float = None) -> list:
+    """Per layout: runs, failures, retries, p50 / p95 total and build seconds per day, for capacity planning."""
+    by_layout = {}
+    for run in runs:
+        by_layout.setdefault(run['layout'], []).append(run)
+    started = [run['started'] for run in runs] or [0]
+    span = days * 86400 if days else max(max(started) - min(started), 86400)
+    rows = []
+    for layout, layout_runs in sorted(by_layout.items()):
+        totals = [run['total'] for run in layout_runs if run['status'] == 'ok' and run['total'] is not None]
+        rows.append({'layout': layout, 'runs': len(layout_runs), 'failures': sum(run['status'] != 'ok' for run in layout_runs),
+                     'retries': sum(run['retries'] or 0 for run in layout_runs),
+                     'p50': float(np.percentile(totals, 50)) if totals else None,
+                     'p95': float(np.percentile(totals, 95)) if totals else None,
+                     'seconds_per_day': sum(build_seconds(run) for run in layout_runs) / span * 86400})
+    return rows
+
+
+
+##########
+## Main ##
+##########
+
+def parse_where(values: list) -> dict:
+    where = {}
+    for value in values or []:
+        name, _, text = value.partition('=')
+        try:
+            where[name] = json.loads(text)
+        except ValueError:
+            where[name] = text
+    return where
+
+
+def format_seconds(seconds) -> str:
+    return "-" if seconds is None else "{:.1f} s".format(seconds)
+
+
+def main(argv: list) -> int:
+    parser = argparse.ArgumentParser(description="Run history queries")
+    parser.add_argument('command', choices=['summary', 'percentile', 'slow', 'runs'])
+    parser.add_argument('--db', default=default_run_history_path, help="run history database")
+    parser.add_argument('--days', type=float, help="only runs started in the last DAYS days")
+    parser.add_argument('--layout', help="layout prefix, e.g. 5x6 or '5x6+6 subsurf 2'")
+    parser.add_argument('--where', action='append', metavar='NAME=VALUE', help="parameter value, repeatable")
+    parser.add_argument('--host')
+    parser.add_argument('--stage', help="stage name or part of it, the total run time by default")
+    parser.add_argument('--q', type=float, default=95, help="percentile")
+    parser.add_argument('--factor', type=float, default=1.5, help="slow when over FACTOR times the layout median")
+    parser.add_argument('--limit', type=int, default=20, help="latest runs listed")
+    parser.add_argument('--json', action='store_true', help="print the result as JSON")
+    args = parser.parse_args(argv)
+
+    runs = load_runs(args.db, args.days, args.layout, parse_where(args.where), args.host)
+    if args.command == 'summary':
+        result = summary(runs, args.days)
+        lines = ["{layout:45s} {runs:5d} runs {failures:3d} failed {retries:4d} retries".format(**row) +
+                 "  p50 {}  p95 {}  {:.2f} h/day".format(format_seconds(row['p50']), format_seconds(row['p95']), row['seconds_per_day'] / 3600)
+                 for row in result]
+    elif args.command == 'percentile':
+        result = percentile(runs, args.q, args.stage)
+        lines = ["p{:g} {} {} (median {}, {} runs)".format(args.q, result['stage'], format_seconds(result['seconds']),
+                                                          format_seconds(result['median']), result['runs'])]
+    elif args.command == 'slow':
+        result = slow_runs(runs, args.factor, args.stage)
+        lines = ["run {id} {when} {host} {layout}: ".format(when=time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['started'])), **entry) +
+                 "{} vs median {} ({:.1f}x)".format(format_seconds(entry['seconds']), format_seconds(entry['median']), entry['ratio'])
+                 for entry in result]
+        lines.append(str(len(result)) + " slow runs")
+    else:
+        result = [{name: run[name] for name in ['id', 'started', 'host', 'layout', 'parameter_hash', 'status', 'total', 'retries', 'polycount', 'error']}
+                  for run in runs[-args.limit:]]
+        lines = ["run {id} {when} {host} {layout} {parameter_hash} {status} ".format(when=time.strftime('%Y-%m-%d %H:%M', time.localtime(run['started'])), **run) +
+                 "{} {} retries".format(format_seconds(run['total']), run['retries']) for run in result]
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print("\n".join(lines))
+    return 1 if args.command == 'slow' and result else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
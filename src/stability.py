@@ -0,0 +1,376 @@
+"""Stable-generation-space pre-check for a parameter set, without Blender.
+
+Rebuilds the plate boundary (RING_0) of the "Generate Finger Plate" / "Generate Thumb Plate"
+stages from the key frames of key_layout, offsets it into the wall rings exactly like the
+"Generate Body Walls" stage and looks for the geometry that makes a generation fail:
+
+    thumb_topology      the thumb keys do not group into columns the thumb plate can build
+    self_intersection   a wall ring crosses itself seen from above
+    inverted_offset     a ring vertex moved inward, or a ring edge flipped against RING_0
+    clipped_miter       a corner sharp enough that the ring offset miter was clamped
+    below_floor         a key plate or switch housing reaches under the bottom plane
+    bridge_fold         a finger/thumb bridge face folds over against its keys
+    wall_breakthrough   the ameoba cut reaches through the inner wall surface
+
+    python src/stability.py                       # default parameters
+    python src/stability.py job.json --strict     # warnings fail too
+
+The exit status is 1 when the report has errors (or warnings with --strict), so sweeps can
+drop a candidate before launching Blender. From Python, risk_report(parameters) returns the
+report and stable(parameters) is a ready-made sweep filter.
+"""
+
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+import key_layout
+
+
+# Plate faces are the mount footprint plus 0.25 mm, sunk key_well_offset into the shell
+plate_margin = 0.25
+
+# MX switch housings reach 5 mm under the plate top; ameoba cut from "Initializing Tool Shapes"
+switch_housing_depth = 5
+ameoba_half_extents = (16.5 / 2, 20 / 2)
+ameoba_depth = (-3 - 0.1, -0.1)
+
+# The bottom plate's upper face is flattened to this height in "Generate Bottom Plate"
+bottom_plate_top = -0.5
+
+# Subdivision pulls the walls in a little, so the ameoba cut needs this much room behind them
+breakthrough_margin = 0.5
+
+# Bridge faces steeper than this against their keys are reported as warnings
+bridge_warning_angle = np.radians(75)
+
+
+
+###################
+## Plate Corners ##
+###################
+
+def wall_profiles(parameters: dict) -> dict:
+    """[width, depth] of rings 1-3 per plate side, from the generator's wall_profiles."""
+    return key_layout.generator_function("CASE WALLS", 'wall_profiles')(
+        *(parameters[name] for name in ['wall_thickness', 'wall_xy_offset', 'wall_z_offset', 'left_wall_x_offset']))
+
+
+def plate_face(parameters: dict, layout: dict, key: int) -> tuple:
+    """Half extents (x, y) and height of a key's plate face in its key frame.
+
+    The finger plate stretches its faces along the key x, the thumb plate along the key y, and
+    the thumb plate is lifted key_well_offset twice.
+    """
+    if layout['positions'][key][0] is None:
+        half = ((key_layout.mount_height + plate_margin) / 2, (key_layout.mount_height * layout['sizes'][key] + plate_margin) / 2)
+        return half, key_layout.mount_thickness + 2 * parameters['key_well_offset']
+    half = ((key_layout.mount_height * layout['sizes'][key] + plate_margin) / 2, (key_layout.mount_width + plate_margin) / 2)
+    return half, key_layout.mount_thickness + parameters['key_well_offset']
+
+
+def plate_corner(parameters: dict, layout: dict, vertex: tuple, thumb: dict = None) -> tuple:
+    """World position, key index and local corner of a plate grid vertex.
+
+    Finger vertices are ('finger', u, w) on the 2*ncols x 2*nrows grid, thumb vertices
+    ('thumb', i, j) on the thumb_topology grid; odd u / i is the +x side of a key, odd w / j the
+    -y side. Pass the layout's thumb_topology as thumb to look up many thumb vertices.
+    """
+    plate, u, w = vertex
+    if plate == 'finger':
+        key = layout['positions'].index((u // 2, w // 2))
+    else:
+        thumb = thumb or key_layout.thumb_topology(parameters, layout)
+        key = layout['positions'].index((None, thumb['keys'][(u // 2, w // 2)]))
+    half, height = plate_face(parameters, layout, key)
+    local = np.array([half[0] if u % 2 else -half[0], -half[1] if w % 2 else half[1], height, 1])
+    return (layout['frames'][key] @ local)[:3], key, local[:3]
+
+
+def boundary_loop(parameters: dict) -> list:
+    """RING_0 vertices in plate order with the wall sides each belongs to.
+
+    Follows the boundary left after the unused faces are removed and the correction and
+    bridge faces are added: finger top, right and bottom, across BRIDGE_RIGHT to the thumb
+    plate, around it and back across BRIDGE_LEFT to the finger left side. The finger and
+    thumb parts come from the generator's finger_topology and thumb_topology.
+    """
+    chains = key_layout.finger_topology(parameters)['chains']
+    thumb = key_layout.thumb_topology(parameters)['chains']
+    top, right, bottom, left = (chains[side] for side in ['finger_TOP', 'finger_RIGHT', 'finger_BOTTOM', 'finger_LEFT'])
+    loop = [(('finger',) + vertex, ['finger_TOP']) for vertex in top]
+    loop += [(('finger',) + vertex, ['finger_RIGHT']) for vertex in right[1:]]
+    loop += [(('finger',) + vertex, ['finger_BOTTOM']) for vertex in bottom[-2::-1]]
+    loop += [(('thumb',) + vertex, ['thumb_RIGHT']) for vertex in thumb['thumb_RIGHT']]
+    loop += [(('thumb',) + vertex, ['thumb_BOTTOM']) for vertex in thumb['thumb_BOTTOM'][-2::-1]]
+    loop += [(('thumb',) + vertex, ['thumb_LEFT']) for vertex in thumb['thumb_LEFT'][1:]]
+    loop += [(('finger',) + vertex, ['finger_LEFT']) for vertex in left[-1:0:-1]]
+
+    # Plate corners sit on two sides and average their profiles
+    corners = {('finger',) + left[0]: 'finger_LEFT', ('finger',) + right[0]: 'finger_RIGHT',
+               ('finger',) + right[-1]: 'finger_BOTTOM', ('thumb',) + thumb['thumb_RIGHT'][-1]: 'thumb_BOTTOM',
+               ('thumb',) + thumb['thumb_LEFT'][0]: 'thumb_LEFT'}
+    return [(vertex, sides + [corners[vertex]] if vertex in corners else sides) for vertex, sides in loop]
+
+
+def bridge_chains(parameters: dict) -> dict:
+    """Finger and thumb vertex chains of the bridge faces, both running toward +x."""
+    chains = key_layout.finger_topology(parameters)['chains']
+    thumb = key_layout.thumb_topology(parameters)['chains']
+    return {side: ([('finger',) + vertex for vertex in chains[side]], [('thumb',) + vertex for vertex in thumb[side]])
+            for side in ['BRIDGE_LEFT', 'BRIDGE_MID', 'BRIDGE_RIGHT']}
+
+
+###################
+## Wall Skeleton ##
+###################
+
+def normalized(vectors):
+    return key_layout.generator_function("CASE WALLS", 'normalized')(vectors)
+
+
+def wall_ring_skeleton(ring_0, plate_normals, widths, depths):
+    """The generator's wall_ring_skeleton: rings 0-3 and the miter cosines it clamps."""
+    return key_layout.generator_function("CASE WALLS", 'wall_ring_skeleton', uses=('normalized',))(ring_0, plate_normals, widths, depths)
+
+
+def signed_area(points) -> float:
+    return float(key_layout.generator_function("GENERATE BOTTOM PLATE", 'signed_area')(points))
+
+
+def wall_skeleton(parameters: dict, layout: dict) -> dict:
+    """Rings 0-3 of the wall with the plate data each ring vertex came from.
+
+    Plate normals are the key axes' z, where Blender averages the key and connector faces.
+    The loop is wound counter-clockwise around the plate normal like the face winding the
+    generator walks.
+    """
+    loop = boundary_loop(parameters)
+    thumb = key_layout.thumb_topology(parameters, layout)
+    corners = [plate_corner(parameters, layout, vertex, thumb) for vertex, _ in loop]
+    ring_0 = np.array([corner[0] for corner in corners])
+    keys = np.array([corner[1] for corner in corners])
+    normals = layout['frames'][keys, :3, 2]
+    if signed_area(ring_0[:, :2]) < 0:
+        loop, ring_0, keys, normals = loop[::-1], ring_0[::-1], keys[::-1], normals[::-1]
+        corners = corners[::-1]
+
+    sides = wall_profiles(parameters)
+    profiles = np.array([np.mean([sides[side] for side in vertex_sides], axis=0) for _, vertex_sides in loop])
+    rings, cosines = wall_ring_skeleton(ring_0, normals, profiles[:, :, 0], profiles[:, :, 1])
+    return {'vertices': [vertex for vertex, _ in loop], 'keys': keys, 'local': np.array([corner[2] for corner in corners]),
+            'rings': rings, 'widths': profiles[:, :, 0], 'miter_cosines': cosines}
+
+
+
+
+############
+## Checks ##
+############
+
+def crossing_edges(points) -> list:
+    """Pairs of non-adjacent edges of a closed 2D polyline that cross, all pairs at once."""
+    start, end = points, np.roll(points, -1, axis=0)
+    first, second = np.triu_indices(len(points), k=2)
+    keep = (second - first) % len(points) != len(points) - 1
+    first, second = first[keep], second[keep]
+
+    def side(a, b, c):
+        return (b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - (b[:, 1] - a[:, 1]) * (c[:, 0] - a[:, 0])
+
+    d1 = side(start[second], end[second], start[first])
+    d2 = side(start[second], end[second], end[first])
+    d3 = side(start[first], end[first], start[second])
+    d4 = side(start[first], end[first], end[second])
+    crossing = (d1 * d2 < 0) & (d3 * d4 < 0)
+    return list(zip(first[crossing].tolist(), second[crossing].tolist()))
+
+
+def ring_risks(skeleton: dict, layout: dict) -> list:
+    risks = []
+    rings = skeleton['rings']
+    positions = [layout['positions'][key] for key in skeleton['keys']]
+
+    for ring_num, ring in enumerate(rings):
+        for first, second in crossing_edges(ring[:, :2]):
+            risks.append({'check': 'self_intersection', 'severity': 'error', 'ring': ring_num,
+                          'keys': [positions[first], positions[second]],
+                          'detail': "RING_{} edges {} and {} cross".format(ring_num, first, second)})
+
+    # An offset ring keeps the winding and edge directions of RING_0; a flip is a swallowtail
+    area_0 = signed_area(rings[0][:, :2])
+    edges_0 = np.roll(rings[0], -1, axis=0) - rings[0]
+    for ring_num in range(1, 4):
+        for index in np.flatnonzero(skeleton['widths'][:, ring_num - 1] <= 0):
+            risks.append({'check': 'inverted_offset', 'severity': 'error', 'ring': ring_num, 'keys': [positions[index]],
+                          'detail': "RING_{} width {:.1f} mm at vertex {} points into the plate".format(
+                              ring_num, skeleton['widths'][index, ring_num - 1], index)})
+        if signed_area(rings[ring_num][:, :2]) * area_0 <= 0:
+            risks.append({'check': 'inverted_offset', 'severity': 'error', 'ring': ring_num, 'keys': [],
+                          'detail': "RING_{} is wound against RING_0".format(ring_num)})
+        edges = np.roll(rings[ring_num], -1, axis=0) - rings[ring_num]
+        for index in np.flatnonzero(np.einsum('ij,ij->i', edges, edges_0) < 0):
+            risks.append({'check': 'inverted_offset', 'severity': 'error', 'ring': ring_num,
+                          'keys': [positions[index], positions[(index + 1) % len(positions)]],
+                          'detail': "RING_{} edge {} runs against RING_0".format(ring_num, index)})
+
+    for index in np.flatnonzero(skeleton['miter_cosines'] < 0.5):
+        risks.append({'check': 'clipped_miter', 'severity': 'warning', 'keys': [positions[index]],
+                      'detail': "corner at vertex {} turns {:.0f} degrees, the miter is clamped".format(
+                          index, np.degrees(2 * np.arccos(np.clip(skeleton['miter_cosines'][index], -1, 1))))})
+    return risks
+
+
+def floor_risks(parameters: dict, layout: dict) -> list:
+    """Keys against the bottom plane.
+
+    The body is cut at z = -bottom_thickness and the bottom plate fills up to bottom_plate_top,
+    so the inner plate surface has to stay above the cut and the switch housing above the plate.
+    """
+    risks = []
+    floor = -parameters['bottom_thickness']
+    corners = np.array([[sx, sy, 0, 1] for sx in [-0.5, 0.5] for sy in [-0.5, 0.5]])
+    for key, position in enumerate(layout['positions']):
+        half, height = plate_face(parameters, layout, key)
+        plate = corners * [2 * half[0], 2 * half[1], 1, 1] + [0, 0, height - parameters['body_thickness'], 0]
+        housing = corners * [key_layout.keyswitch_width, key_layout.keyswitch_height * layout['sizes'][key], 1, 1] + \
+                  [0, 0, key_layout.mount_thickness - switch_housing_depth, 0]
+        lowest_plate = (layout['frames'][key] @ plate.T)[2].min()
+        lowest_housing = (layout['frames'][key] @ housing.T)[2].min()
+        if lowest_plate < floor:
+            risks.append({'check': 'below_floor', 'severity': 'error', 'keys': [position],
+                          'detail': "inner plate reaches z = {:.1f}, under the body cut at {:.1f}".format(lowest_plate, floor)})
+        elif lowest_housing < bottom_plate_top:
+            risks.append({'check': 'below_floor', 'severity': 'warning', 'keys': [position],
+                          'detail': "switch housing reaches z = {:.1f}, into the bottom plate".format(lowest_housing)})
+    return risks
+
+
+def bridge_risks(parameters: dict, layout: dict) -> list:
+    """Zip each bridge between its finger and thumb chains and compare the faces with their keys."""
+    risks = []
+    topology = key_layout.thumb_topology(parameters, layout)
+    for bridge, (finger, thumb) in bridge_chains(parameters).items():
+        finger = [plate_corner(parameters, layout, vertex) for vertex in finger]
+        thumb = [plate_corner(parameters, layout, vertex, topology) for vertex in thumb]
+        keys = sorted({corner[1] for corner in finger + thumb})
+        reference = normalized(layout['frames'][keys, :3, 2].mean(axis=0))
+
+        # Triangles keep the winding of the loop finger forward, thumb backward, which faces down
+        triangles, a, b = [], 0, 0
+        while a < len(finger) - 1 or b < len(thumb) - 1:
+            advance_finger = b == len(thumb) - 1 or (a < len(finger) - 1 and
+                np.linalg.norm(finger[a + 1][0] - thumb[b][0]) <= np.linalg.norm(finger[a][0] - thumb[b + 1][0]))
+            if advance_finger:
+                triangles.append((finger[a][0], finger[a + 1][0], thumb[b][0]))
+                a += 1
+            else:
+                triangles.append((finger[a][0], thumb[b + 1][0], thumb[b][0]))
+                b += 1
+        triangles = np.array(triangles)
+        normals = -np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+        cosines = normalized(normals) @ reference
+        worst = float(cosines.min())
+        position = [layout['positions'][key] for key in keys]
+        if worst < 0:
+            risks.append({'check': 'bridge_fold', 'severity': 'error', 'keys': position,
+                          'detail': "{} folds over, {:.0f} degrees against its keys".format(bridge, np.degrees(np.arccos(worst)))})
+        elif worst < np.cos(bridge_warning_angle):
+            risks.append({'check': 'bridge_fold', 'severity': 'warning', 'keys': position,
+                          'detail': "{} is {:.0f} degrees steep against its keys".format(bridge, np.degrees(np.arccos(worst)))})
+    return risks
+
+
+def breakthrough_risks(parameters: dict, layout: dict, skeleton: dict, samples: int = 6) -> list:
+    """Ameoba cut boxes against the inner surface of the walls.
+
+    Each wall band between two rings is sampled, moved body_thickness inward along its
+    normal like the Solidify shell, and tested against the cut box of every boundary key.
+    """
+    if not parameters['ameoba_cut']:
+        return []
+    rings = skeleton['rings']
+    s, t = np.meshgrid(np.linspace(0, 1, samples), np.linspace(0, 1, samples // 2 + 1))
+    s, t = s.ravel()[None, :, None], t.ravel()[None, :, None]
+    points = []
+    for upper, lower in zip(rings[:-1], rings[1:]):
+        upper_next, lower_next = np.roll(upper, -1, axis=0), np.roll(lower, -1, axis=0)
+        normal = normalized(np.cross(upper_next - upper, lower - upper))
+        outward = (lower + lower_next - upper - upper_next)[:, :2]
+        normal *= -np.sign(np.einsum('ij,ij->i', normal[:, :2], outward) + 1e-12)[:, None]
+        surface = (1 - t) * ((1 - s) * upper[:, None] + s * upper_next[:, None]) + t * ((1 - s) * lower[:, None] + s * lower_next[:, None])
+        points.append((surface + normal[:, None] * parameters['body_thickness']).reshape(-1, 3))
+    points = np.c_[np.concatenate(points), np.ones(sum(len(chunk) for chunk in points))]
+
+    risks = []
+    half = np.array(ameoba_half_extents)
+    for key in sorted(set(skeleton['keys'].tolist())):
+        local = (np.linalg.inv(layout['frames'][key]) @ points.T).T
+        key_half = half[::-1] if layout['rotated'][key] else half
+        depth = np.minimum(key_half[0] - np.abs(local[:, 0]), key_half[1] - np.abs(local[:, 1]))
+        depth = np.minimum(depth, np.minimum(local[:, 2] - ameoba_depth[0], ameoba_depth[1] - local[:, 2]))
+        if depth.max() > -breakthrough_margin:
+            risks.append({'check': 'wall_breakthrough', 'severity': 'warning', 'keys': [layout['positions'][key]],
+                          'detail': "inner wall comes within {:.2f} mm of the ameoba cut, raise wall_xy_offset".format(-depth.max())})
+    return risks
+
+
+
+############
+## Report ##
+############
+
+def risk_report(parameters: dict) -> dict:
+    """Every risk found for a resolved parameter set, errors first."""
+    layout = key_layout.key_frames(parameters)
+    try:
+        key_layout.thumb_topology(parameters, layout)
+    except ValueError as error:
+        # Without a thumb plate there is no wall loop to check
+        return {'risks': [{'check': 'thumb_topology', 'severity': 'error', 'keys': [], 'detail': str(error)}],
+                'errors': 1, 'warnings': 0}
+    skeleton = wall_skeleton(parameters, layout)
+    risks = ring_risks(skeleton, layout) + floor_risks(parameters, layout) + \
+            bridge_risks(parameters, layout) + breakthrough_risks(parameters, layout, skeleton)
+    risks.sort(key=lambda risk: risk['severity'] != 'error')
+    return {'risks': risks,
+            'errors': sum(risk['severity'] == 'error' for risk in risks),
+            'warnings': sum(risk['severity'] == 'warning' for risk in risks)}
+
+
+def stable(parameters: dict, strict: bool = False) -> bool:
+    """Sweep filter: no errors, and with strict no warnings either."""
+    report = risk_report(parameters)
+    return report['errors'] == 0 and not (strict and report['warnings'])
+
+
+def main(argv: list) -> int:
+    parser = argparse.ArgumentParser(description="Stable generation space pre-check")
+    parser.add_argument('overrides', nargs='?', help="JSON file of parameter overrides (or a worker job with 'parameters')")
+    parser.add_argument('--strict', action='store_true', help="fail on warnings as well as errors")
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    overrides = {}
+    if args.overrides:
+        with open(args.overrides) as handle:
+            overrides = json.load(handle)
+        overrides = overrides.get('parameters', overrides)
+
+    started = time.time()
+    report = risk_report(key_layout.resolve_parameters(overrides))
+    elapsed = time.time() - started
+    if args.json:
+        print(json.dumps(report, indent=2, default=str))
+    else:
+        for risk in report['risks']:
+            print(risk['severity'], risk['check'], risk['detail'], risk['keys'])
+        print(report['errors'], "errors,", report['warnings'], "warnings in {:.1f} ms".format(elapsed * 1000))
+    return 1 if report['errors'] or (args.strict and report['warnings']) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
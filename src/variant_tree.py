@@ -0,0 +1,289 @@
+"""Run a batch of parameter sets as a tree, sharing the stages their variants have in common.
+
+Each parameter is mapped to the first generator stage that reads it, from the names in the
+generator's code after the parameter sections. Variants of one design that only differ in
+parameters read late, e.g. magnet_layout or bottom_thickness, build the plates, walls and
+punch-outs once. The run forks (os.fork, so Linux or macOS) at the start of the first stage
+that reads a differing parameter, and every child applies its variant's values and runs only
+the remaining stages, branching again further down when its group still differs. The number
+of stage runs grows with the distinct subtrees of the batch instead of with its size:
+
+    python src/variant_tree.py batch.json --plan
+    python src/variant_tree.py batch.json --blender /path/to/blender --parallel 4
+
+A batch is a JSON list of worker jobs (or {"jobs": [...]}). Every job's result, as returned
+by worker.run_job with 'branch' (the stage its variant forked at), is written to
+<output_dir>/<id>.result.json. A forked job's total only covers the stages after its fork; the
+stages it shares with its siblings are listed with 'shared' in its telemetry and left out of
+its run history row. Outside Blender the script relaunches itself in a background
+Blender, where it runs the whole batch. The exit status is 1 when any job failed.
+"""
+
+import argparse
+import io
+import json
+import os
+import runpy
+import subprocess
+import sys
+import time
+import tokenize
+import traceback
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import key_layout
+import worker
+
+
+class BranchDone(Exception):
+    """Raised in a parent process once the children of its branch point have finished."""
+
+
+
+###############################
+## Stage Dependency Analysis ##
+###############################
+
+def generator_stages(path: str = key_layout.GENERATOR) -> tuple:
+    """Stage names in order and the index of the first stage that reads each name.
+
+    Only stage calls at the top level are branch points, since a conditional one may not run;
+    a name first read inside a conditional stage maps to the top-level stage before it. Names
+    read before the first stage, or only in strings, map to -1 and 'DONE' respectively.
+    """
+    with open(path) as handle:
+        source = handle.read()
+    start = source.index("## Parameter Overrides ##")
+    offset = source[:start].count('\n')
+    tokens = list(tokenize.generate_tokens(io.StringIO(source[start:]).readline))
+
+    stages, first_read = [], {}
+    for index, token in enumerate(tokens):
+        if token.type != tokenize.NAME:
+            continue
+        previous = tokens[index - 1].string if index else ''
+        if token.string == 'stage' and previous not in ['.', 'def'] and tokens[index + 1].string == '(' and tokens[index + 2].type == tokenize.STRING:
+            if token.start[1] == 0:
+                stages.append((token.start[0] + offset, tokens[index + 2].string.strip('"\'')))
+            continue
+        if previous != '.':
+            first_read.setdefault(token.string, len(stages) - 1)
+    names = [name for _, name in stages]
+    if len(set(names)) != len(names):
+        raise ValueError("stage names must be unique to branch on them")
+    return names, first_read
+
+
+
+##########
+## Plan ##
+##########
+
+def plan(jobs: list, resolved: list, stages: list, first_read: dict) -> dict:
+    """Tree of the jobs (indices into jobs): a leaf {'job': index} or {'stage': index, 'branches': [...]}.
+
+    A node's jobs share every parameter read before its stage; its branches group them by the
+    values of the differing parameters first read at that stage. Jobs that differ in a parameter
+    read before the first stage branch at -1, as separate runs from scratch.
+    """
+    def values(index, names):
+        return json.dumps([resolved[index].get(name) for name in names], sort_keys=True, default=repr)
+
+    def node(group):
+        if len(group) == 1:
+            return {'job': group[0]}
+        names = sorted({name for index in group for name in resolved[index]})
+        differing = [name for name in names if len({values(index, [name]) for index in group}) > 1]
+        branch = min([first_read.get(name, stages.index('DONE')) for name in differing], default=stages.index('DONE'))
+        keys = [name for name in differing if first_read.get(name, stages.index('DONE')) == branch]
+        groups = {}
+        for index in group:
+            groups.setdefault(values(index, keys), []).append(index)
+        if len(groups) == 1:
+            # Identical parameters (different ids or outputs) only split for their exports
+            return {'stage': stages.index('DONE'), 'branches': [{'job': index} for index in group]}
+        return {'stage': branch, 'branches': [node(subgroup) for subgroup in groups.values()]}
+
+    return node(list(range(len(jobs))))
+
+
+def node_jobs(node: dict) -> list:
+    return [node['job']] if 'job' in node else [index for branch in node['branches'] for index in node_jobs(branch)]
+
+
+def stage_runs(node: dict, stages: list, start: int = 0) -> int:
+    """Stages run by the tree, counting the shared ones once."""
+    if 'job' in node:
+        return len(stages) - start
+    branch = max(node['stage'], 0)
+    return branch - start + sum(stage_runs(child, stages, branch) for child in node['branches'])
+
+
+def describe(node: dict, jobs: list, stages: list, depth: int = 0) -> list:
+    indent = "    " * depth
+    if 'job' in node:
+        return [indent + "job " + str(jobs[node['job']]['id'])]
+    where = "separate runs" if node['stage'] < 0 else "fork at " + stages[node['stage']]
+    return [indent + where + " ({} jobs)".format(len(node_jobs(node)))] + [line for branch in node['branches'] for line in describe(branch, jobs, stages, depth + 1)]
+
+
+
+###############
+## Execution ##
+###############
+
+class TreeRunner:
+    """Runs one plan in this Blender, forking at its branch points through the generator's stage_hook."""
+
+    def __init__(self, jobs: list, resolved: list, stages: list, parallel: int):
+        self.jobs, self.resolved, self.stages, self.parallel = jobs, resolved, stages, parallel
+        self.differing = sorted({name for parameters in resolved for name in parameters
+                                 if len({json.dumps(other.get(name), sort_keys=True, default=repr) for other in resolved}) > 1})
+        self.node, self.branch, self.child = None, None, False
+        self.started = None
+
+    def variant_values(self, node: dict) -> dict:
+        """The differing parameter values of the first job under the node."""
+        parameters = self.resolved[node_jobs(node)[0]]
+        return {name: parameters[name] for name in self.differing if name in parameters}
+
+    def stage_hook(self, name: str, namespace: dict):
+        if 'stage' not in self.node or self.node['stage'] < 0 or self.stages[self.node['stage']] != name:
+            return
+        reached = time.time()
+        running = []
+        for branch in self.node['branches']:
+            while len(running) >= self.parallel:
+                running.remove(os.wait()[0])
+            sys.stdout.flush()
+            pid = os.fork()
+            if pid == 0:
+                self.node, self.branch, self.child = branch, name, True
+                self.rebase(namespace, reached)
+                values = self.variant_values(branch)
+                namespace.update(values)
+                namespace['run_parameters'].update(values)
+                namespace['progress'].signature = None          # ETA history of the variant's layout
+                if 'job' in branch:
+                    namespace['progress_file'] = self.jobs[branch['job']].get('progress_file')
+                return
+            running.append(pid)
+        while running:
+            running.remove(os.wait()[0])
+        raise BranchDone()
+
+    def rebase(self, namespace: dict, reached: float):
+        """Time a forked child from its fork. The stages it inherited are marked shared and shifted to
+        end where the parent reached the branch point, so neither they nor the wait for a free slot
+        count toward the child's total."""
+        forked = time.time()
+        for entry in namespace['stage_log']:
+            entry['start'] -= reached - namespace['start_time']
+            entry['shared'] = True
+        namespace['start_time'] = self.started = forked
+
+    def result_path(self, index: int) -> str:
+        job = self.jobs[index]
+        return os.path.join(job.get('output_dir', os.getcwd()), str(job['id']) + '.result.json')
+
+    def write_result(self, index: int, result: dict):
+        os.makedirs(os.path.dirname(os.path.abspath(self.result_path(index))), exist_ok=True)
+        result['branch'] = self.branch
+        worker.write_json(self.result_path(index), result)
+
+    def run_node(self, node: dict):
+        """Generate the node's jobs from scratch in this process."""
+        self.node, self.branch = node, None
+        worker.reset_blend_data()
+        parameters = dict(self.jobs[node_jobs(node)[0]].get('parameters', {}), **self.variant_values(node))
+        parameters['stage_hook'] = self.stage_hook
+        self.started = time.time()
+        try:
+            namespace = runpy.run_path(key_layout.GENERATOR, init_globals={'parameter_overrides': parameters}, run_name='__main__')
+        except BranchDone:
+            return
+        except Exception:
+            error = traceback.format_exc()
+            for index in node_jobs(self.node):
+                self.write_result(index, {'id': self.jobs[index]['id'], 'status': 'error', 'outputs': {}, 'error': error,
+                                          'telemetry': {'total': round(time.time() - self.started, 4)}})
+        else:
+            index = self.node['job']
+            result = {'id': self.jobs[index]['id'], 'status': 'ok', 'outputs': {}, 'telemetry': {}}
+            self.write_result(index, worker.finish_job(self.jobs[index], result, namespace, time.time() - self.started))
+        finally:
+            if self.child:
+                sys.stdout.flush()
+                os._exit(0)
+
+    def run(self, tree: dict) -> list:
+        for node in tree['branches'] if tree.get('stage', 0) < 0 else [tree]:
+            self.run_node(node)
+        results = []
+        for index in range(len(self.jobs)):
+            try:
+                with open(self.result_path(index)) as handle:
+                    results.append(json.load(handle))
+            except (OSError, ValueError):
+                results.append({'id': self.jobs[index]['id'], 'status': 'error', 'error': "the variant's process left no result"})
+        return results
+
+
+
+##########
+## Main ##
+##########
+
+def resolve_job(job: dict) -> dict:
+    """Every parameter value of a job, defaults included (None too, so a branch can restore it)."""
+    parameters = key_layout.resolve_parameters(job.get('parameters', {}))
+    return dict({name: value for name, value in parameters.items() if not callable(value)}, **job.get('parameters', {}))
+
+
+def load_batch(path: str) -> list:
+    with open(path) as handle:
+        batch = json.load(handle)
+    jobs = batch['jobs'] if isinstance(batch, dict) else batch
+    for number, job in enumerate(jobs):
+        job.setdefault('id', os.path.splitext(os.path.basename(path))[0] + '_' + str(number))
+    return jobs
+
+
+def main(argv: list, in_blender: bool) -> int:
+    parser = argparse.ArgumentParser(description="Prefix-sharing variant tree execution")
+    parser.add_argument('batch', help="JSON list of worker jobs")
+    parser.add_argument('--plan', action='store_true', help="print the variant tree and exit")
+    parser.add_argument('--parallel', type=int, default=1, help="variants of one branch point run at once")
+    args = parser.parse_args(argv)
+
+    jobs = load_batch(args.batch)
+    resolved = [resolve_job(job) for job in jobs]
+    stages, first_read = generator_stages()
+    tree = plan(jobs, resolved, stages, first_read)
+    print("\n".join(describe(tree, jobs, stages)))
+    print("{} stage runs for {} jobs instead of {}".format(stage_runs(tree, stages), len(jobs), len(jobs) * len(stages)))
+    if args.plan or not in_blender:
+        return 0
+    if not hasattr(os, 'fork'):
+        print("no os.fork here, running every job from scratch")
+        results = [worker.run_job(job) for job in jobs]
+    else:
+        started = time.time()
+        results = TreeRunner(jobs, resolved, stages, max(args.parallel, 1)).run(tree)
+        print("batch of {} jobs in {:.1f} s".format(len(jobs), time.time() - started))
+    for result in results:
+        print("   ", result['id'], result['status'], result.get('telemetry', {}).get('total'), "s, forked at", result.get('branch'))
+    return 1 if any(result['status'] != 'ok' for result in results) else 0
+
+
+if __name__ == '__main__':
+    if worker.bpy is not None:
+        sys.exit(main(sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else [], True))
+    else:
+        # Print the plan here, then relaunch in a background Blender unless only the plan is wanted
+        launcher = argparse.ArgumentParser(add_help=False)
+        launcher.add_argument('--blender', default='blender')
+        known, rest = launcher.parse_known_args(sys.argv[1:])
+        if '--plan' in rest or '-h' in rest or '--help' in rest:
+            sys.exit(main(rest, False))
+        sys.exit(subprocess.call([known.blender, '--background', '--factory-startup', '--python', os.path.abspath(__file__), '--'] + rest))
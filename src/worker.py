@@ -0,0 +1,353 @@
+"""Warm Blender worker for running many generations without paying Blender startup per design.
+
+Inside Blender the file runs as a worker that keeps Blender (and its enabled addons) alive
+and takes generation jobs from a spool directory or a local socket:
+
+    blender --background --python src/worker.py -- --spool /tmp/dm-spool
+    blender --background --python src/worker.py -- --port 5870
+
+Outside Blender the same file launches a pool of workers and submits jobs:
+
+    python src/worker.py pool --blender /path/to/blender --workers 4 --spool /tmp/dm-spool
+    python src/worker.py submit --spool /tmp/dm-spool --wait job.json
+
+A job is a JSON object:
+
+    {"id": "5x6-lvl2",                      # optional, defaults to the job file name
+     "parameters": {"body_subsurf_level": 2},
+     "outputs": ["body", "bottom"],         # objects exported as binary STL
+     "output_dir": "/tmp/dm-out",
+     "progress_file": "/tmp/dm-out/5x6-lvl2.progress.jsonl"}   # optional
+
+Progress events (stage and punch-out key updates with an ETA from earlier runs of the same
+layout, one JSON object per line) go to the job's progress_file. Spool jobs default to
+working/<id>.progress.jsonl, moved to done/ with the result, so a sweep runner can tail it
+and compare the time since the last event with its 'expected' step duration. A spool worker
+claims a job by moving it to working/<name>.<pid>; on start it moves the claims of workers
+that are no longer running back to incoming/.
+
+The result is the job id, "status" ("ok" or "error"), the exported "outputs" paths and
+"telemetry" (per-stage durations and peak memory, total time, polycounts, the solver
+attempts of every boolean, the setup and addon enabling steps the job paid for and, for
+jobs with "profile_operators": true in their parameters, the bpy.ops calls and time per
+operator and stage). Jobs that fail are appended to the generator's run history (see
+run_history.py); finished ones are recorded by the generator itself. Before every job the
+worker loads Blender's factory startup file with use_empty, so each job starts from a clean
+bpy.data (no objects, meshes, images, node groups, libraries or texts of earlier jobs) while
+the preferences and the addons it enabled stay loaded.
+"""
+
+import argparse
+import json
+import os
+import runpy
+import socket
+import subprocess
+import sys
+import time
+import traceback
+
+try:
+    import bpy
+except ImportError:
+    bpy = None
+
+
+GENERATOR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'blended-dm.py')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+
+####################
+## Blender Worker ##
+####################
+
+def reset_blend_data():
+    """Start from an empty factory startup file, keeping the preferences and the enabled addons."""
+    # A failed profiled run leaves the generator's bpy.ops wrapper installed
+    operator = type(bpy.ops.object.select_all)
+    if hasattr(operator, 'original_call'):
+        operator.__call__ = operator.original_call
+        del operator.original_call
+
+    if bpy.context.object is not None and bpy.context.object.mode != 'OBJECT':
+        bpy.ops.object.mode_set(mode='OBJECT')
+    bpy.ops.wm.read_homefile(use_empty=True, use_factory_startup=True)
+
+
+def export_stl(name: str, filepath: str):
+    bpy.ops.object.select_all(action='DESELECT')
+    bpy.data.objects[name].select_set(True)
+    bpy.context.view_layer.objects.active = bpy.data.objects[name]
+    bpy.ops.export_mesh.stl(filepath=filepath, use_selection=True)
+
+
+def stage_durations(stage_log: list, total: float) -> list:
+    durations = []
+    for index, entry in enumerate(stage_log):
+        end = stage_log[index + 1]['start'] if index + 1 < len(stage_log) else total
+        durations.append({'stage': entry['stage'], 'seconds': round(end - entry['start'], 4),
+                          'peak_memory_mb': entry.get('peak_memory')})
+        if entry.get('shared'):
+            durations[-1]['shared'] = True
+    return durations
+
+
+def record_failure(parameters: dict, started: float, error: str):
+    """Append a failed job to the run history; finished runs are recorded by the generator."""
+    import run_history
+    try:
+        run_parameters = run_history.job_parameters(parameters)
+        run_history.record_run(parameters.get('run_history_path') or run_history.default_run_history_path,
+            {'started': started, 'layout': run_history.layout_signature(run_parameters), 'parameters': run_parameters,
+             'status': 'error', 'total': time.time() - started, 'error': error})
+    except Exception as exception:
+        print("could not record the failed job in the run history:", exception)
+
+
+def run_job(job: dict) -> dict:
+    """Generate one design in the running Blender and return its result record."""
+    result = {'id': job.get('id'), 'status': 'ok', 'outputs': {}, 'telemetry': {}}
+    reset_started = time.time()
+    reset_blend_data()
+    result['telemetry']['reset'] = round(time.time() - reset_started, 4)
+
+    parameters = dict(job.get('parameters', {}))
+    if job.get('progress_file'):
+        parameters['progress_file'] = job['progress_file']
+
+    started = time.time()
+    try:
+        namespace = runpy.run_path(GENERATOR, init_globals={'parameter_overrides': parameters}, run_name='__main__')
+    except Exception:
+        result['status'] = 'error'
+        result['error'] = traceback.format_exc()
+        result['telemetry']['total'] = round(time.time() - started, 4)
+        record_failure(parameters, started, result['error'].strip().splitlines()[-1])
+        return result
+    return finish_job(job, result, namespace, time.time() - started)
+
+
+def finish_job(job: dict, result: dict, namespace: dict, total: float) -> dict:
+    """Export the job's outputs from the finished scene and fill in the result's telemetry."""
+    output_dir = job.get('output_dir', os.getcwd())
+    os.makedirs(output_dir, exist_ok=True)
+    polycount = {}
+    for name in job.get('outputs', ['body', 'bottom']):
+        if name not in bpy.data.objects:
+            continue
+        filepath = os.path.join(output_dir, str(result['id']) + '_' + name + '.stl')
+        export_stl(name, filepath)
+        result['outputs'][name] = filepath
+        polycount[name] = {'vertices': len(bpy.data.objects[name].data.vertices),
+                           'faces': len(bpy.data.objects[name].data.polygons)}
+
+    result['telemetry']['total'] = round(total, 4)
+    result['telemetry']['stages'] = stage_durations(namespace.get('stage_log', []), total)
+    result['telemetry']['polycount'] = polycount
+    result['telemetry']['booleans'] = namespace.get('boolean_log', [])
+    result['telemetry']['setup'] = namespace.get('setup_log', [])
+    if namespace.get('operator_profile'):
+        result['telemetry']['operators'] = namespace['operator_profile']
+    return result
+
+
+def write_json(path: str, data: dict):
+    with open(path + '.tmp', 'w') as handle:
+        json.dump(data, handle, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def spool_directories(spool: str) -> dict:
+    directories = {name: os.path.join(spool, name) for name in ['incoming', 'working', 'done']}
+    for directory in directories.values():
+        os.makedirs(directory, exist_ok=True)
+    return directories
+
+
+def claim_job(directories: dict):
+    """Atomically move the oldest incoming job into working/ so only one worker runs it."""
+    for name in sorted(os.listdir(directories['incoming'])):
+        if not name.endswith('.json'):
+            continue
+        claimed = os.path.join(directories['working'], name + '.' + str(os.getpid()))
+        try:
+            os.rename(os.path.join(directories['incoming'], name), claimed)
+        except OSError:
+            continue
+        return name, claimed
+    return None, None
+
+
+def process_exists(pid: int) -> bool:
+    if os.name == 'nt':
+        return True             # os.kill would terminate it; claims are left to the operator there
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def requeue_stale_claims(directories: dict) -> list:
+    """Move jobs claimed by workers that no longer run (working/<name>.<pid>) back to incoming/."""
+    requeued = []
+    for claim in sorted(os.listdir(directories['working'])):
+        name, _, pid = claim.rpartition('.')
+        if not name.endswith('.json') or not pid.isdigit() or process_exists(int(pid)):
+            continue
+        try:
+            os.rename(os.path.join(directories['working'], claim), os.path.join(directories['incoming'], name))
+        except OSError:
+            continue            # requeued by another starting worker
+        requeued.append(name)
+    return requeued
+
+
+def serve_spool(spool: str, poll: float = 0.5, max_jobs: int = 0):
+    directories = spool_directories(spool)
+    for name in requeue_stale_claims(directories):
+        print("worker", os.getpid(), "requeued", name, "from a worker that exited")
+    jobs_done = 0
+    print("worker", os.getpid(), "watching", directories['incoming'])
+    while not os.path.exists(os.path.join(spool, 'stop')):
+        name, claimed = claim_job(directories)
+        if name is None:
+            time.sleep(poll)
+            continue
+        with open(claimed) as handle:
+            job = json.load(handle)
+        job.setdefault('id', name[:-len('.json')])
+        progress_file = os.path.join(directories['working'], name[:-len('.json')] + '.progress.jsonl')
+        job.setdefault('progress_file', progress_file)
+        result = run_job(job)
+        result['worker'] = os.getpid()
+        if os.path.exists(progress_file):
+            os.replace(progress_file, os.path.join(directories['done'], os.path.basename(progress_file)))
+        write_json(os.path.join(directories['done'], name), result)
+        os.remove(claimed)
+        print("worker", os.getpid(), "finished", job['id'], result['status'])
+        jobs_done += 1
+        if max_jobs and jobs_done >= max_jobs:
+            break
+
+
+def serve_socket(port: int):
+    """Serve newline-delimited JSON jobs on 127.0.0.1, one result line per job."""
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(('127.0.0.1', port))
+    server.listen(1)
+    print("worker", os.getpid(), "listening on 127.0.0.1:" + str(port))
+    while True:
+        connection, _ = server.accept()
+        with connection, connection.makefile('rw') as stream:
+            for line in stream:
+                if not line.strip():
+                    continue
+                try:
+                    job = json.loads(line)
+                    if not isinstance(job, dict):
+                        raise ValueError("a job must be a JSON object")
+                except ValueError as error:
+                    result = {'status': 'error', 'error': "invalid job line: " + str(error)}
+                else:
+                    if job.get('command') == 'stop':
+                        return
+                    result = run_job(job)
+                result['worker'] = os.getpid()
+                stream.write(json.dumps(result) + '\n')
+                stream.flush()
+
+
+def worker_main(argv: list):
+    parser = argparse.ArgumentParser(description="Blender generation worker")
+    parser.add_argument('--spool', help="spool directory with incoming/, working/ and done/")
+    parser.add_argument('--port', type=int, help="serve jobs on 127.0.0.1:PORT instead of a spool")
+    parser.add_argument('--max-jobs', type=int, default=0, help="exit after this many spool jobs")
+    parser.add_argument('--job', help="run a single job file and write the result next to it")
+    args = parser.parse_args(argv)
+
+    if args.job:
+        with open(args.job) as handle:
+            job = json.load(handle)
+        job.setdefault('id', os.path.splitext(os.path.basename(args.job))[0])
+        write_json(os.path.splitext(args.job)[0] + '.result.json', run_job(job))
+    elif args.port:
+        serve_socket(args.port)
+    elif args.spool:
+        serve_spool(args.spool, max_jobs=args.max_jobs)
+    else:
+        parser.error("one of --spool, --port or --job is required")
+
+
+
+###############################
+## Pool Launcher and Submits ##
+###############################
+
+def blender_command(blender: str, worker_args: list) -> list:
+    return [blender, '--background', '--factory-startup', '--python', os.path.abspath(__file__), '--'] + worker_args
+
+
+def run_pool(blender: str, workers: int, spool: str):
+    """Start workers on a shared spool and wait; touch SPOOL/stop to shut them down."""
+    spool_directories(spool)
+    if os.path.exists(os.path.join(spool, 'stop')):
+        os.remove(os.path.join(spool, 'stop'))
+    processes = [subprocess.Popen(blender_command(blender, ['--spool', spool])) for _ in range(workers)]
+    try:
+        for process in processes:
+            process.wait()
+    except KeyboardInterrupt:
+        open(os.path.join(spool, 'stop'), 'w').close()
+        for process in processes:
+            process.wait()
+
+
+def submit(spool: str, job: dict, wait: bool = False, poll: float = 0.5):
+    directories = spool_directories(spool)
+    job.setdefault('id', 'job_' + str(int(time.time() * 1000)))
+    name = str(job['id']) + '.json'
+    write_json(os.path.join(directories['incoming'], name), job)
+    if not wait:
+        return None
+    done = os.path.join(directories['done'], name)
+    while not os.path.exists(done):
+        time.sleep(poll)
+    with open(done) as handle:
+        return json.load(handle)
+
+
+def launcher_main(argv: list):
+    parser = argparse.ArgumentParser(description="Blended-DM worker pool")
+    commands = parser.add_subparsers(dest='command', required=True)
+    pool = commands.add_parser('pool', help="start Blender workers on a spool directory")
+    pool.add_argument('--blender', default='blender')
+    pool.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    pool.add_argument('--spool', required=True)
+    submit_command = commands.add_parser('submit', help="queue job files on a spool directory")
+    submit_command.add_argument('--spool', required=True)
+    submit_command.add_argument('--wait', action='store_true', help="wait for and print the results")
+    submit_command.add_argument('jobs', nargs='+')
+    args = parser.parse_args(argv)
+
+    if args.command == 'pool':
+        run_pool(args.blender, args.workers, args.spool)
+    else:
+        for path in args.jobs:
+            with open(path) as handle:
+                job = json.load(handle)
+            job.setdefault('id', os.path.splitext(os.path.basename(path))[0])
+            result = submit(args.spool, job, wait=args.wait)
+            if result is not None:
+                print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    if bpy is not None:
+        worker_main(sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else [])
+    else:
+        launcher_main(sys.argv[1:])
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The checked modules are the Blender-free tools next to the generator
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src'))
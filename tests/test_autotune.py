@@ -0,0 +1,102 @@
+"""autotune's cost model and candidate choice, fitted on synthetic runs in a temporary run history."""
+
+import json
+import time
+from itertools import product
+from math import exp, log
+
+import numpy as np
+import pytest
+
+import autotune
+import key_layout
+import run_history
+
+
+def key_count(overrides: dict) -> int:
+    return len(key_layout.key_frames(key_layout.resolve_parameters(overrides))['positions'])
+
+
+def true_cost(overrides: dict) -> dict:
+    """Stage seconds of the synthetic generator: walls triple per subdivision level and scale with
+    the keys, relaxing costs half again; the magnet stage only runs with magnet_bottom."""
+    walls = 0.02 * exp(log(3) * overrides['body_subsurf_level'] + log(key_count(overrides))) * (1.5 if overrides['relaxed_mesh'] else 1)
+    stages = {"Generate Body Walls": walls, "Initializing": 2.0}
+    if overrides.get('magnet_bottom', True):
+        stages["Place Magnets"] = 4.0
+    return stages
+
+
+@pytest.fixture(scope='module')
+def runs(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('history') / 'run_history.sqlite')
+    noise = np.random.default_rng(0)
+    for level, relaxed, (nrows, ncols), magnets in product([1, 2], [False, True], [(4, 5), (5, 6), (6, 7)], [True, False]):
+        overrides = {'body_subsurf_level': level, 'relaxed_mesh': relaxed, 'nrows': nrows, 'ncols': ncols, 'magnet_bottom': magnets}
+        stages = true_cost(overrides)
+        run_history.record_run(path, {'started': time.time(), 'layout': "{}x{}".format(nrows, ncols), 'status': 'ok',
+                                      'parameters': run_history.job_parameters(overrides), 'total': sum(stages.values()),
+                                      'stages': [(stage, seconds * exp(noise.normal(0, 0.01)), None) for stage, seconds in stages.items()]})
+    run_history.record_run(path, {'started': time.time(), 'layout': "5x6", 'status': 'error', 'total': 1,
+                                  'parameters': run_history.job_parameters({}), 'stages': [("Initializing", 1000.0, None)]})
+    return path
+
+
+def fitted(path: str) -> dict:
+    return autotune.fit_cost_model([run for run in run_history.load_runs(path) if run['status'] == 'ok'])
+
+
+def test_ridge_fit_recovers_the_cost_law(runs):
+    model = fitted(runs)
+    assert model['runs'] == 24 and model['subsurf_levels'] == [1, 2]
+    walls = model['stages']["Generate Body Walls"]['coefficients']
+    assert walls[1] == pytest.approx(log(3), rel=0.05)          # per subdivision level
+    assert walls[2] == pytest.approx(1, rel=0.25)               # log key count, shrunk by the ridge
+    assert walls[3] == pytest.approx(log(1.5), rel=0.05)        # relaxed_mesh
+    # Extrapolated one level up, for a layout in between the recorded ones
+    overrides = {'body_subsurf_level': 3, 'relaxed_mesh': True, 'nrows': 5, 'ncols': 7, 'magnet_bottom': True}
+    prediction = autotune.predict(model, key_layout.resolve_parameters(overrides))
+    for stage, seconds in true_cost(overrides).items():
+        assert prediction['stages'][stage] == pytest.approx(seconds, rel=0.1)
+
+
+def test_gated_stage_is_left_out_without_its_feature(runs):
+    model = fitted(runs)
+    assert model['stages']["Place Magnets"]['gates'] == {'magnet_bottom': True}
+    assert model['stages']["Initializing"]['gates'] == {}
+    without = autotune.predict(model, key_layout.resolve_parameters({'magnet_bottom': False}))
+    assert "Place Magnets" not in without['stages']
+    assert without['stages']["Initializing"] == pytest.approx(2, rel=0.05)
+
+
+def test_candidate_levels_extrapolate_one_level():
+    assert autotune.candidate_levels({'subsurf_levels': [1, 2]}) == [0, 1, 2, 3]
+    assert autotune.candidate_levels({'subsurf_levels': [2]}) == [2]
+
+
+def test_tune_picks_the_best_setting_that_fits(runs):
+    model = fitted(runs)
+    costs = {(level, relaxed): sum(true_cost({'body_subsurf_level': level, 'relaxed_mesh': relaxed}).values())
+             for level, relaxed in product([0, 1, 2, 3], [False, True])}
+    # Room for subsurf 2 relaxed (and the 10% margin) but not for subsurf 3
+    budget = costs[(2, True)] * 1.2
+    assert budget < costs[(3, False)] * 1.1
+    candidates, chosen = autotune.tune(model, {}, budget, 0.1)
+    assert chosen['settings'] == {'body_subsurf_level': 2, 'relaxed_mesh': True}
+    assert [tuple(candidate['settings'].values()) for candidate in candidates] == sorted(costs, reverse=True)
+    assert [candidate['fits'] for candidate in candidates] == [False, False] + [True] * 6
+    assert autotune.tune(model, {}, costs[(0, False)] * 0.5, 0.1)[1] is None
+
+
+def test_parse_budget():
+    assert [autotune.parse_budget(text) for text in ['180', '90s', '3m', '1.5h', '2M']] == [180, 90, 180, 5400, 120]
+
+
+def test_main_reports_the_choice(runs, tmp_path, capsys):
+    overrides = tmp_path / 'job.json'
+    overrides.write_text(json.dumps({'parameters': {'nrows': 5, 'ncols': 6, 'body_subsurf_level': 0}}))
+    assert autotune.main([str(overrides), '--db', runs, '--budget', '1h', '--json']) == 0
+    report = json.loads(capsys.readouterr().out)
+    assert report['runs'] == 24
+    assert report['chosen']['settings'] == {'body_subsurf_level': 3, 'relaxed_mesh': True}
+    assert autotune.main([str(overrides), '--db', runs, '--budget', '1s']) == 1
@@ -0,0 +1,55 @@
+"""clearance's oriented box test and its verdict on known layouts."""
+
+import numpy as np
+import pytest
+
+import clearance
+import key_layout
+
+
+def pair_overlap(offset, turn: float = 0, axis: str = 'Z') -> float:
+    """Penetration of two 2 x 2 x 2 boxes, the second moved by offset and turned about axis."""
+    centers = np.array([[0, 0, 0], offset], dtype=float)
+    axes = np.stack([np.eye(3), key_layout.rotation(axis, turn)[:3, :3]])
+    return float(clearance.box_overlaps(centers, axes, np.ones((2, 3)), np.array([0]), np.array([1]))[0])
+
+
+def test_touching_boxes_are_clear():
+    assert pair_overlap([2, 0, 0]) == pytest.approx(0, abs=1e-12)
+    assert pair_overlap([2, 2, 0]) == pytest.approx(0, abs=1e-12)
+
+
+def test_separated_boxes_report_the_gap():
+    assert pair_overlap([3, 0, 0]) == pytest.approx(-1)
+    assert pair_overlap([0, 0, -2.5]) == pytest.approx(-0.5)
+
+
+def test_rotated_boxes_overlap_where_aligned_ones_do_not():
+    # Turned 45 degrees, the second box reaches sqrt(2) toward the first
+    assert pair_overlap([2.3, 0, 0]) == pytest.approx(-0.3)
+    assert pair_overlap([2.3, 0, 0], np.pi / 4) == pytest.approx(np.sqrt(2) - 1.3)
+    assert pair_overlap([2.3, 0.5, 0], np.pi / 4, 'Y') > 0
+
+
+def test_edge_axis_separates_crossed_boxes():
+    # Stacked edge on edge, crossed: every face axis overlaps, the cross product of the edges (z) separates them
+    centers = np.array([[0, 0, 0], [0, 0, 3]], dtype=float)
+    axes = np.stack([key_layout.rotation('X', np.pi / 4)[:3, :3], key_layout.rotation('Y', np.pi / 4)[:3, :3]])
+    overlap = clearance.box_overlaps(centers, axes, np.ones((2, 3)), np.array([0]), np.array([1]))[0]
+    assert overlap == pytest.approx(2 * np.sqrt(2) - 3)
+
+
+def test_default_margin_tolerates_the_default_layout():
+    assert clearance.default_margin < 0
+    parameters = key_layout.resolve_parameters({})
+    assert clearance.check_clearance(parameters) == []
+    # Without the margin the neighbouring envelopes overlap by about 0.12 mm, less than it allows
+    touching = clearance.check_clearance(parameters, margin=0)
+    assert touching and all(0 < depth < -clearance.default_margin for _, _, depth in touching)
+
+
+def test_cramped_rows_collide():
+    collisions = clearance.check_clearance(key_layout.resolve_parameters({'extra_height': -2}))
+    assert ((0, 0), (0, 1)) in [(first, second) for first, second, _ in collisions]
+    assert collisions[0][2] == pytest.approx(2.15, abs=0.01)
+    assert [depth for _, _, depth in collisions] == sorted((depth for _, _, depth in collisions), reverse=True)
@@ -0,0 +1,31 @@
+"""Parameter overrides reach the generator's code unchanged."""
+
+import ast
+
+import key_layout
+
+
+def test_no_parameter_is_reassigned_after_the_override_hook():
+    # A later plain assignment would silently drop a job's override; `name = name or default` keeps it
+    parameters = {}
+    exec(key_layout.generator_parameter_source(), {'pi': 0, 'radians': abs, 'sin': abs, 'cos': abs}, parameters)
+    with open(key_layout.GENERATOR) as handle:
+        source = handle.read()
+    hook = source[:source.index("## Parameter Overrides ##")].count('\n') + 1
+    reassigned = []
+    for node in ast.parse(source).body:
+        if node.lineno < hook or not isinstance(node, (ast.Assign, ast.AugAssign, ast.AnnAssign)):
+            continue
+        names = {name.id for target in getattr(node, 'targets', [getattr(node, 'target', None)]) for name in ast.walk(target) if isinstance(name, ast.Name)}
+        reads = {name.id for name in ast.walk(node.value) if isinstance(name, ast.Name)} if node.value else set()
+        reassigned += [(node.lineno, name) for name in names & set(parameters) if name not in reads]
+    assert reassigned == []
+
+
+def test_cache_settings_are_parameters():
+    # Declared before the hook, so the test above covers them
+    overrides = {'use_punch_cache': True, 'punch_cache_dir': '/tmp/punch', 'punch_cache_size_limit': 64,
+                 'use_template_library': False, 'template_library_dir': '/tmp/templates'}
+    assert set(overrides) <= set(key_layout.resolve_parameters({}))
+    parameters = key_layout.resolve_parameters(overrides)
+    assert {name: parameters[name] for name in overrides} == overrides
@@ -0,0 +1,88 @@
+"""run_history's store and queries on a temporary database of synthetic runs."""
+
+import json
+import sqlite3
+import time
+
+import pytest
+
+import run_history
+
+
+def synthetic_run(started: float, total, layout: str = "5x6+6 subsurf 1", status: str = 'ok', **parameters) -> dict:
+    stages = [("Initializing", 1.0, None), ("Punch out Switch Locations", None if total is None else total - 2, {'key': 0.5}), ("DONE", None, None)]
+    return {'started': started, 'host': 'builder', 'layout': layout, 'parameters': dict({'body_subsurf_level': 1}, **parameters),
+            'status': status, 'total': total, 'retries': 1, 'polycount': {'body': {'vertices': 8, 'faces': 6}}, 'stages': stages}
+
+
+@pytest.fixture
+def history(tmp_path):
+    path = str(tmp_path / 'history' / 'run_history.sqlite')
+    now = time.time()
+    for day, total in enumerate([10, 11, 12, 13, 14, 30]):
+        run_history.record_run(path, synthetic_run(now - (6 - day) * 86400, total))
+    run_history.record_run(path, synthetic_run(now - 3600, 20, layout="6x7+6 subsurf 2", body_subsurf_level=2))
+    run_history.record_run(path, synthetic_run(now - 1800, 5, status='error'))
+    return path
+
+
+def test_schema_and_stored_rows(history):
+    connection = sqlite3.connect(history)
+    tables = {name: [column[1] for column in connection.execute("PRAGMA table_info({})".format(name))] for name in ['runs', 'stages']}
+    assert tables == {'runs': ['id', 'started', 'host', 'layout', 'parameter_hash', 'parameters', 'status', 'total', 'retries', 'polycount', 'error'],
+                      'stages': ['run', 'position', 'stage', 'seconds', 'steps']}
+    parameters, parameter_hash = connection.execute("SELECT parameters, parameter_hash FROM runs WHERE id = 1").fetchone()
+    assert parameter_hash == run_history.parameter_hash(json.loads(parameters))
+    assert connection.execute("SELECT position, stage, seconds, steps FROM stages WHERE run = 1 ORDER BY position").fetchall() == \
+        [(0, "Initializing", 1.0, None), (1, "Punch out Switch Locations", 8.0, '{"key": 0.5}'), (2, "DONE", None, None)]
+    connection.close()
+    # Opening it again keeps the rows
+    run_history.open_run_history(history).close()
+    assert len(run_history.load_runs(history)) == 8
+
+
+def test_recent_runs_are_the_last_successful_ones(history):
+    runs = run_history.recent_runs(history, "5x6+6 subsurf 1", 3)
+    assert [run['stages']["Punch out Switch Locations"] for run in runs] == [11, 12, 28]
+    assert runs[0]['order'] == ["Initializing", "Punch out Switch Locations", "DONE"]
+    assert runs[0]['steps'] == {"Punch out Switch Locations": {'key': 0.5}}
+    assert run_history.recent_runs(history + '.missing', "5x6+6 subsurf 1", 3) == []
+
+
+def test_selection(history):
+    assert len(run_history.load_runs(history, layout="5x6")) == 7
+    assert len(run_history.load_runs(history, days=2.5)) == 4
+    assert [run['total'] for run in run_history.load_runs(history, where={'body_subsurf_level': 2})] == [20]
+    assert run_history.load_runs(history, host='elsewhere') == []
+
+
+def test_percentiles_skip_failed_runs(history):
+    runs = run_history.load_runs(history, layout="5x6")
+    assert run_history.percentile(runs, 50) == {'runs': 6, 'stage': 'total', 'q': 50, 'seconds': 12.5, 'median': 12.5}
+    punch_out = run_history.percentile(runs, 100, "PUNCH")
+    assert (punch_out['runs'], punch_out['seconds'], punch_out['median']) == (6, 28, 10.5)
+
+
+def test_slow_runs(history):
+    runs = run_history.load_runs(history)
+    slow = run_history.slow_runs(runs, 1.5)
+    assert [(entry['seconds'], entry['median'], entry['ratio']) for entry in slow] == [(30, 12.5, 2.4)]
+    # The 6x7 layout has a single run, fewer than min_runs to compare against
+    assert "6x7+6 subsurf 2" not in [entry['layout'] for entry in run_history.slow_runs(runs, 0.5)]
+    assert "6x7+6 subsurf 2" in [entry['layout'] for entry in run_history.slow_runs(runs, 0.5, min_runs=1)]
+    assert run_history.slow_runs(runs, 3) == []
+
+
+def test_summary_counts_forked_variants_by_their_stages(history):
+    run_history.record_run(history, synthetic_run(time.time() - 60, None, layout="6x7+6 subsurf 2", body_subsurf_level=2))
+    rows = {row['layout']: row for row in run_history.summary(run_history.load_runs(history), days=7)}
+    assert (rows["5x6+6 subsurf 1"]['runs'], rows["5x6+6 subsurf 1"]['failures'], rows["5x6+6 subsurf 1"]['retries']) == (7, 1, 7)
+    assert rows["5x6+6 subsurf 1"]['p50'] == 12.5
+    # The forked run has no total and adds its one timed stage (Initializing) to the build time
+    assert (rows["6x7+6 subsurf 2"]['p50'], rows["6x7+6 subsurf 2"]['seconds_per_day']) == (20, pytest.approx(21 / 7))
+
+
+def test_slow_exit_status(history, capsys):
+    assert run_history.main(['slow', '--db', history]) == 1
+    assert "1 slow runs" in capsys.readouterr().out
+    assert run_history.main(['slow', '--db', history, '--factor', '3']) == 0
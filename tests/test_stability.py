@@ -0,0 +1,34 @@
+"""stability's floor check against the plate faces the generator builds."""
+
+import pytest
+
+import key_layout
+import stability
+
+
+def floor_errors(overrides: dict) -> list:
+    parameters = key_layout.resolve_parameters(overrides)
+    return [risk for risk in stability.floor_risks(parameters, key_layout.key_frames(parameters)) if risk['severity'] == 'error']
+
+
+@pytest.mark.parametrize('nrows', range(3, 8))
+@pytest.mark.parametrize('ncols', range(4, 8))
+def test_grids_stay_above_the_floor(nrows, ncols):
+    assert floor_errors({'nrows': nrows, 'ncols': ncols}) == []
+
+
+def test_thumb_plate_is_lifted_twice():
+    # The lowest thumb plate corner is 1.92 above the cut at the default keyboard_z_offset of 9
+    assert floor_errors({'keyboard_z_offset': 4.2}) == []
+    errors = floor_errors({'keyboard_z_offset': 3.8})
+    assert [risk['keys'] for risk in errors] == [[(None, 1)]]
+    assert "z = -3.3," in errors[0]['detail']
+
+
+def test_plate_corners_match_the_floor_check():
+    parameters = key_layout.resolve_parameters({})
+    layout = key_layout.key_frames(parameters)
+    for vertex in [('finger', 0, 0), ('finger', 11, 7), ('thumb', 0, 0), ('thumb', 1, 3)]:
+        _, key, local = stability.plate_corner(parameters, layout, vertex)
+        half, height = stability.plate_face(parameters, layout, key)
+        assert list(map(abs, local)) == pytest.approx([half[0], half[1], height])
@@ -0,0 +1,76 @@
+"""stl_mesh on a written unit cube and an open box."""
+
+import numpy as np
+import pytest
+
+import stl_mesh
+
+
+# Outward-wound triangles of the unit cube [0, 1]^3, the two z = 1 ones last
+cube_triangles = np.array([
+    [[0, 0, 0], [0, 1, 0], [1, 1, 0]], [[0, 0, 0], [1, 1, 0], [1, 0, 0]],
+    [[0, 0, 0], [1, 0, 0], [1, 0, 1]], [[0, 0, 0], [1, 0, 1], [0, 0, 1]],
+    [[1, 0, 0], [1, 1, 0], [1, 1, 1]], [[1, 0, 0], [1, 1, 1], [1, 0, 1]],
+    [[1, 1, 0], [0, 1, 0], [0, 1, 1]], [[1, 1, 0], [0, 1, 1], [1, 1, 1]],
+    [[0, 1, 0], [0, 0, 0], [0, 0, 1]], [[0, 1, 0], [0, 0, 1], [0, 1, 1]],
+    [[0, 0, 1], [1, 0, 1], [1, 1, 1]], [[0, 0, 1], [1, 1, 1], [0, 1, 1]]], dtype=np.float32)
+
+
+def write_stl(path, corners) -> str:
+    records = np.zeros(len(corners), dtype=stl_mesh.record_dtype)
+    records['vertices'] = corners
+    with open(path, 'wb') as handle:
+        handle.write(b'\0' * 80 + np.uint32(len(records)).tobytes() + records.tobytes())
+    return str(path)
+
+
+def test_unit_cube(tmp_path):
+    records = stl_mesh.load(write_stl(tmp_path / 'cube.stl', cube_triangles))
+    assert len(records) == 12
+    assert stl_mesh.volume(records) == pytest.approx(1)
+    assert stl_mesh.surface_area(records) == pytest.approx(6)
+    assert stl_mesh.bounding_box(records).tolist() == [[0, 0, 0], [1, 1, 1]]
+    vertices, faces = stl_mesh.weld(records)
+    assert len(vertices) == 8 and faces.shape == (12, 3)
+    edges = stl_mesh.edge_counts(faces)
+    assert edges == {'edges': 18, 'boundary': 0, 'non_manifold': 0, 'flipped': 0}
+    assert stl_mesh.closed(edges)
+    assert len(vertices) - edges['edges'] + len(faces) == 2
+
+
+def test_open_box(tmp_path):
+    records = stl_mesh.load(write_stl(tmp_path / 'box.stl', cube_triangles[:-2]))
+    # The missing lid would add a third: its face is 1 from the origin, 1 / 3 * area * distance
+    assert stl_mesh.volume(records) == pytest.approx(2 / 3)
+    vertices, faces = stl_mesh.weld(records)
+    edges = stl_mesh.edge_counts(faces)
+    assert edges['boundary'] == 4 and edges['edges'] == 17
+    assert not stl_mesh.closed(edges)
+
+
+def test_flipped_triangle_is_not_closed(tmp_path):
+    corners = cube_triangles.copy()
+    corners[0] = corners[0, ::-1]
+    vertices, faces = stl_mesh.weld(stl_mesh.load(write_stl(tmp_path / 'flipped.stl', corners)))
+    edges = stl_mesh.edge_counts(faces)
+    assert edges['boundary'] == 0 and edges['flipped'] > 0
+    assert not stl_mesh.watertight(faces)
+
+
+def test_weld_tolerance_joins_nearby_corners(tmp_path):
+    corners = cube_triangles + np.random.default_rng(0).uniform(-1e-5, 1e-5, cube_triangles.shape).astype(np.float32)
+    records = stl_mesh.load(write_stl(tmp_path / 'jittered.stl', corners))
+    assert len(stl_mesh.weld(records)[0]) == 36
+    vertices, faces = stl_mesh.weld(records, tolerance=1e-3)
+    assert len(vertices) == 8 and stl_mesh.watertight(faces)
+
+
+def test_load_rejects_files_that_are_not_binary_stl(tmp_path):
+    short = tmp_path / 'short.stl'
+    short.write_bytes(b'solid cube\n')
+    with pytest.raises(ValueError, match="too short"):
+        stl_mesh.load(str(short))
+    ascii_stl = tmp_path / 'ascii.stl'
+    ascii_stl.write_bytes(b'solid cube\n' + b' ' * 100 + b'\nendsolid cube\n')
+    with pytest.raises(ValueError, match="ASCII"):
+        stl_mesh.load(str(ascii_stl))
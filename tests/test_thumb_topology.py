@@ -0,0 +1,86 @@
+"""thumb_topology on thumb clusters of 3 to 7 keys, taken from the default th_layout."""
+
+import collections
+from math import radians
+
+import numpy as np
+import pytest
+
+import key_layout
+import stability
+
+
+parameters = key_layout.resolve_parameters({})
+default_layout = parameters['th_layout']
+
+
+def thumbs(layout: list) -> dict:
+    return key_layout.thumb_topology(dict(parameters, th_layout=layout))
+
+
+def beside(thumb: int, columns: int) -> list:
+    """A copy of a default thumb key moved sideways by whole key widths in its own frame."""
+    angles, offset = default_layout[thumb][:2]
+    rotation = key_layout.rotation('Z', radians(angles[2])) @ key_layout.rotation('Y', radians(angles[1])) @ \
+               key_layout.rotation('X', radians(angles[0]))
+    return [angles, tuple(np.array(offset) + rotation[:3, :3] @ [columns * key_layout.mount_width, 0, 0])] + default_layout[thumb][2:]
+
+
+def assert_plate(topology: dict):
+    """Every edge on at most two faces, and the open ones close into a single boundary loop."""
+    edges = collections.Counter()
+    for face in topology['faces'] + topology['corrections']:
+        edges.update(frozenset(edge) for edge in zip(face, face[1:] + face[:1]))
+    assert max(edges.values()) <= 2
+    neighbours = collections.defaultdict(set)
+    for edge, count in edges.items():
+        if count == 1:
+            a, b = edge
+            neighbours[a].add(b)
+            neighbours[b].add(a)
+    assert all(len(linked) == 2 for linked in neighbours.values())
+    start = next(iter(neighbours))
+    previous, vertex, length = None, start, 0
+    while length == 0 or vertex != start:
+        previous, vertex = vertex, min(neighbours[vertex] - {previous})
+        length += 1
+    assert length == len(neighbours)
+
+
+@pytest.mark.parametrize('keys, heights', [
+    ((0, 2, 4), [1, 1, 1]),
+    ((1, 3, 5), [1, 1, 1]),
+    ((0, 1, 2, 4), [2, 1, 1]),
+    ((0, 2, 3, 5), [1, 2, 1]),
+    ((0, 2, 4, 5), [1, 1, 1, 1]),
+    ((0, 1, 2, 3, 4), [2, 2, 1]),
+    ((0, 1, 2, 4, 5), [2, 1, 1, 1]),
+    ((1, 2, 3, 4, 5), [1, 2, 1, 1]),
+    ((0, 1, 2, 3, 4, 5), [2, 2, 1, 1]),
+])
+def test_subsets_of_the_default_cluster(keys, heights):
+    topology = thumbs([default_layout[key] for key in keys])
+    assert topology['heights'] == heights
+    assert sorted(topology['keys'].values()) == list(range(len(keys)))
+    assert_plate(topology)
+
+
+def test_default_slots():
+    topology = thumbs(default_layout)
+    assert topology['slots'] == [(0, 0), (0, 1), (1, 0), (1, 1), (2, 0), (3, 0)]
+
+
+def test_seventh_key_opens_a_column():
+    topology = thumbs(default_layout + [beside(5, 1)])
+    assert topology['heights'] == [2, 2, 1, 1, 1]
+    assert topology['slots'][6] == (4, 0)
+    assert_plate(topology)
+
+
+@pytest.mark.parametrize('keys', [(0, 1, 2), (2, 3, 5), (0, 1, 2, 3)])
+def test_two_column_clusters_are_rejected(keys):
+    layout = [default_layout[key] for key in keys]
+    with pytest.raises(ValueError, match="2 columns"):
+        thumbs(layout)
+    report = stability.risk_report(dict(parameters, th_layout=layout))
+    assert [risk['check'] for risk in report['risks']] == ['thumb_topology']
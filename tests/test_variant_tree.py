@@ -0,0 +1,54 @@
+"""variant_tree's branch points and the timings of its forked variants."""
+
+import json
+import os
+import time
+import types
+
+import pytest
+
+import variant_tree
+import worker
+
+
+def test_bottom_thickness_forks_after_the_punch_outs():
+    stages, first_read = variant_tree.generator_stages()
+    jobs = [{'id': thickness, 'parameters': {'bottom_thickness': thickness}} for thickness in (3, 4)]
+    tree = variant_tree.plan(jobs, [variant_tree.resolve_job(job) for job in jobs], stages, first_read)
+    assert stages[tree['stage']] == "Form Loligagger Port"
+    assert tree['stage'] > stages.index("Punch out Switch Locations")
+    assert tree['branches'] == [{'job': 0}, {'job': 1}]
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason="variant_tree forks")
+def test_forked_variants_only_time_their_own_stages(tmp_path):
+    # Stage b reads bottom_thickness; one branch at a time, so the second one waits for the first
+    seconds = {'a': 0.3, 'b': 0.1, 'DONE': 0.1}
+    jobs = [{'id': thickness, 'parameters': {'bottom_thickness': thickness}} for thickness in (3, 4)]
+    resolved = [job['parameters'] for job in jobs]
+    runner = variant_tree.TreeRunner(jobs, resolved, list(seconds), parallel=1)
+    runner.node = variant_tree.plan(jobs, resolved, list(seconds), {'bottom_thickness': 1})
+    runner.started = time.time()
+    namespace = {'start_time': runner.started, 'stage_log': [], 'run_parameters': {},
+                 'progress': types.SimpleNamespace(signature='layout')}
+    try:
+        for name in seconds:
+            runner.stage_hook(name, namespace)
+            namespace['stage_log'].append({'stage': name, 'start': time.time() - namespace['start_time']})
+            time.sleep(seconds[name])
+        total = time.time() - runner.started
+        record = {'bottom_thickness': namespace['bottom_thickness'], 'total': total,
+                  'stages': worker.stage_durations(namespace['stage_log'], time.time() - namespace['start_time'])}
+        (tmp_path / "{}.json".format(namespace['bottom_thickness'])).write_text(json.dumps(record))
+    except variant_tree.BranchDone:
+        pass
+    finally:
+        if runner.child:
+            os._exit(0)
+    for thickness in (3, 4):
+        record = json.loads((tmp_path / "{}.json".format(thickness)).read_text())
+        assert record['bottom_thickness'] == thickness
+        assert record['total'] == pytest.approx(0.2, abs=0.08)
+        assert [stage['stage'] for stage in record['stages']] == ['a', 'b', 'DONE']
+        assert [stage.get('shared', False) for stage in record['stages']] == [True, False, False]
+        assert [stage['seconds'] for stage in record['stages']] == pytest.approx([0.3, 0.1, 0.1], abs=0.08)
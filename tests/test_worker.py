@@ -0,0 +1,52 @@
+"""The worker's spool claims and socket protocol, without running a generation."""
+
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+
+import pytest
+
+import worker
+
+
+def dead_pid() -> int:
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+@pytest.mark.skipif(os.name == 'nt', reason="claims are only checked on POSIX")
+def test_claims_of_exited_workers_are_requeued(tmp_path):
+    directories = worker.spool_directories(str(tmp_path))
+    for claim in ['a.json.' + str(dead_pid()), 'b.json.' + str(os.getpid()), 'c.progress.jsonl']:
+        (tmp_path / 'working' / claim).write_text('{}')
+    assert worker.requeue_stale_claims(directories) == ['a.json']
+    assert sorted(os.listdir(directories['incoming'])) == ['a.json']
+    assert sorted(os.listdir(directories['working'])) == ['b.json.' + str(os.getpid()), 'c.progress.jsonl']
+
+
+def test_invalid_socket_lines_get_an_error_result():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    server = threading.Thread(target=worker.serve_socket, args=(port,), daemon=True)
+    server.start()
+    for attempt in range(100):
+        try:
+            connection = socket.create_connection(('127.0.0.1', port))
+            break
+        except ConnectionRefusedError:
+            server.join(0.05)
+    with connection, connection.makefile('rw') as stream:
+        for line in ['{"id": ', '[1, 2]']:
+            stream.write(line + '\n')
+            stream.flush()
+            result = json.loads(stream.readline())
+            assert result['status'] == 'error' and result['error'].startswith("invalid job line")
+        stream.write('{"command": "stop"}\n')
+        stream.flush()
+    server.join(5)
+    assert not server.is_alive()